@@ -50,39 +50,18 @@
 get_ipython().magic(u'matplotlib inline')
 
 import xml.etree.cElementTree as ET
-from collections import defaultdict
-import re
 import pprint
-from operator import itemgetter
-from difflib import get_close_matches
 
-#For export to csv and data validation
-import csv
-import codecs
-import cerberus
-
-#For reverse geocoding
-from geopy.geocoders import GoogleV3
-geolocator = GoogleV3()
-from geopy.exc import GeocoderTimedOut
+#The functions of the stages are imported from the wrangle_osm package in the
+#cells below, the same code as the command line (python -m wrangle_osm)
 
 
 # In[2]:
 
 #OSM downloaded from openstreetmap
 SG_OSM = '../Helper/Singapore.osm'
-#The following .csv files will be used for data extraction from the XML.
-NODES_PATH = "../Helper/nodes.csv"
-NODE_TAGS_PATH = "../Helper/nodes_tags.csv"
-WAYS_PATH = "../Helper/ways.csv"
-WAY_NODES_PATH = "../Helper/ways_nodes.csv"
-WAY_TAGS_PATH = "../Helper/ways_tags.csv"
-
-
-# In[3]:
-
-#Regular expressions
-PROBLEMCHARS = re.compile(r'[=\+/&<>;\'\"\?%#$@\,\.\t\r\n]')
+#The directory of the .csv files extracted from the XML.
+CSV_DIR = "../Helper"
 
 
 # In[4]:
@@ -161,54 +140,12 @@ root = tree.getroot()
 
 # In[7]:
 
-def chk_for_street(element):
-    '''Extracts adrresses from elements.
-    
-    Args:
-        element (element): An element of the XML tree
-        
-    Returns:
-        str: If the element has an address it returns it as a string , otherwise it returns nothing.
-        
-    '''
-    highway_types = [
-        'living_street', 'motorway', 'primary', 'residential', 'secondary',
-        'tertiary'
-    ]
-    tag = element.find("./tag[@k='addr:street']")
-    if tag is None:
-        if element.tag == 'way':
-            tag = element.find("./tag[@k='highway']")
-            try:
-                if tag.get('v') in highway_types:
-                    return element.find("./tag[@k='name']")
-            except AttributeError:
-                return
-    else:
-        return tag
-    return
+from wrangle_osm.audit import chk_for_street
 
 
 # In[8]:
 
-def get_street_names(tree):
-    '''Creates a dictionary for all elements in a given tree.
-    
-    Args:
-        tree (ElementTree): An ElementTree object for which I want to find the street names
-        
-    Returns
-        dict: A dictionary with the following stracture: {element_id:street_name}
-        
-    '''
-    result = {}
-    for path in ["./node", "./way"]:
-        for element in tree.findall(path):
-            try:
-                result[element.get('id')] = chk_for_street(element).get('v')
-            except (AttributeError):  #chk_for_street() returns nothing
-                continue
-    return result
+from wrangle_osm.audit import get_street_names
 
 
 # In[9]:
@@ -229,7 +166,7 @@ pprint.pprint(dict(street_names.items()[:10]))
 
 # In[11]:
 
-st_types_re = re.compile(r'[a-zA-Z]+[^0-9]\b\.?')
+from wrangle_osm.audit import st_types_re
 
 
 # The result will be a dictionary with the format: *{street_type:(list_of_street_names)}*  
@@ -237,31 +174,12 @@ st_types_re = re.compile(r'[a-zA-Z]+[^0-9]\b\.?')
 
 # In[12]:
 
-def audit_st_types(streets):
-    '''Extracts the "street type" part from an address
-    
-    Args:
-        streets (dict): A dictionary containing street names in the form of {element_id:street_name}
-        
-    Returns:
-        dict: A dictionary of street types in the form of 
-        {street_type:(street_name_1,street_name_2,...,street_name_n)}
-    
-    '''
-    result = defaultdict(set)
-    for key, value in streets.iteritems():
-        try:
-            street_type = st_types_re.findall(value)[-1].strip()
-        except (IndexError):  #One word or empty street names
-            PROBLEMATICS.append((key, 'street name', value))
-        result[street_type].add(value)
-
-    return result
+from wrangle_osm.audit import audit_st_types
 
 
 # In[13]:
 
-streets = audit_st_types(street_names)
+streets = audit_st_types(street_names, PROBLEMATICS)
 #Sample of the dictionary
 pprint.pprint(dict(streets.items()[:7]))
 
@@ -270,22 +188,7 @@ pprint.pprint(dict(streets.items()[:7]))
 
 # In[14]:
 
-def sort_street_types(street_types):
-    '''Counts the number of appearances of each street type and sorts them.
-    
-    Args:
-        street_types (dict): A dictionary of street types in the form of 
-        {street_type:(street_name_1,street_name_2,...,street_name_n)}
-        
-    Returns:
-        list: A sorted list of tupples where each tupple includes a 
-        street type and the number of occurences in the dataset.
-    '''
-    result = []
-    for key, value in street_types.iteritems():
-        result.append((key, len(value)))
-        result = sorted(list(result), key=itemgetter(1), reverse=True)
-    return result
+from wrangle_osm.audit import sort_street_types
 
 
 # In[15]:
@@ -297,23 +200,7 @@ street_types[:15]
 
 # In[16]:
 
-def populate_expected(street_types, threshold):
-    '''Populates the Expected list
-    
-    Args:
-        street_types (list): A sorted list of (street_type, #_of_appearances).
-        threshold (int): The number of the top elements I want to put in the "expected" list.
-        
-    Returns:
-        list: Returns a list of the x most frequent street types (x defined by "threshold)
-    
-     '''
-    
-    expected = []
-    for i in street_types[:threshold]:
-        expected.append(i[0])
-
-    return expected
+from wrangle_osm.audit import populate_expected
 
 
 # In[17]:
@@ -326,19 +213,7 @@ EXPECTED
 
 # In[18]:
 
-def find_abbreviations(expected, data):
-    """Uses get_close_matces() to find similar text
-    
-    Args:
-        expected (list): A list of the expected street types.
-        data (list): A list of all the different street types.
-        
-    Retturns: nothing
-        
-    """
-    
-    for i in expected:
-        print i, get_close_matches(i, data, 4, 0.5)
+from wrangle_osm.audit import find_abbreviations
 
 
 # In[19]:
@@ -350,72 +225,13 @@ find_abbreviations(EXPECTED, list(streets.keys()))
 
 # In[20]:
 
-mapping = {
-    'road': 'Road',
-    'Rd': 'Road',
-    'street': 'Street',
-    'Ave': 'Avenue',
-    'Avebue': 'Avenue',
-    'Aenue': 'Avenue',
-    'park': 'Park',
-    'walk': 'Walk',
-    'link': 'Link',
-    'Cresent': 'Crescent',
-    'Terrance': 'Terrace',
-    'Ter': 'Terrace'
-}
+from wrangle_osm.audit import mapping
+mapping
 
 
 # In[21]:
 
-def update_street_type(tree):
-    '''Corrects the dataset's street name according to the mapping
-    
-    Args:
-        tree (ElementTree): An ElementTree object for which I want to clean the street names
-    
-    Returns: nothing
-           
-    '''
-    changes = {}
-    for path in ["./node", "./way"]:  #"elements" do not have street names.
-        for element in tree.findall(path):
-            try:
-                tag = chk_for_street(element)
-                street_name = tag.get('v')
-            except (AttributeError
-                    ):  #In case element doen't have "street name" attribute
-                continue
-            try:
-                street_type = st_types_re.findall(street_name)[-1].strip()
-            except (IndexError):
-                #Leaves the problematic street names as is.
-                #They are already in the PROBLEMATICS list.
-                street_type = street_name
-
-            if street_type in mapping:
-                tag.attrib['v'] = tag.attrib['v'].replace(street_type,
-                                                          mapping[street_type])
-
-                if street_name not in changes:
-                    changes[street_name] = [tag.attrib['v'], 1]
-                else:
-                    changes[street_name][1] += 1
-    counter = 0
-    for key, value in changes.iteritems():
-        counter += value[1]
-        if value[1] == 1:
-            print key + ' ==> ' + value[0]
-        else:
-            print key + ' ==> ' + value[0] + " " + "(" + str(value[
-                1]) + " occurrences" + ")"
-    print str(counter) + " street names were fixed"
-    update_street_type.called = True #Function attribute to track if a function has been called.
-
-
-# In[22]:
-
-update_street_type.called = False
+from wrangle_osm.audit import update_street_type
 
 
 # In[23]:
@@ -430,37 +246,12 @@ update_street_type(root)
 
 # In[24]:
 
-def fix_pcodes():
-    """Tries to find an integer between 01 and 80, excluding 74 in the postcode field and
-    if needed change the field value accordingly
-    
-    Args: No args
-    
-    Returns: Nothing
-    """
-    postcode_re = re.compile(
-        r'(([0-6][0-9])|(7([0-3]|[5-9]))|80)[0-9]{4}')# all integers between 01 and 80, excluding 74 
-    for element in root.findall(".//*[@k='addr:postcode']/.."):
-        tag = element.find("./*[@k='addr:postcode']")
-        postcode = tag.attrib['v']
-        try:
-            new_tag = postcode_re.search(postcode).group(0)
-            if new_tag != postcode:
-                tag.attrib['v'] = postcode_re.search(postcode).group(0)
-                print postcode + ' ==> ' + tag.attrib['v']
-        except (AttributeError):  # If you cannot extract a valid postcode, add the element to PROBLEMATICS
-            PROBLEMATICS.append((element.get('id'), 'postcode', postcode))
-    fix_pcodes.called = True #Function attribute to track if a function has been called.
-
-
-# In[25]:
-
-fix_pcodes.called = False
+from wrangle_osm.audit import fix_pcodes
 
 
 # In[26]:
 
-fix_pcodes()
+fix_pcodes(root, PROBLEMATICS)
 
 
 # Postcodes were much more consistent than the street types with 3 problems fixed programmati-
@@ -478,242 +269,38 @@ fix_pcodes()
 
 # In[27]:
 
-SCHEMA = {
-    'node': {
-        'type': 'dict',
-        'schema': {
-            'id': {'required': True, 'type': 'integer', 'coerce': int},
-            'lat': {'required': True, 'type': 'float', 'coerce': float},
-            'lon': {'required': True, 'type': 'float', 'coerce': float},
-            'user': {'required': True, 'type': 'string'},
-            'uid': {'required': True, 'type': 'integer', 'coerce': int},
-            'version': {'required': True, 'type': 'string'},
-            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
-            'timestamp': {'required': True, 'type': 'string'}
-        }
-    },
-    'node_tags': {
-        'type': 'list',
-        'schema': {
-            'type': 'dict',
-            'schema': {
-                'id': {'required': True, 'type': 'integer', 'coerce': int},
-                'key': {'required': True, 'type': 'string'},
-                'value': {'required': True, 'type': 'string'},
-                'type': {'required': True, 'type': 'string'}
-            }
-        }
-    },
-    'way': {
-        'type': 'dict',
-        'schema': {
-            'id': {'required': True, 'type': 'integer', 'coerce': int},
-            'user': {'required': True, 'type': 'string'},
-            'uid': {'required': True, 'type': 'integer', 'coerce': int},
-            'version': {'required': True, 'type': 'string'},
-            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
-            'timestamp': {'required': True, 'type': 'string'}
-        }
-    },
-    'way_nodes': {
-        'type': 'list',
-        'schema': {
-            'type': 'dict',
-            'schema': {
-                'id': {'required': True, 'type': 'integer', 'coerce': int},
-                'node_id': {'required': True, 'type': 'integer', 'coerce': int},
-                'position': {'required': True, 'type': 'integer', 'coerce': int}
-            }
-        }
-    },
-    'way_tags': {
-        'type': 'list',
-        'schema': {
-            'type': 'dict',
-            'schema': {
-                'id': {'required': True, 'type': 'integer', 'coerce': int},
-                'key': {'required': True, 'type': 'string'},
-                'value': {'required': True, 'type': 'string'},
-                'type': {'required': True, 'type': 'string'}
-            }
-        }
-    }
-}
+from wrangle_osm.export import SCHEMA
 
 
 # In[28]:
 
-NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
-NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
-WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
-WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
-WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+from wrangle_osm.export import (NODE_FIELDS, NODE_TAGS_FIELDS, WAY_FIELDS,
+                                 WAY_TAGS_FIELDS, WAY_NODES_FIELDS)
 
 
 # In[29]:
 
-def shape_element(element):
-    """Clean and shape node or way XML element to Python dict
-    
-    Arrgs:
-        element (element): An element of the XML tree
-        
-    Returns:
-        dict: if element is a node, the node's attributes and tags.
-              if element is a way, the ways attributes and tags along with the nodes that form the way.
-    """
-    node_attribs = {}
-    way_attribs = {}
-    way_nodes = []
-    tags = [
-    ]  # Handle secondary tags the same way for both node and way elements
-    if element.tag == 'node':
-        node_attribs['id'] = element.get('id')
-        node_attribs['lat'] = element.get('lat')
-        node_attribs['lon'] = element.get('lon')
-        node_attribs['user'] = element.get('user')
-        node_attribs['uid'] = element.get('uid')
-        node_attribs['version'] = element.get('version')
-        node_attribs['changeset'] = element.get('changeset')
-        node_attribs['timestamp'] = element.get('timestamp')
-        for child in element:
-            if child.tag == 'tag':
-                tag = {'id': node_attribs['id']}
-                k = child.get('k')
-                if not PROBLEMCHARS.search(k):
-                    k = k.split(':', 1)
-                    tag['key'] = k[-1]
-                    tag['value'] = child.get('v')
-                    if len(k) == 1:
-                        tag['type'] = 'regular'
-                    elif len(k) == 2:
-                        tag['type'] = k[0]
-                tags.append(tag)
-        return {'node': node_attribs, 'node_tags': tags}
-    elif element.tag == 'way':
-        counter = 0
-        way_attribs['id'] = element.get('id')
-        way_attribs['user'] = element.get('user')
-        way_attribs['uid'] = element.get('uid')
-        way_attribs['version'] = element.get('version')
-        way_attribs['changeset'] = element.get('changeset')
-        way_attribs['timestamp'] = element.get('timestamp')
-        for child in element:
-            if child.tag == 'tag':
-                tag = {'id': way_attribs['id']}
-                k = child.get('k')
-                if not PROBLEMCHARS.search(k):
-                    k = k.split(':', 1)
-                    tag['key'] = k[-1]
-                    tag['value'] = child.get('v')
-                    if len(k) == 1:
-                        tag['type'] = 'regular'
-                    elif len(k) == 2:
-                        tag['type'] = k[0]
-                tags.append(tag)
-            if child.tag == 'nd':
-                nd = {'id': way_attribs['id']}
-                nd['node_id'] = child.get('ref')
-                nd['position'] = counter
-                way_nodes.append(nd)
-            counter += 1
-        return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+from wrangle_osm.export import shape_element
 
 
 # In[30]:
 
-def validate_element(element, validator, schema=SCHEMA):
-    """Raise ValidationError if element does not match schema
-    
-    Args:
-        element (element): An element of the tree
-        validator (cerberus.validator): a validator
-        schema (dict): The schema to validate element against.
-        
-    Returns:
-        Nothing
-        
-        """
-    if validator.validate(element, schema) is not True:
-        field, errors = next(validator.errors.iteritems())
-        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
-        error_string = pprint.pformat(errors)
-
-        raise Exception(message_string.format(field, error_string))
+from wrangle_osm.export import validate_element
 
 
 # In[31]:
 
-class UnicodeDictWriter(csv.DictWriter, object):
-    """Extend csv.DictWriter to handle Unicode input"""
-
-    def writerow(self, row):
-        super(UnicodeDictWriter, self).writerow({
-            k: (v.encode('utf-8') if isinstance(v, unicode) else v)
-            for k, v in row.iteritems()
-        })
-
-    def writerows(self, rows):
-        for row in rows:
-            self.writerow(row)
+from wrangle_osm.export import UnicodeDictWriter
 
 
 # In[32]:
 
-def process_map(validate=True):
-    """Iteratively process each XML element and write to csv(s)
-    
-    Arrgs:
-        validate (bool): Validate the data before write them to csv or not
-        
-    Returns:
-        Nothing
-    """
-
-    with codecs.open(NODES_PATH, 'w') as nodes_file,          codecs.open(NODE_TAGS_PATH, 'w') as nodes_tags_file,          codecs.open(WAYS_PATH, 'w') as ways_file,          codecs.open(WAY_NODES_PATH, 'w') as way_nodes_file,          codecs.open(WAY_TAGS_PATH, 'w') as way_tags_file:
-
-        nodes_writer = UnicodeDictWriter(nodes_file, NODE_FIELDS)
-        node_tags_writer = UnicodeDictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
-        ways_writer = UnicodeDictWriter(ways_file, WAY_FIELDS)
-        way_nodes_writer = UnicodeDictWriter(way_nodes_file, WAY_NODES_FIELDS)
-        way_tags_writer = UnicodeDictWriter(way_tags_file, WAY_TAGS_FIELDS)
-
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
-
-        validator = cerberus.Validator()
-        
-        #Check that the dataset has been cleared
-        if update_street_type.called is not True:
-            update_street_type(root)
-            
-        if fix_pcodes.called is not True:
-            fix_pcodes()            
-
-        for element in root.findall("./*"):
-            el = shape_element(element)
-            if el:
-                if validate is True:
-                    #try:
-                    validate_element(el, validator)
-                    #except:
-                    #    print element.get('id')
-
-                if element.tag == 'node':
-                    nodes_writer.writerow(el['node'])
-                    node_tags_writer.writerows(el['node_tags'])
-                elif element.tag == 'way':
-                    ways_writer.writerow(el['way'])
-                    way_nodes_writer.writerows(el['way_nodes'])
-                    way_tags_writer.writerows(el['way_tags'])
+from wrangle_osm.export import process_map
 
 
 # In[33]:
 
-process_map()
+process_map(root, CSV_DIR)
 
 
 # ### Connection to the database
@@ -851,25 +438,22 @@ get_element_tags(PROBLEMATICS[5][0])
 
 # In[96]:
 
+from wrangle_osm.enrich import GeopyBackend
+
+
 def complete_address(address):
     """
     Tries to find the full address from part of the address (e.g. without the postcode)
-    
+
     Args:
         address(str): Partial address
-        
+
     Returns:
         (str): Full address
-    
+
     """
-    while True:  #Retry the call in case of GeocoderTimedOut error
-        try:
-            location = geolocator.geocode(address)
-            #coordinates = str(coord[0]) + "," + str(coord[1])
-            print location.raw['formatted_address']
-        except GeocoderTimedOut:
-            continue
-        break
+    location = GeopyBackend()(address)  #Retries on GeocoderTimedOut
+    print location['address'] if location else None
 
 
 # In[66]:
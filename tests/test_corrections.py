@@ -0,0 +1,140 @@
+"""The correction rules give the same tables in the stream and in the database.
+
+The database part needs psycopg2 and a PostgreSQL database, given by the
+WRANGLE_OSM_TEST_DSN variable (the tables are created in a transaction that is
+rolled back), and is skipped without it:
+
+    WRANGLE_OSM_TEST_DSN=postgresql://localhost/test python -m pytest tests
+"""
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+from wrangle_osm.corrections import Corrections, Rule, apply_sql
+from wrangle_osm.export import PY2, iter_top_level, open_csv, process_map
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE = os.path.join(ROOT, 'sample.osm')
+
+#Rules matching elements of sample.osm, next to the ones of corrections.json
+SAMPLE_RULES = [
+    {'action': 'set_value', 'element': 'way', 'ids': [96826153],
+     'key': 'street', 'to': 'Henderson Rd'},
+    {'action': 'rename_key', 'element': 'node', 'ids': [3038816607],
+     'key': 'postcode', 'value': '150163', 'to': 'housenumber'},
+    {'action': 'remap_value', 'element': '*', 'key': 'created_by',
+     'value': 'JOSM', 'to': 'josm'},
+    {'action': 'delete_tag', 'element': 'node', 'ids': [3100404287],
+     'key': 'postcode'},
+    {'action': 'add_tag', 'element': 'node', 'ids': [2402563788, 1],
+     'key': 'brand', 'to': 'Kopitiam'},
+    {'action': 'delete_element', 'element': 'node', 'key': 'operator',
+     'value': 'Golden Village'},
+    {'action': 'delete_element', 'element': 'way', 'ids': [96826154]},
+]
+
+#Columns compared, as text
+QUERIES = [
+    ('nodes.csv', 'SELECT id::text FROM public.nodes', ['id']),
+    ('nodes_tags.csv', 'SELECT id::text, key, value, type FROM public.nodes_tags',
+     ['id', 'key', 'value', 'type']),
+    ('ways.csv', 'SELECT id::text FROM public.ways', ['id']),
+    ('ways_nodes.csv', 'SELECT id::text, node_id::text, position::text '
+     'FROM public.ways_nodes', ['id', 'node_id', 'position']),
+    ('ways_tags.csv', 'SELECT id::text, key, value, type FROM public.ways_tags',
+     ['id', 'key', 'value', 'type']),
+]
+
+
+def _rules():
+    with open(os.path.join(ROOT, 'corrections.json')) as rules_file:
+        return json.load(rules_file)['rules'] + SAMPLE_RULES
+
+
+def _read_rows(path, columns):
+    with (open(path, 'rb') if PY2 else open_csv(path, 'r')) as csv_file:
+        return sorted(tuple(row[c] for c in columns)
+                      for row in csv.DictReader(csv_file))
+
+
+class RuleTest(unittest.TestCase):
+
+    def test_tag_actions_need_a_key(self):
+        for action in ('rename_key', 'set_value', 'add_tag'):
+            with self.assertRaises(ValueError):
+                Rule(action, 'node', ids=[1], to='X')
+
+    def test_rule_without_value_conflicts_with_any_value(self):
+        rules = [{'action': 'set_value', 'element': 'node', 'ids': [1],
+                  'key': 'postcode', 'to': '1'},
+                 {'action': 'set_value', 'element': 'node', 'ids': [1],
+                  'key': 'postcode', 'value': '2', 'to': '3'}]
+        with self.assertRaises(ValueError):
+            Corrections(rules)
+        with self.assertRaises(ValueError):
+            Corrections(rules[::-1])
+        Corrections([rules[1], dict(rules[1], value='4')])
+
+    def test_rule_without_key_conflicts_with_any_key(self):
+        rule = {'action': 'remap_value', 'element': '*', 'value': 'Posb',
+                'to': 'POSB'}
+        for other in ({'key': 'name'}, {'key': 'name', 'to': 'DBS'},
+                      {'element': 'node', 'to': 'OCBC'}):
+            rules = [rule, dict(rule, **other)]
+            with self.assertRaises(ValueError):
+                Corrections(rules)
+            with self.assertRaises(ValueError):
+                Corrections(rules[::-1])
+        Corrections([rule, dict(rule, key='name', value='DBS')])
+        Corrections([dict(rule, key='name'), dict(rule, key='brand')])
+
+
+@unittest.skipUnless(psycopg2 and os.environ.get('WRANGLE_OSM_TEST_DSN'),
+                     'needs psycopg2 and WRANGLE_OSM_TEST_DSN')
+class StreamAndDatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _export(self, name, corrections=None):
+        out_dir = os.path.join(self.tmp_dir, name)
+        os.makedirs(out_dir)
+        process_map(iter_top_level(SAMPLE), out_dir, validate=False,
+                    corrections=corrections)
+        return out_dir
+
+    def test_same_tables(self):
+        from wrangle_osm import db
+        streamed = self._export('streamed', Corrections(_rules()))
+        plain = self._export('plain')
+
+        conn = psycopg2.connect(os.environ['WRANGLE_OSM_TEST_DSN'])
+        try:
+            with conn.cursor() as cursor:
+                db.create_tables(cursor)
+                db.load_csvs(cursor, plain)
+                self.assertTrue(sum(apply_sql(cursor, Corrections(_rules()))))
+                for filename, query, columns in QUERIES:
+                    cursor.execute(query)
+                    self.assertEqual(
+                        sorted(cursor.fetchall()),
+                        _read_rows(os.path.join(streamed, filename), columns),
+                        filename)
+        finally:
+            conn.rollback()
+            conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""Geocoding of the problem addresses against the local stub server."""
+import unittest
+
+from wrangle_osm.enrich import (HttpBackend, RateLimiter, StubServer, enrich,
+                                geocode_all)
+from wrangle_osm.instrument import clock
+
+USER_AGENT = 'wrangle_osm tests'
+
+ADDRESSES = {
+    '6 Sago Street, Singapore': {
+        'display_name': '6 Sago Street, Chinatown, Singapore 059011',
+        'lat': '1.2812', 'lon': '103.8443',
+        'address': {'postcode': '059011'}},
+    '80 Rhu Cross, Singapore': {
+        'display_name': '80 Rhu Cross, Singapore 437437',
+        'lat': '1.2964', 'lon': '103.8873',
+        'address': {'postcode': 'S437437'}},
+    '279 New Bridge Road, Singapore': {
+        'display_name': '279 New Bridge Road, Singapore',
+        'lat': '1.2825', 'lon': '103.8440', 'address': {}},
+}
+
+#(problem, tags) pairs, like Database.review()
+REVIEW = [
+    (('3756813987', 'postcode', '59011'),
+     [('Node', 3756813987, 'housenumber', '6', 'addr'),
+      ('Node', 3756813987, 'street', 'Sago Street', 'addr'),
+      ('Node', 3756813987, 'postcode', '59011', 'addr')]),
+    #A second problem of the same element
+    (('3756813987', 'street name', 'Sago Street'),
+     [('Node', 3756813987, 'housenumber', '6', 'addr'),
+      ('Node', 3756813987, 'street', 'Sago Street', 'addr'),
+      ('Node', 3756813987, 'postcode', '59011', 'addr')]),
+    (('23946435', 'postcode', '#01-38'),
+     [('Way', 23946435, 'housenumber', '80', 'addr'),
+      ('Way', 23946435, 'street', 'Rhu Cross', 'addr')]),
+    #Found, but without a postcode
+    (('4496749591', 'postcode', 'Singapore'),
+     [('Node', 4496749591, 'housenumber', '279', 'addr'),
+      ('Node', 4496749591, 'street', 'New Bridge Road', 'addr')]),
+    #Not found
+    (('1318498347', 'postcode', '135'),
+     [('Node', 1318498347, 'street', 'Jln Pelatina', 'addr')]),
+]
+
+
+class EnrichTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(ADDRESSES).start()
+        self.backend = HttpBackend(self.server.url, USER_AGENT)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_suggested_rules(self):
+        rules = enrich(REVIEW, self.backend, workers=4, rate=None)
+        self.assertEqual(
+            [dict((k, v) for k, v in rule.items() if k != 'note')
+             for rule in rules],
+            [{'action': 'set_value', 'element': 'node', 'ids': [3756813987],
+              'key': 'postcode', 'to': '059011'},
+             {'action': 'add_tag', 'element': 'way', 'ids': [23946435],
+              'key': 'postcode', 'to': '437437', 'type': 'addr'}])
+        #Every distinct address is requested once, with the User-Agent
+        self.assertEqual(sorted(r[0] for r in self.server.requests),
+                         sorted(list(ADDRESSES) + ['Jln Pelatina, Singapore']))
+        self.assertEqual(set(r[1] for r in self.server.requests), {USER_AGENT})
+
+    def test_rate_limit(self):
+        rate = 20.0
+        geocode_all(sorted(ADDRESSES) * 2 + ['a', 'b', 'c'], self.backend,
+                    workers=4, rate=rate)
+        times = sorted(r[2] for r in self.server.requests)
+        self.assertEqual(len(times), 6)
+        #Some slack for the scheduling of the threads
+        for earlier, later in zip(times, times[1:]):
+            self.assertGreater(later - earlier, 0.8 / rate)
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(50.0)
+        start = clock()
+        for _ in range(6):
+            limiter.wait()
+        self.assertGreaterEqual(clock() - start, 5 / 50.0 * 0.9)
+
+    def test_user_agent_required(self):
+        with self.assertRaises(ValueError):
+            HttpBackend(self.server.url, '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1 @@
+"""Helpers for wrangling OpenStreetMap extracts outside of the notebook."""
@@ -0,0 +1,5 @@
+import sys
+
+from wrangle_osm.cli import main
+
+sys.exit(main())
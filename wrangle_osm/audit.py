@@ -0,0 +1,274 @@
+"""Auditing and cleaning of street names and postcodes.
+
+The functions of the notebook, without the module level side effects, so the
+notebook, the command line and the benchmarks share them. The problem records
+are appended to the list (or ProblemStore) given by the caller.
+"""
+from __future__ import print_function
+
+import re
+from collections import defaultdict
+from difflib import get_close_matches
+from operator import itemgetter
+
+HIGHWAY_TYPES = [
+    'living_street', 'motorway', 'primary', 'residential', 'secondary',
+    'tertiary'
+]
+
+#The last word of a street name that does not contain numbers
+st_types_re = re.compile(r'[a-zA-Z]+[^0-9]\b\.?')
+
+#The postal sectors of Singapore
+VALID_SECTORS = frozenset('%02d' % i for i in range(1, 81) if i != 74)
+#Every run of 6 digits, including the overlapping ones
+postcode_candidates_re = re.compile(r'(?=([0-9]{6}))')
+
+mapping = {
+    'road': 'Road',
+    'Rd': 'Road',
+    'street': 'Street',
+    'Ave': 'Avenue',
+    'Avebue': 'Avenue',
+    'Aenue': 'Avenue',
+    'park': 'Park',
+    'walk': 'Walk',
+    'link': 'Link',
+    'Cresent': 'Crescent',
+    'Terrance': 'Terrace',
+    'Ter': 'Terrace'
+}
+
+
+# ### Street Types
+
+
+def chk_for_street(element):
+    '''Extracts adrresses from elements.
+
+    Args:
+        element (element): An element of the XML tree
+
+    Returns:
+        element: The tag holding the street name, otherwise it returns nothing.
+
+    '''
+    tag = element.find("./tag[@k='addr:street']")
+    if tag is None:
+        if element.tag == 'way':
+            tag = element.find("./tag[@k='highway']")
+            try:
+                if tag.get('v') in HIGHWAY_TYPES:
+                    return element.find("./tag[@k='name']")
+            except AttributeError:
+                return
+    else:
+        return tag
+    return
+
+
+def get_street_names(tree):
+    '''Creates a dictionary for all elements in a given tree.
+
+    Args:
+        tree (ElementTree): An ElementTree object for which I want to find the street names
+
+    Returns
+        dict: A dictionary with the following stracture: {element_id:street_name}
+
+    '''
+    result = {}
+    for path in ["./node", "./way"]:
+        for element in tree.findall(path):
+            try:
+                result[element.get('id')] = chk_for_street(element).get('v')
+            except (AttributeError):  #chk_for_street() returns nothing
+                continue
+    return result
+
+
+def audit_st_types(streets, problematics):
+    '''Extracts the "street type" part from an address
+
+    Args:
+        streets (dict): A dictionary containing street names in the form of {element_id:street_name}
+        problematics (list): Where to save the street names that need further
+            attention, e.g. the PROBLEMATICS of the notebook or a ProblemStore.
+
+    Returns:
+        dict: A dictionary of street types in the form of
+        {street_type:(street_name_1,street_name_2,...,street_name_n)}
+
+    '''
+    result = defaultdict(set)
+    for key, value in streets.items():
+        try:
+            street_type = st_types_re.findall(value)[-1].strip()
+        except (IndexError):  #One word or empty street names
+            problematics.append((key, 'street name', value))
+            street_type = value
+        result[street_type].add(value)
+
+    return result
+
+
+def sort_street_types(street_types):
+    '''Counts the number of appearances of each street type and sorts them.
+
+    Args:
+        street_types (dict): A dictionary of street types in the form of
+        {street_type:(street_name_1,street_name_2,...,street_name_n)}
+
+    Returns:
+        list: A sorted list of tupples where each tupple includes a
+        street type and the number of occurences in the dataset.
+    '''
+    result = [(key, len(value)) for key, value in street_types.items()]
+    return sorted(result, key=itemgetter(1), reverse=True)
+
+
+def populate_expected(street_types, threshold):
+    '''Populates the Expected list
+
+    Args:
+        street_types (list): A sorted list of (street_type, #_of_appearances).
+        threshold (int): The number of the top elements I want to put in the "expected" list.
+
+    Returns:
+        list: Returns a list of the x most frequent street types (x defined by "threshold)
+
+     '''
+    return [i[0] for i in street_types[:threshold]]
+
+
+def find_abbreviations(expected, data):
+    """Uses get_close_matces() to find similar text
+
+    Args:
+        expected (list): A list of the expected street types.
+        data (list): A list of all the different street types.
+
+    Retturns: nothing
+
+    """
+    for i in expected:
+        print(i, get_close_matches(i, data, 4, 0.5))
+
+
+def update_street_type(tree, verbose=True):
+    '''Corrects the dataset's street name according to the mapping
+
+    Args:
+        tree (ElementTree): An ElementTree object for which I want to clean the street names
+        verbose (bool): Print every change
+
+    Returns:
+        dict: The changes in the form of {old_street_name: [new_street_name, occurrences]}
+
+    '''
+    changes = {}
+    for path in ["./node", "./way"]:  #"elements" do not have street names.
+        for element in tree.findall(path):
+            try:
+                tag = chk_for_street(element)
+                street_name = tag.get('v')
+            except (AttributeError
+                    ):  #In case element doen't have "street name" attribute
+                continue
+            try:
+                street_type = st_types_re.findall(street_name)[-1].strip()
+            except (IndexError):
+                #Leaves the problematic street names as is.
+                #audit_st_types() already reported them.
+                street_type = street_name
+
+            if street_type in mapping:
+                tag.attrib['v'] = tag.attrib['v'].replace(street_type,
+                                                          mapping[street_type])
+
+                if street_name not in changes:
+                    changes[street_name] = [tag.attrib['v'], 1]
+                else:
+                    changes[street_name][1] += 1
+    if verbose:
+        counter = 0
+        for key, value in changes.items():
+            counter += value[1]
+            if value[1] == 1:
+                print(key + ' ==> ' + value[0])
+            else:
+                print(key + ' ==> ' + value[0] + " (" + str(value[1]) +
+                      " occurrences)")
+        print(str(counter) + " street names were fixed")
+    update_street_type.called = True  #Function attribute to track if a function has been called.
+    return changes
+
+
+update_street_type.called = False
+
+
+# ### Postcodes
+
+
+def normalize_postcode(postcode):
+    """Extracts the first valid postcode: 6 digits starting with a sector
+    in VALID_SECTORS.
+
+    Returns:
+        str: The postcode, or None if there is none.
+    """
+    for candidate in postcode_candidates_re.findall(postcode):
+        if candidate[:2] in VALID_SECTORS:
+            return candidate
+    return None
+
+
+def normalize_postcodes(postcodes):
+    """Normalizes a batch of postcodes, e.g. the values of a column.
+
+    Every distinct value is normalized once, so the cost depends on the number
+    of distinct values rather than on the number of elements.
+
+    Args:
+        postcodes (list): The raw values.
+
+    Returns:
+        list: The normalized postcodes (None where there is none), in the
+        order of postcodes.
+    """
+    normalized = dict((p, normalize_postcode(p)) for p in set(postcodes))
+    return [normalized[p] for p in postcodes]
+
+
+def fix_pcodes(tree, problematics, verbose=True):
+    """Tries to find an integer between 01 and 80, excluding 74 in the postcode field and
+    if needed change the field value accordingly
+
+    Args:
+        tree (ElementTree): An ElementTree object for which I want to clean the postcodes
+        problematics (list): Where to save the postcodes that cannot be fixed,
+            like in audit_st_types().
+        verbose (bool): Print every change
+
+    Returns:
+        dict: The changes in the form of {old_postcode: new_postcode}
+    """
+    elements = tree.findall(".//*[@k='addr:postcode']/..")
+    tags = [element.find("./*[@k='addr:postcode']") for element in elements]
+    postcodes = [tag.attrib['v'] for tag in tags]
+    changes = {}
+    log = []  #Printed at once
+    for element, tag, postcode, normalized in zip(
+            elements, tags, postcodes, normalize_postcodes(postcodes)):
+        if normalized is None:  # If you cannot extract a valid postcode, add the element to problematics
+            problematics.append((element.get('id'), 'postcode', postcode))
+        elif normalized != postcode:
+            tag.attrib['v'] = changes[postcode] = normalized
+            log.append(postcode + ' ==> ' + normalized)
+    if verbose and log:
+        print('\n'.join(log))
+    fix_pcodes.called = True  #Function attribute to track if a function has been called.
+    return changes
+
+
+fix_pcodes.called = False
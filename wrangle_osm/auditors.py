@@ -0,0 +1,387 @@
+"""Auditing of any tag in a single pass, in bounded memory.
+
+The notebook audits the street names and the postcodes, each with its own pass
+over the whole tree. Here every field has an auditor, registered by name:
+
+    @register('phone')
+    class PhoneAuditor(Auditor):
+        keys = ('phone', 'contact:phone')
+
+        def check(self, value, tags):
+            ...  #Returns None, or the problem of the value
+
+An AuditRun feeds the elements of one parse to many auditors, either on its
+own (audit_osm()) or next to the export (process_map(consumers=[run])). Each
+auditor counts the values and problems in sketches whose size does not depend
+on the size of the file: a count-min sketch for the frequencies and a top-k
+list of the heavy hitters, plus the first few problematic elements as examples.
+
+    python -m wrangle_osm.auditors sample.osm --fields phone,postcode
+"""
+from __future__ import print_function, division
+
+import argparse
+import re
+import sys
+import zlib
+from collections import OrderedDict
+
+from wrangle_osm.audit import (HIGHWAY_TYPES, mapping, normalize_postcode,
+                               st_types_re)
+
+#name: Auditor subclass
+AUDITORS = OrderedDict()
+
+
+def register(name):
+    """Class decorator adding an auditor to AUDITORS."""
+    def decorator(cls):
+        cls.name = name
+        AUDITORS[name] = cls
+        return cls
+    return decorator
+
+
+# ### Sketches
+
+
+def _hashes(item):
+    """Two independent 32 bit hashes of a string, stable across processes
+    (unlike hash())."""
+    if not isinstance(item, bytes):
+        item = item.encode('utf-8')
+    return zlib.crc32(item) & 0xffffffff, zlib.adler32(item) & 0xffffffff
+
+
+class CountMinSketch(object):
+    """Approximate frequencies of a stream in width * depth counters.
+
+    The estimates are never lower than the true counts, and higher by at most
+    2 * total / width with probability 1 - 1 / 2**depth.
+    """
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def _cells(self, item):
+        h1, h2 = _hashes(item)
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, item, count=1):
+        """Adds an item and returns its new estimate."""
+        self.total += count
+        estimate = None
+        for row, cell in zip(self.rows, self._cells(item)):
+            row[cell] += count
+            if estimate is None or row[cell] < estimate:
+                estimate = row[cell]
+        return estimate
+
+    def estimate(self, item):
+        return min(row[cell] for row, cell in zip(self.rows, self._cells(item)))
+
+
+class TopK(object):
+    """The k most frequent items of a stream.
+
+    The frequencies are estimated by a CountMinSketch, and only the k items
+    with the highest estimates so far are kept.
+    """
+
+    def __init__(self, k=20, width=2048, depth=4):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.items = {}
+        self._min = None  #(estimate, item) with the lowest estimate of items
+
+    def add(self, item, count=1):
+        estimate = self.sketch.add(item, count)
+        if item in self.items:
+            self.items[item] = estimate
+            if self._min is not None and self._min[1] == item:
+                self._min = None
+        elif len(self.items) < self.k:
+            self.items[item] = estimate
+            self._min = None
+        else:
+            if self._min is None:
+                self._min = min((v, i) for i, v in self.items.items())
+            if estimate > self._min[0]:
+                del self.items[self._min[1]]
+                self.items[item] = estimate
+                self._min = None
+
+    def most_common(self, n=None):
+        """Returns [(item, estimated count), ...], the most frequent first."""
+        result = sorted(self.items.items(), key=lambda i: (-i[1], i[0]))
+        return result[:n]
+
+
+# ### Auditors
+
+
+class Auditor(object):
+    """Audits the values of some tag keys.
+
+    Subclasses set keys and override check().
+
+    Args:
+        k (int): The number of values and problems to keep in the top-k lists.
+        examples (int): The number of problematic elements to keep.
+        problematics (list): Where to save every problematic element, as
+            (element_id, field, value, problem) records, e.g. a ProblemStore
+            (see wrangle_osm.problems).
+    """
+
+    name = None
+    keys = ()
+
+    def __init__(self, k=20, examples=20, problematics=None):
+        self.problematics = problematics
+        self.values = TopK(k)
+        self.problems = TopK(k)
+        self.problem_values = TopK(k)
+        self.examples = []
+        self.max_examples = examples
+        self.count = 0
+        self.problem_count = 0
+
+    def check(self, value, tags):
+        """Returns the problem of a value (a short description used as
+        category), or None if it looks fine.
+
+        Args:
+            value (str): The value of one of the keys.
+            tags (dict): All the tags of the element, {key: value}.
+        """
+        return None
+
+    def values_of(self, tags):
+        """The values to audit among the tags of an element."""
+        return [tags[key] for key in self.keys if key in tags]
+
+    def audit(self, element_id, tags):
+        for value in self.values_of(tags):
+            self.count += 1
+            self.values.add(value)
+            problem = self.check(value, tags)
+            if problem is not None:
+                self.problem_count += 1
+                self.problems.add(problem)
+                self.problem_values.add(value)
+                if len(self.examples) < self.max_examples:
+                    self.examples.append((element_id, self.name, value))
+                if self.problematics is not None:
+                    self.problematics.append((element_id, self.name, value,
+                                              problem))
+
+    def report(self, n=10, stream=None):
+        stream = stream or sys.stdout
+        print('%s: %d values, %d problems' % (self.name, self.count,
+                                              self.problem_count), file=stream)
+        for title, top in [('values', self.values),
+                           ('problems', self.problems),
+                           ('problematic values', self.problem_values)]:
+            common = top.most_common(n)
+            if common:
+                print('  most common %s:' % title, file=stream)
+                for item, count in common:
+                    print('    %8d  %s' % (count, item), file=stream)
+
+
+class RegexAuditor(Auditor):
+    """Reports the values that do not fully match a pattern."""
+
+    pattern = None
+    problem = 'format'
+
+    def check(self, value, tags):
+        if self.pattern.match(value) is None:
+            return self.problem
+
+
+@register('street')
+class StreetAuditor(Auditor):
+    """The street types of the addresses and highway names, like
+    audit_st_types()."""
+
+    keys = ('addr:street', )
+
+    def values_of(self, tags):
+        if 'addr:street' in tags:
+            return [tags['addr:street']]
+        if tags.get('highway') in HIGHWAY_TYPES and 'name' in tags:
+            return [tags['name']]
+        return []
+
+    def check(self, value, tags):
+        types = st_types_re.findall(value)
+        if not types:
+            return 'no street type'
+        if types[-1].strip() in mapping:
+            return 'abbreviation: %s' % types[-1].strip()
+
+
+@register('postcode')
+class PostcodeAuditor(Auditor):
+    """Postcodes that fix_pcodes() would change or cannot fix."""
+
+    keys = ('addr:postcode', )
+
+    def check(self, value, tags):
+        postcode = normalize_postcode(value)
+        if postcode is None:
+            return 'invalid'
+        if postcode != value:
+            return 'extra characters'
+
+
+@register('phone')
+class PhoneAuditor(Auditor):
+    """Singapore numbers: +65 and 8 digits, starting with 3, 6, 8 or 9."""
+
+    keys = ('phone', 'contact:phone', 'fax')
+    formatted = re.compile(r'^\+65 [3689]\d{3} \d{4}$')
+
+    def check(self, value, tags):
+        for number in value.split(';'):
+            number = number.strip()
+            if self.formatted.match(number):
+                continue
+            digits = re.sub(r'\D', '', number)
+            if len(digits) == 8 and digits[0] in '3689':
+                return 'missing country code'
+            if len(digits) == 10 and digits.startswith('65') and \
+                    digits[2] in '3689':
+                return 'format'
+            if digits.startswith('1800') and len(digits) in (10, 11):
+                continue  #Toll free
+            return 'invalid'
+
+
+_HOURS = r'\d\d:\d\d-\d\d:\d\d\+?(,\d\d:\d\d-\d\d:\d\d\+?)*'
+_DAYS = r'(Mo|Tu|We|Th|Fr|Sa|Su|PH)(-(Mo|Tu|We|Th|Fr|Sa|Su))?'
+_RULE = r'(%s(,%s)*( %s| off| closed)?|%s)' % (_DAYS, _DAYS, _HOURS, _HOURS)
+
+
+@register('opening_hours')
+class OpeningHoursAuditor(RegexAuditor):
+    """A common subset of the opening_hours syntax, e.g.
+    'Mo-Fr 08:00-17:00; Sa 09:00-12:00'."""
+
+    keys = ('opening_hours', )
+    pattern = re.compile(r'^(24/7|%s(; ?%s)*)$' % (_RULE, _RULE))
+    problem = 'syntax'
+
+
+@register('operator')
+class OperatorAuditor(Auditor):
+    """Operators and brands, whose spelling should be consistent (e.g. Posb
+    and POSB)."""
+
+    keys = ('operator', 'brand')
+    #Spellings remembered to find the case variants
+    max_spellings = 10000
+
+    def __init__(self, *args, **kwargs):
+        super(OperatorAuditor, self).__init__(*args, **kwargs)
+        self.spellings = {}
+
+    def check(self, value, tags):
+        if value != value.strip() or '  ' in value:
+            return 'whitespace'
+        if value.islower():
+            return 'lowercase'
+        spelling = self.spellings.get(value.lower())
+        if spelling is None and len(self.spellings) < self.max_spellings:
+            self.spellings[value.lower()] = value
+        elif spelling is not None and spelling != value:
+            return 'case variant of %s' % spelling
+
+
+@register('cuisine')
+class CuisineAuditor(RegexAuditor):
+    """Lowercase values separated by semicolons, e.g. 'chinese;noodle'."""
+
+    keys = ('cuisine', )
+    pattern = re.compile(r'^[a-z_]+(;[a-z_]+)*$')
+    problem = 'not lowercase_with_underscores;separated'
+
+
+@register('housenumber')
+class HousenumberAuditor(RegexAuditor):
+    """Numbers with an optional letter, or blocks like 'Blk 123A'."""
+
+    keys = ('addr:housenumber', )
+    pattern = re.compile(r'^(Blk )?\d+[A-Z]?(-\d+[A-Z]?)?$')
+    problem = 'not a number'
+
+
+class AuditRun(object):
+    """Feeds the elements of a parse to many auditors.
+
+    The run is a callable, so it can be one of the consumers of process_map().
+
+    Args:
+        names (list): The names of the auditors, all of AUDITORS by default.
+        **kwargs: Passed to the auditors.
+    """
+
+    def __init__(self, names=None, **kwargs):
+        self.auditors = [AUDITORS[name](**kwargs)
+                         for name in (names or list(AUDITORS))]
+        self.elements = 0
+
+    def __call__(self, element):
+        if element.tag not in ('node', 'way'):
+            return
+        self.elements += 1
+        tags = dict((tag.get('k'), tag.get('v')) for tag in element.iter('tag'))
+        if not tags:
+            return
+        element_id = element.get('id')
+        for auditor in self.auditors:
+            auditor.audit(element_id, tags)
+
+    def problematics(self):
+        """The examples of every auditor, in the format of PROBLEMATICS:
+        [(element_id, field, value), ...]."""
+        return [example for auditor in self.auditors
+                for example in auditor.examples]
+
+    def report(self, n=10, stream=None):
+        for auditor in self.auditors:
+            auditor.report(n, stream)
+
+
+def audit_osm(path, names=None, **kwargs):
+    """Audits an .osm file in one streaming pass.
+
+    Returns:
+        AuditRun: The auditors, with their counts and sketches.
+    """
+    from wrangle_osm.export import iter_top_level
+    run = AuditRun(names, **kwargs)
+    for element in iter_top_level(path):
+        run(element)
+    return run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Audits the tags of an .osm file in one pass.')
+    parser.add_argument('path')
+    parser.add_argument('--fields', default=','.join(AUDITORS),
+                        help='Comma separated auditors (default: %(default)s)')
+    parser.add_argument('-n', type=int, default=10,
+                        help='Values and problems reported per auditor')
+    args = parser.parse_args(argv)
+    run = audit_osm(args.path, args.fields.split(','), k=max(args.n, 20))
+    run.report(args.n)
+
+
+if __name__ == '__main__':
+    main()
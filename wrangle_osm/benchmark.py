@@ -0,0 +1,299 @@
+"""Benchmarks of the pipeline stages.
+
+Every stage of the pipeline runs on sample.osm and on scaled-up copies of it,
+and elements/sec and the memory of the stage are reported per stage. The results
+are saved as JSON, so a run can be compared with the one of an older commit:
+
+    python -m wrangle_osm.benchmark sample.osm --scale 1 10 -o bench.json
+    python -m wrangle_osm.benchmark sample.osm --scale 1 10 --compare bench.json
+    python -m wrangle_osm.benchmark --synthetic 100MB 1GB -o bench.json
+
+The memory of a stage is traced with tracemalloc (Python 3): the peak of the
+memory it allocated, and the part still allocated when it returns. Tracing
+slows down the stages, so use --no-allocations for clean timings. The peak
+RSS is the one of the whole process since it started (it never goes down),
+reported for stages that run without tracing.
+"""
+from __future__ import division, print_function
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.cElementTree as ET
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:  #Windows
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:  #Python 2
+    tracemalloc = None
+
+from wrangle_osm import audit, export, synthetic
+from wrangle_osm.sample import parse_size
+
+ELEMENT_TYPES = ('node', 'way', 'relation')
+
+
+def peak_rss_kb():
+    '''The peak resident set size of the process since it started, in KB.'''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+@contextlib.contextmanager
+def _quiet():
+    '''Silences the prints of the cleaning functions.'''
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+def measure(func, count, allocations=True):
+    '''Runs a stage and measures it.
+
+    Args:
+        func (callable): The stage, called without arguments.
+        count (int): The number of elements the stage processes.
+        allocations (bool): Trace the allocations of the stage.
+
+    Returns:
+        tuple: (the return value of func, dict of measurements)
+    '''
+    tracing = allocations and tracemalloc is not None
+    if tracing:
+        tracemalloc.start()  #Traces only what the stage allocates
+    start = time.time()
+    with _quiet():
+        result = func()
+    seconds = time.time() - start
+    stats = {
+        'elements': count,
+        'seconds': seconds,
+        'elements_per_sec': count / seconds if seconds else None,
+        'process_peak_rss_kb': peak_rss_kb()
+    }
+    if tracing:
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats['peak_traced_kb'] = peak // 1024
+        stats['retained_kb'] = retained // 1024
+    return result, stats
+
+
+def run_stages(path, out_dir, allocations=True, validate=True):
+    '''Runs every stage of the pipeline on an .osm file.
+
+    The stages run in the order of the notebook, each one on the output of the
+    previous ones.
+
+    Returns:
+        dict: {stage_name: measurements}
+    '''
+    stats = OrderedDict()
+    tree, stats['parse'] = measure(lambda: ET.parse(path),
+                                   os.path.getsize(path), allocations)
+    stats['parse']['unit'] = 'bytes'
+    root = tree.getroot()
+    n_elements = sum(1 for e in root if e.tag in ELEMENT_TYPES)
+
+    street_names, stats['get_street_names'] = measure(
+        lambda: audit.get_street_names(root), n_elements, allocations)
+    _, stats['audit_st_types'] = measure(
+        lambda: audit.audit_st_types(street_names, []), len(street_names),
+        allocations)
+    _, stats['update_street_type'] = measure(
+        lambda: audit.update_street_type(root), n_elements, allocations)
+    _, stats['fix_pcodes'] = measure(lambda: audit.fix_pcodes(root, []),
+                                     n_elements, allocations)
+
+    shaped, stats['shape_element'] = measure(
+        lambda: [el for el in map(export.shape_element, root) if el],
+        n_elements, allocations)
+
+    if validate:
+        try:
+            import cerberus
+        except ImportError:
+            print('cerberus is not installed, skipping validate_element')
+        else:
+            validator = cerberus.Validator()
+            _, stats['validate_element'] = measure(
+                lambda: [export.validate_element(el, validator) for el in shaped],
+                len(shaped), allocations)
+
+    def write():
+        with export.CsvWriters(out_dir) as writers:
+            for el in shaped:
+                writers.write(el)
+
+    _, stats['csv_write'] = measure(write, len(shaped), allocations)
+    return stats
+
+
+def scale_osm(src, dst, factor):
+    '''Writes a synthetic .osm file with factor copies of every element.
+
+    The ids of every copy are shifted past the maximum id of the source (and so
+    are the node references of the ways), so the copies are valid, distinct
+    elements.
+
+    Args:
+        src (str): The .osm file to scale up.
+        dst (str): The file to write.
+        factor (int): The number of copies.
+    '''
+    max_id = 0
+    for _, element in ET.iterparse(src):
+        if element.tag in ELEMENT_TYPES:
+            max_id = max(max_id, int(element.get('id')))
+    offset = 10**len(str(max_id))
+
+    with open(dst, 'wb') as out:
+        out.write(b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                  b'<osm version="0.6" generator="wrangle_osm.benchmark">\n')
+        for copy in range(factor):
+            for _, element in ET.iterparse(src):
+                if element.tag not in ELEMENT_TYPES:
+                    continue
+                element.set('id', str(int(element.get('id')) + copy * offset))
+                for child in element:
+                    if child.get('ref') is not None:
+                        child.set('ref', str(int(child.get('ref')) + copy * offset))
+                element.tail = '\n'
+                out.write(ET.tostring(element, 'utf-8'))
+                element.clear()
+        out.write(b'</osm>\n')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(path, scales=(1, ), allocations=True, validate=True, synthetic_sizes=()):
+    '''Benchmarks the pipeline on an .osm file and on scaled-up copies of it.
+
+    Args:
+        path (str): The .osm file, None to run on synthetic data only.
+        scales (list): Scale factors of the copies of path.
+        allocations (bool): Trace the allocations of the stages.
+        validate (bool): Benchmark validate_element() too.
+        synthetic_sizes (list): Sizes (e.g. '100MB') of synthetic inputs
+            generated with wrangle_osm.synthetic.
+
+    Returns:
+        dict: The results, ready to be saved as JSON.
+    '''
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'inputs': []
+    }
+    inputs = []
+    if path is not None:
+        inputs.extend((path, scale) for scale in scales)
+    inputs.extend(('synthetic:%s' % size, 1) for size in synthetic_sizes)
+
+    tmp_dir = tempfile.mkdtemp(prefix='wrangle_osm_bench_')
+    try:
+        for name, scale in inputs:
+            input_path = os.path.join(tmp_dir, 'input.osm')
+            if name.startswith('synthetic:'):
+                with open(input_path, 'w') as out:
+                    synthetic.generate(out, parse_size(name.split(':', 1)[1]))
+            elif scale != 1:
+                scale_osm(name, input_path, scale)
+            else:
+                input_path = name
+            stages = run_stages(input_path, tmp_dir, allocations, validate)
+            results['inputs'].append({
+                'path': name,
+                'scale': scale,
+                'bytes': os.path.getsize(input_path),
+                'stages': stages
+            })
+            if input_path != name:
+                os.remove(input_path)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return results
+
+
+def print_results(results, baseline=None):
+    '''Prints a table of the results, with the change against a baseline.'''
+    old = {}
+    if baseline:
+        for entry in baseline['inputs']:
+            old[(entry['path'], entry['scale'])] = entry['stages']
+    for entry in results['inputs']:
+        print('\n%s x%d (%.1f MB)' % (entry['path'], entry['scale'],
+                                      entry['bytes'] / 1024**2))
+        for name, stats in entry['stages'].items():
+            line = '  %-20s %8.3fs %14.0f %s/sec' % (
+                name, stats['seconds'], stats['elements_per_sec'] or 0,
+                stats.get('unit', 'elements'))
+            if 'peak_traced_kb' in stats:
+                line += '  peak %d KB, retained %d KB' % (
+                    stats['peak_traced_kb'], stats['retained_kb'])
+            else:
+                line += '  process peak RSS %s KB' % stats['process_peak_rss_kb']
+            before = old.get((entry['path'], entry['scale']), {}).get(name)
+            if before and before['seconds']:
+                line += '  %+.1f%%' % (
+                    (stats['seconds'] / before['seconds'] - 1) * 100)
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages')
+    parser.add_argument('path', nargs='?',
+                        help='the .osm file (sample.osm without --synthetic)')
+    parser.add_argument('--scale', type=int, nargs='+', default=[1],
+                        help='scale factors of the copies of path')
+    parser.add_argument('--synthetic', nargs='+', default=[], metavar='SIZE',
+                        help='also run on generated inputs of these sizes')
+    parser.add_argument('-o', '--output', help='save the results as JSON')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='results of an earlier run to compare against')
+    parser.add_argument('--no-allocations', action='store_true')
+    parser.add_argument('--no-validate', action='store_true')
+    args = parser.parse_args(argv)
+
+    path = args.path
+    if path is None and not args.synthetic:
+        path = 'sample.osm'
+    results = run(path, args.scale, not args.no_allocations,
+                  not args.no_validate, args.synthetic)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as json_file:
+            baseline = json.load(json_file, object_pairs_hook=OrderedDict)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
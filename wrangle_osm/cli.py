@@ -0,0 +1,291 @@
+"""Command line interface of the pipeline.
+
+    python -m wrangle_osm audit Singapore.osm --problems problems.db
+    python -m wrangle_osm clean Singapore.osm cleaned.osm
+    python -m wrangle_osm export cleaned.osm csv/ --corrections corrections.json
+    python -m wrangle_osm load csv/ --dsn postgresql://localhost/Project_3 \\
+        --create --corrections corrections.json --rollups
+
+The subcommands import what they need when they run, so the startup does not
+pay for cerberus, psycopg2 or geopy. The tools of the other modules are
+available too (sample, synthetic, benchmark, analytics, scoring,
+dedup, diff).
+
+Exit status: 0 on success, 1 on errors (e.g. an invalid element with
+--strict, dangling references found by check, or differences found by diff),
+2 on usage errors. Errors of the input are reported in one line, with their
+traceback after --debug (python -m wrangle_osm --debug export ...); any other
+exception is a bug and always gets its traceback.
+"""
+from __future__ import print_function
+
+import argparse
+import importlib
+import sys
+import traceback
+
+#Tools of the other modules, run with their own arguments
+PASSTHROUGH = [
+    ('sample', 'sample an .osm file'),
+    ('synthetic', 'generate a synthetic extract'),
+    ('benchmark', 'benchmark the pipeline stages'),
+    ('analytics', 'contributor and daily statistics'),
+    ('scoring', 'walkability scores of candidate homes'),
+    ('dedup', 'duplicate points of interest'),
+    ('diff', 'differences between two sorted exports'),
+]
+
+#The errors of bad input (missing files, invalid data), reported in one line
+#unless --debug is given. Any other exception is a bug and keeps its traceback.
+EXPECTED_ERRORS = (EnvironmentError, ValueError)
+
+
+def iter_osm(path):
+    """Iterates over the top-level elements of an .osm or .pbf file.
+
+    path can be the file opened in binary mode.
+    """
+    if getattr(path, 'name', path).endswith('.pbf'):
+        from wrangle_osm.pbf import iter_elements
+        return iter_elements(path)
+    from wrangle_osm.export import iter_top_level
+    return iter_top_level(path)
+
+
+def _problem_store(path):
+    if path is None:
+        return None
+    from wrangle_osm.problems import ProblemStore
+    return ProblemStore(path)
+
+
+# ### Subcommands
+
+
+def audit(args):
+    from wrangle_osm.auditors import AuditRun
+    store = _problem_store(args.problems)
+    fields = args.fields.split(',') if args.fields else None
+    run = AuditRun(fields, k=max(args.n, 20), problematics=store)
+    for element in iter_osm(args.path):
+        run(element)
+    run.report(args.n)
+    if store is not None:
+        store.close()
+
+
+def clean(args):
+    from wrangle_osm import snapshot
+    snap = snapshot.load(args.path, args.cache_dir)
+    snap.write_osm(args.output)
+    print('%d street names and %d postcodes fixed, %d problems' % (
+        sum(n for _, n in snap.street_changes.values()),
+        len(snap.postcode_changes), len(snap.problematics)), file=sys.stderr)
+    store = _problem_store(args.problems)
+    if store is not None:
+        store.extend(snap.problematics)
+        store.close()
+
+
+def export(args):
+    import os
+    from wrangle_osm.export import process_map
+    from wrangle_osm.instrument import Instrumentation
+    kwargs = {}
+    if args.corrections:
+        from wrangle_osm.corrections import Corrections
+        kwargs['corrections'] = Corrections.load(args.corrections)
+    if args.audit:
+        from wrangle_osm.auditors import AuditRun
+        run = AuditRun()
+        kwargs['consumers'] = [run]
+    if args.dictionary:
+        from wrangle_osm.interning import StringTable
+        kwargs.update(strings=StringTable(), dictionary=True)
+    if args.tiles is not None:
+        from wrangle_osm.tiles import Quadkeys
+        kwargs['tiles'] = Quadkeys(args.tiles)
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    with open(args.path, 'rb') as osm_file:
+        #The number of elements is unknown, the ETA follows the bytes read
+        stats = Instrumentation(interval=args.progress,
+                                size=os.path.getsize(args.path),
+                                position=osm_file.tell)
+        process_map(iter_osm(osm_file), args.out_dir, validate=args.validate,
+                    strict=args.strict, instrumentation=stats, **kwargs)
+    stats.report()
+    if args.audit:
+        run.report()
+
+
+def check(args):
+    from wrangle_osm import integrity
+    report = integrity.check(args.csv_dir)
+    print('%d nodes, %d way nodes, %d dangling references in %d ways, '
+          '%d ways with less than two nodes' % (
+              report.nodes, report.way_nodes, report.dangling,
+              len(report.broken_ways), len(report.short_ways)),
+          file=sys.stderr)
+    if args.repair and report.dangling:
+        for filename, rows in sorted(integrity.repair(args.csv_dir,
+                                                      report).items()):
+            print('%s: %d rows dropped' % (filename, rows), file=sys.stderr)
+    elif report.dangling:
+        return 1
+
+
+def sort(args):
+    import os
+    from wrangle_osm import extsort
+    csv_dirs = args.csv_dirs
+    if len(csv_dirs) == 1 and os.path.exists(os.path.join(csv_dirs[0],
+                                                          'tiles.json')):
+        from wrangle_osm.tiles import read_manifest
+        csv_dirs = [os.path.join(csv_dirs[0], tile)
+                    for tile in read_manifest(csv_dirs[0])]
+        if args.output is None:
+            raise ValueError('Merging the tiles needs an output directory')
+    counts = extsort.sort_export(csv_dirs, args.output,
+                                 int(args.memory * 2 ** 20))
+    for filename, rows in sorted(counts.items()):
+        print('%s: %d rows' % (filename, rows), file=sys.stderr)
+
+
+def load(args):
+    import os
+    import psycopg2
+    from wrangle_osm import db
+    conn = psycopg2.connect(args.dsn)
+    try:
+        with conn:  #One transaction, rolled back on errors
+            with conn.cursor() as cursor:
+                if args.create:
+                    db.create_tables(cursor, args.dictionary)
+                if os.path.exists(os.path.join(args.csv_dir, 'tiles.json')):
+                    db.load_tiles(cursor, args.csv_dir, dictionary=args.dictionary)
+                else:
+                    db.load_csvs(cursor, args.csv_dir, args.dictionary)
+                if args.corrections:
+                    from wrangle_osm.corrections import Corrections, apply_sql
+                    counts = apply_sql(cursor, Corrections.load(args.corrections))
+                    print('%d rows corrected' % sum(counts), file=sys.stderr)
+                if args.rollups:
+                    from wrangle_osm import rollups
+                    rollups.install(cursor)
+    finally:
+        conn.close()
+
+
+def parser():
+    result = argparse.ArgumentParser(
+        prog='python -m wrangle_osm',
+        description='Audit, clean, export and load OpenStreetMap extracts.')
+    result.add_argument('--debug', action='store_true',
+                        help='print the traceback of every error')
+    commands = result.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    command = commands.add_parser('audit', help='audit the tags in one pass')
+    command.add_argument('path', help='the .osm or .pbf file')
+    command.add_argument('--fields',
+                         help='comma separated auditors (default: all)')
+    command.add_argument('--problems', metavar='DB',
+                         help='save every problem to this SQLite file')
+    command.add_argument('-n', type=int, default=10,
+                         help='values and problems reported per auditor')
+    command.set_defaults(func=audit)
+
+    command = commands.add_parser(
+        'clean', help='fix the street names and postcodes')
+    command.add_argument('path', help='the .osm file')
+    command.add_argument('output', help='the cleaned .osm file')
+    command.add_argument('--cache-dir',
+                         help='where the snapshots are kept (see snapshot.py)')
+    command.add_argument('--problems', metavar='DB',
+                         help='save the PROBLEMATICS to this SQLite file')
+    command.set_defaults(func=clean)
+
+    command = commands.add_parser('export', help='write the .csv files')
+    command.add_argument('path', help='the .osm or .pbf file')
+    command.add_argument('out_dir', help='the directory of the .csv files')
+    command.add_argument('--corrections', metavar='JSON',
+                         help='correction rules applied to the elements')
+    command.add_argument('--no-validate', dest='validate',
+                         action='store_false')
+    command.add_argument('--lenient', dest='strict', action='store_false',
+                         help='skip the invalid elements instead of failing')
+    command.add_argument('--audit', action='store_true',
+                         help='audit the tags during the export')
+    command.add_argument('--dictionary', action='store_true',
+                         help='write the user names once, to users.csv')
+    command.add_argument('--progress', type=float, metavar='SECONDS',
+                         help='report the progress every SECONDS')
+    command.add_argument('--tiles', type=int, metavar='ZOOM',
+                         help='one directory per quadkey tile of this zoom')
+    command.set_defaults(func=export)
+
+    command = commands.add_parser(
+        'check', help='find the way nodes referencing missing nodes')
+    command.add_argument('csv_dir', help='the directory of the .csv files')
+    command.add_argument('--repair', action='store_true',
+                         help='drop them, and the ways left with less than '
+                         'two nodes')
+    command.set_defaults(func=check)
+
+    command = commands.add_parser(
+        'sort', help='order the .csv files by id, within a memory budget')
+    command.add_argument('csv_dirs', nargs='+', metavar='csv_dir',
+                         help='the directories of the .csv files, or of the '
+                         'tiles of a tiled export')
+    command.add_argument('-o', '--output', metavar='DIR',
+                         help='the directory of the sorted files (default: '
+                         'in place)')
+    command.add_argument('--memory', type=float, default=256, metavar='MB',
+                         help='rows kept in memory (default: 256)')
+    command.set_defaults(func=sort)
+
+    command = commands.add_parser('load', help='import the .csv files')
+    command.add_argument('csv_dir', help='the directory of the .csv files')
+    command.add_argument('--dsn', default='',
+                         help='connection string (default: the PG* variables)')
+    command.add_argument('--create', action='store_true',
+                         help='create the tables first')
+    command.add_argument('--dictionary', action='store_true',
+                         help='load users.csv too')
+    command.add_argument('--corrections', metavar='JSON',
+                         help='correction rules applied after the import')
+    command.add_argument('--rollups', action='store_true',
+                         help='install the tag rollups (see rollups.py)')
+    command.set_defaults(func=load)
+
+    #Listed in the help only: main() hands their arguments to the module as
+    #they are, options included
+    for module, help in PASSTHROUGH:
+        commands.add_parser(module, help=help, add_help=False)
+    return result
+
+
+def _run(command, arg, debug):
+    try:
+        return command(arg) or 0
+    except KeyboardInterrupt:
+        return 1
+    except EXPECTED_ERRORS as error:
+        if debug:
+            traceback.print_exc()
+        else:
+            print('%s: %s' % (type(error).__name__, error), file=sys.stderr)
+        return 1
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    debug = argv[:1] == ['--debug']
+    if debug:
+        argv = argv[1:]
+    if argv and argv[0] in dict(PASSTHROUGH):
+        module = importlib.import_module('wrangle_osm.' + argv[0])
+        return _run(module.main, argv[1:], debug)
+    args = parser().parse_args(argv)
+    return _run(args.func, args, debug)
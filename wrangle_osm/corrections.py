@@ -0,0 +1,382 @@
+"""Declarative corrections, replayed in the stream or in the database.
+
+The fixes of the database review used to be hand-written UPDATE/DELETE
+statements, one per element. They are now rules in a JSON file
+(see corrections.json):
+
+    {"rules": [
+        {"action": "set_value", "element": "way", "ids": [23946435],
+         "key": "postcode", "to": "437437"},
+        {"action": "remap_value", "element": "node", "value": "Posb", "to": "POSB"},
+        {"action": "delete_element", "element": "node", "key": "operator",
+         "value": "home"}
+    ]}
+
+Every rule has an action, an element ('node', 'way' or '*' for both) and
+conditions: the ids of the elements, the key and/or the (current) value of the
+tag. The keys are the ones of the tables, without the type prefix ('street',
+not 'addr:street'). An optional "note" says where the fix comes from.
+
+Actions, in the order they are applied:
+
+1. rename_key: the key of the matching tags becomes "to" (needs ids).
+2. set_value: the value of the matching tags becomes "to" (needs ids).
+3. remap_value: every tag with "value" gets "to" instead (optionally only for
+   one key, no ids).
+4. delete_tag: drops the matching tags.
+5. add_tag: adds a tag with "key", "to" and "type" (default 'regular') to the
+   elements (needs ids), if they exist.
+6. delete_element: drops the elements with the ids, or with a tag matching
+   key and value, together with their tags.
+
+The rules are compiled to lookup tables, and applied either
+
+* in the stream, to the output of shape_element() (process_map(corrections=)),
+  with a couple of dict lookups per tag, or
+* in the database with one set-based statement per action and table
+  (apply_sql()), so tens of thousands of rules cost a few joins.
+"""
+import json
+from collections import defaultdict
+
+ACTIONS = ['rename_key', 'set_value', 'remap_value', 'delete_tag', 'add_tag',
+           'delete_element']
+#Actions that change a tag, in the order they are applied
+TAG_ACTIONS = ACTIONS[:4]
+ELEMENTS = ('node', 'way')
+TAGS_TABLES = {'node': 'public.nodes_tags', 'way': 'public.ways_tags'}
+ELEMENT_TABLES = {'node': 'public.nodes', 'way': 'public.ways'}
+
+
+class Rule(object):
+    """A compiled rule."""
+
+    __slots__ = ('action', 'element', 'ids', 'key', 'value', 'to', 'type',
+                 'order', 'note')
+
+    def __init__(self, action, element='*', ids=None, key=None, value=None,
+                 to=None, type='regular', order=0, note=None):
+        if action not in ACTIONS:
+            raise ValueError('Unknown action: %s' % action)
+        if action in ('rename_key', 'set_value', 'add_tag') and not ids:
+            raise ValueError('%s needs the ids of the elements' % action)
+        if action in ('rename_key', 'set_value', 'add_tag') and key is None:
+            raise ValueError('%s needs a key' % action)
+        if action == 'remap_value' and (ids or value is None):
+            raise ValueError('remap_value needs a value and no ids')
+        if action != 'delete_element' and action != 'delete_tag' and to is None:
+            raise ValueError('%s needs a "to"' % action)
+        if not (ids or key or value is not None):
+            raise ValueError('%s matches every element' % action)
+        if element not in ELEMENTS + ('*', ):
+            raise ValueError('Unknown element: %s' % element)
+        self.action = action
+        self.element = element
+        self.ids = [str(i) for i in ids] if ids else None
+        self.key = key
+        self.value = value
+        self.to = to
+        self.type = type
+        self.order = order
+        self.note = note
+
+    @property
+    def elements(self):
+        return ELEMENTS if self.element == '*' else (self.element, )
+
+    def matches(self, tag):
+        """Whether the tag meets the key/value conditions of the rule."""
+        return ((self.key is None or tag.get('key') == self.key) and
+                (self.value is None or tag.get('value') == self.value))
+
+
+class Corrections(object):
+    """Correction rules compiled to lookup tables.
+
+    Args:
+        rules (list): Rule objects, or dicts with the arguments of Rule.
+    """
+
+    def __init__(self, rules):
+        self.rules = []
+        for order, rule in enumerate(rules):
+            if isinstance(rule, dict):
+                rule = dict((str(k), v) for k, v in rule.items())
+                rule = Rule(order=order, **rule)
+            self.rules.append(rule)
+
+        #(element, id) -> rules of specific elements
+        self.by_id = defaultdict(list)
+        #(element, value) and (element, key) -> rules of any element
+        self.by_value = defaultdict(list)
+        self.by_key = defaultdict(list)
+        #The ids of the nodes deleted by apply()
+        self.deleted_nodes = set()
+        seen = {}
+        for rule in self.rules:
+            for element in rule.elements:
+                if rule.ids:
+                    for element_id in rule.ids:
+                        self.by_id[(element, element_id)].append(rule)
+                        self._check_conflict(seen, rule, element, element_id)
+                elif rule.value is not None:
+                    self.by_value[(element, rule.value)].append(rule)
+                    self._check_conflict(seen, rule, element, None)
+                else:
+                    self.by_key[(element, rule.key)].append(rule)
+                    self._check_conflict(seen, rule, element, None)
+
+    @staticmethod
+    def _check_conflict(seen, rule, element, element_id):
+        """Two rules of the same action must not match the same tags, as the
+        set-based statements would apply them in an undefined order. A rule
+        without a key matches any key, and one without a value any value."""
+        if rule.action in ('add_tag', 'delete_element', 'delete_tag'):
+            return
+        #The values of the rules by key, all the values, and the keys of the
+        #rules without a value
+        by_key, values, any_value = seen.setdefault(
+            (rule.action, element, element_id),
+            (defaultdict(set), set(), set()))
+        key, value = rule.key, rule.value
+        if key is None and value is None:
+            conflict = values or any_value
+        elif key is None:
+            conflict = value in values or any_value
+        elif value is None:
+            conflict = by_key.get(key) or by_key.get(None)
+        else:
+            conflict = any(by_key.get(k, set()) & set([value, None])
+                           for k in (key, None))
+        if conflict:
+            raise ValueError('Conflicting %s rules for %s' % (
+                rule.action, (element, element_id, key, value)))
+        by_key[key].add(value)
+        if value is None:
+            any_value.add(key)
+        else:
+            values.add(value)
+
+
+    @classmethod
+    def load(cls, path):
+        """Compiles the rules of a JSON file."""
+        with open(path) as rules_file:
+            return cls(json.load(rules_file)['rules'])
+
+    def __len__(self):
+        return len(self.rules)
+
+    # ### In the stream
+
+    def apply(self, el):
+        """Applies the rules to a shaped element.
+
+        Like the cascading deletes of the database, the way_nodes of the
+        deleted nodes are dropped too, so the nodes have to come before the
+        ways (as they do in OSM files).
+
+        Args:
+            el (dict): The output of shape_element(). It is changed in place.
+
+        Returns:
+            dict: The element, or None if it has to be deleted.
+        """
+        kind = 'node' if 'node' in el else 'way'
+        element_id = el[kind]['id']
+        if self._deletes(kind, el):
+            if kind == 'node':
+                self.deleted_nodes.add(element_id)
+            return None
+        if kind == 'way' and self.deleted_nodes:
+            el['way_nodes'] = [nd for nd in el['way_nodes']
+                               if nd['node_id'] not in self.deleted_nodes]
+        return el
+
+    def _deletes(self, kind, el):
+        """Corrects the tags of the element, and tells whether it has to be
+        deleted."""
+        tags_key = kind + '_tags'
+        element_id = el[kind]['id']
+        id_rules = self.by_id.get((kind, element_id), ())
+
+        for rule in id_rules:
+            if rule.action == 'delete_element' and rule.key is None and \
+                    rule.value is None:
+                return True
+
+        tags = []
+        for tag in el[tags_key]:
+            if not self._candidates(kind, tag, id_rules):
+                tags.append(tag)
+                continue
+            for action in TAG_ACTIONS:
+                tag = self._apply_tag_action(action, kind, tag, id_rules)
+                if tag is None:
+                    break
+            else:
+                tags.append(tag)
+
+        for rule in id_rules:
+            if rule.action == 'add_tag':
+                tags.append({'id': element_id, 'key': rule.key,
+                             'value': rule.to, 'type': rule.type})
+        el[tags_key] = tags
+
+        for tag in tags:
+            for rule in self._candidates(kind, tag, id_rules):
+                if rule.action == 'delete_element' and rule.matches(tag):
+                    return True
+        return False
+
+    def _candidates(self, kind, tag, id_rules):
+        rules = list(id_rules)
+        rules.extend(self.by_value.get((kind, tag.get('value')), ()))
+        rules.extend(self.by_key.get((kind, tag.get('key')), ()))
+        return rules
+
+    def _apply_tag_action(self, action, kind, tag, id_rules):
+        """Applies the first matching rule of an action to a tag.
+
+        Returns:
+            dict: The tag, or None if it has to be deleted.
+        """
+        for rule in sorted(self._candidates(kind, tag, id_rules),
+                           key=lambda r: r.order):
+            if rule.action != action or not rule.matches(tag):
+                continue
+            if action == 'rename_key':
+                tag['key'] = rule.to
+            elif action in ('set_value', 'remap_value'):
+                tag['value'] = rule.to
+            elif action == 'delete_tag':
+                return None
+            break
+        return tag
+
+    # ### In the database
+
+    def statements(self):
+        """The set-based statements of the rules.
+
+        The rules of every action and table go to a single statement, whose
+        arguments are arrays (one element per rule).
+
+        Returns:
+            list: (sql, args) tuples, in the order they have to run.
+        """
+        result = []
+        for action in ACTIONS:
+            for element in ELEMENTS:
+                rules = [r for r in self.rules
+                         if r.action == action and element in r.elements]
+                if rules:
+                    result.extend(self._statements(action, element, rules))
+        return result
+
+    def _statements(self, action, element, rules):
+        table = TAGS_TABLES[element]
+        id_rows = [(int(i), r) for r in rules for i in (r.ids or ())]
+        any_rules = [r for r in rules if not r.ids]
+
+        if action in ('rename_key', 'set_value'):
+            column = 'key' if action == 'rename_key' else 'value'
+            yield ('''
+                UPDATE {table} AS t SET {column} = m.new_{column}
+                FROM unnest(%s::bigint[], %s::text[], %s::text[], %s::text[])
+                     AS m(id, key, value, new_{column})
+                WHERE t.id = m.id AND t.key = m.key
+                  AND (m.value IS NULL OR t.value = m.value)'''.format(
+                      table=table, column=column),
+                   _columns(id_rows, lambda i, r: (i, r.key, r.value, r.to)))
+
+        elif action == 'remap_value':
+            yield ('''
+                UPDATE {table} AS t SET value = m.new_value
+                FROM unnest(%s::text[], %s::text[], %s::text[])
+                     AS m(key, value, new_value)
+                WHERE t.value = m.value
+                  AND (m.key IS NULL OR t.key = m.key)'''.format(table=table),
+                   _columns(rules, lambda r: (r.key, r.value, r.to)))
+
+        elif action == 'delete_tag':
+            if id_rows:
+                yield ('''
+                    DELETE FROM {table} AS t
+                    USING unnest(%s::bigint[], %s::text[], %s::text[])
+                          AS m(id, key, value)
+                    WHERE t.id = m.id
+                      AND (m.key IS NULL OR t.key = m.key)
+                      AND (m.value IS NULL OR t.value = m.value)'''.format(
+                          table=table),
+                       _columns(id_rows, lambda i, r: (i, r.key, r.value)))
+            if any_rules:
+                yield ('''
+                    DELETE FROM {table} AS t
+                    USING unnest(%s::text[], %s::text[]) AS m(key, value)
+                    WHERE (m.key IS NULL OR t.key = m.key)
+                      AND (m.value IS NULL OR t.value = m.value)'''.format(
+                          table=table),
+                       _columns(any_rules, lambda r: (r.key, r.value)))
+
+        elif action == 'add_tag':
+            yield ('''
+                INSERT INTO {table} (id, key, value, type)
+                SELECT m.* FROM unnest(%s::bigint[], %s::text[], %s::text[],
+                                       %s::text[]) AS m(id, key, value, type)
+                JOIN {elements} AS e ON e.id = m.id'''.format(
+                    table=table, elements=ELEMENT_TABLES[element]),
+                   _columns(id_rows, lambda i, r: (i, r.key, r.to, r.type)))
+
+        elif action == 'delete_element':
+            ids = [i for i, r in id_rows if r.key is None and r.value is None]
+            conditions = [(i, r) for i, r in id_rows
+                          if r.key is not None or r.value is not None]
+            conditions += [(None, r) for r in any_rules]
+            selections = []
+            if ids:
+                selections.append(('SELECT unnest(%s::bigint[])', (ids, )))
+            if conditions:
+                selections.append(('''
+                    SELECT t.id FROM {table} AS t
+                    JOIN unnest(%s::bigint[], %s::text[], %s::text[])
+                         AS m(id, key, value)
+                      ON (m.id IS NULL OR t.id = m.id)
+                     AND (m.key IS NULL OR t.key = m.key)
+                     AND (m.value IS NULL OR t.value = m.value)'''.format(
+                         table=table),
+                    _columns(conditions, lambda i, r: (i, r.key, r.value))))
+            #The tags are deleted in cascade, the ways_nodes of a way are not
+            tables = [ELEMENT_TABLES[element]]
+            if element == 'way':
+                tables.insert(0, 'public.ways_nodes')
+            for element_table in tables:
+                for selection, args in selections:
+                    yield ('DELETE FROM %s WHERE id IN (%s)' % (
+                        element_table, selection), args)
+
+
+def _columns(rows, values):
+    """Transposes the values of the rows to one list per column (the arrays
+    of the unnest() of the statements)."""
+    columns = zip(*[values(*row) if isinstance(row, tuple) else values(row)
+                    for row in rows])
+    return tuple(list(c) for c in columns)
+
+
+def apply_sql(cursor, corrections):
+    """Applies the rules to the database, in one statement per action and
+    table.
+
+    Args:
+        cursor: A psycopg2 cursor (lists are passed as arrays).
+        corrections (Corrections): The compiled rules.
+
+    Returns:
+        list: The number of rows affected by every statement.
+    """
+    counts = []
+    for sql, args in corrections.statements():
+        cursor.execute(sql, args)
+        counts.append(cursor.rowcount)
+    return counts
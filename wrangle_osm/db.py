@@ -0,0 +1,143 @@
+"""PostgreSQL tables of the export and loading of the .csv files.
+
+The functions take a DB-API cursor; loading needs the COPY support of
+psycopg2.
+"""
+import os
+
+#DELETE CASCADE on the tables with foreign keys drops the tags along with the
+#related elements.
+TABLES = '''
+CREATE TABLE public.nodes
+(
+  id bigint NOT NULL,
+  lat real,
+  lon real,
+  "user" text,
+  uid integer,
+  version integer,
+  changeset integer,
+  "timestamp" text,
+  CONSTRAINT nodes_pkey PRIMARY KEY (id)
+);
+
+CREATE TABLE public.nodes_tags
+(
+  id bigint,
+  key text,
+  value text,
+  type text,
+  CONSTRAINT nodes_tags_id_fkey FOREIGN KEY (id)
+      REFERENCES public.nodes (id) MATCH SIMPLE
+      ON UPDATE NO ACTION ON DELETE CASCADE
+);
+
+CREATE TABLE public.ways
+(
+  id bigint NOT NULL,
+  "user" text,
+  uid integer,
+  version text,
+  changeset integer,
+  "timestamp" text,
+  CONSTRAINT ways_pkey PRIMARY KEY (id)
+);
+
+CREATE TABLE public.ways_nodes
+(
+  id bigint NOT NULL,
+  node_id bigint NOT NULL,
+  "position" integer NOT NULL,
+  CONSTRAINT ways_nodes_id_fkey FOREIGN KEY (id)
+      REFERENCES public.ways (id) MATCH SIMPLE
+      ON UPDATE NO ACTION ON DELETE NO ACTION,
+  CONSTRAINT ways_nodes_node_id_fkey FOREIGN KEY (node_id)
+      REFERENCES public.nodes (id) MATCH SIMPLE
+      ON UPDATE NO ACTION ON DELETE CASCADE
+);
+
+CREATE TABLE public.ways_tags
+(
+  id bigint NOT NULL,
+  key text NOT NULL,
+  value text NOT NULL,
+  type text,
+  CONSTRAINT ways_tags_id_fkey FOREIGN KEY (id)
+      REFERENCES public.ways (id) MATCH SIMPLE
+      ON UPDATE NO ACTION ON DELETE CASCADE
+);
+'''
+
+#The lookup tables of the dictionary encoded exports, where "user" is NULL in
+#nodes and ways.
+DICTIONARY_TABLES = '''
+CREATE TABLE public.users
+(
+  uid integer NOT NULL,
+  "user" text,
+  CONSTRAINT users_pkey PRIMARY KEY (uid)
+);
+'''
+
+#The table of each .csv file, in the order they have to be loaded
+CSV_TABLES = [
+    ('nodes.csv', 'public.nodes'),
+    ('nodes_tags.csv', 'public.nodes_tags'),
+    ('ways.csv', 'public.ways'),
+    ('ways_nodes.csv', 'public.ways_nodes'),
+    ('ways_tags.csv', 'public.ways_tags'),
+]
+
+DICTIONARY_CSV_TABLES = [
+    ('users.csv', 'public.users'),
+]
+
+
+def create_tables(cursor, dictionary=False):
+    cursor.execute(TABLES)
+    if dictionary:
+        cursor.execute(DICTIONARY_TABLES)
+
+
+def load_csvs(cursor, csv_dir, dictionary=False):
+    """Imports the .csv files of an export with COPY.
+
+    The files are streamed from the client (COPY FROM STDIN), so they do not
+    have to be copied to the database server first.
+
+    Args:
+        cursor: A psycopg2 cursor.
+        csv_dir (str): The directory of the .csv files.
+        dictionary (bool): Load the lookup tables of a dictionary encoded
+            export too.
+    """
+    tables = CSV_TABLES + (DICTIONARY_CSV_TABLES if dictionary else [])
+    for filename, table in tables:
+        with open(os.path.join(csv_dir, filename), 'rb') as csv_file:
+            cursor.copy_expert('COPY %s FROM STDIN CSV HEADER' % table, csv_file)
+
+
+def load_tiles(cursor, out_dir, tiles=None, dictionary=False):
+    """Imports the .csv files of a tiled export (see wrangle_osm.tiles).
+
+    The files are loaded table by table, so the way nodes of a tile can
+    reference the nodes of the others.
+
+    Args:
+        cursor: A psycopg2 cursor.
+        out_dir (str): The directory of the tiles.
+        tiles (list): The tiles to load, all by default.
+        dictionary (bool): Load the lookup tables of a dictionary encoded
+            export too, written once for all the tiles.
+    """
+    if tiles is None:
+        tiles = sorted(name for name in os.listdir(out_dir)
+                       if os.path.isdir(os.path.join(out_dir, name)))
+    for filename, table in CSV_TABLES:
+        for tile in tiles:
+            with open(os.path.join(out_dir, tile, filename), 'rb') as csv_file:
+                cursor.copy_expert('COPY %s FROM STDIN CSV HEADER' % table,
+                                   csv_file)
+    for filename, table in DICTIONARY_CSV_TABLES if dictionary else []:
+        with open(os.path.join(out_dir, filename), 'rb') as csv_file:
+            cursor.copy_expert('COPY %s FROM STDIN CSV HEADER' % table, csv_file)
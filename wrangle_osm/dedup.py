@@ -0,0 +1,281 @@
+"""Duplicate points of interest, found by geohash cells.
+
+The ATM counts of the notebook are inflated by duplicates and by spellings of
+the same bank, which were fixed by hand. Duplicates finds the tagged nodes of
+the same category (e.g. amenity=atm) with the same or a similar name, brand
+or operator within max_distance meters of each other:
+
+    dedup = Duplicates(max_distance=50)
+    process_map(elements, 'csv', consumers=[dedup])  #Or dedup(element) each
+    for group in dedup.groups():
+        ...                                          #[Poi, Poi, ...]
+    dedup.write_candidates('duplicates.json')
+
+    python -m wrangle_osm.dedup Singapore.osm --review duplicates.json
+
+Two ATMs of the same bank 30 m apart may both exist, so the duplicates are
+flagged for review, not turned into correction rules: the confirmed ones are
+copied to corrections.json as delete_element rules by hand.
+
+The nodes are bucketed by the geohash of their coordinates, with cells at
+least max_distance wide, so every duplicate is in the same or a neighbouring
+cell. Only the nodes of the same category in those 9 cells are compared,
+instead of all the pairs. Near the poles the cells get narrower in meters (by
+cos(latitude)): use a larger max_distance, or a smaller precision, there.
+"""
+from __future__ import print_function, division
+
+import argparse
+import difflib
+import json
+import re
+import unicodedata
+from collections import defaultdict, namedtuple
+
+from wrangle_osm.scoring import distance
+
+#Keys whose value is the category of a point of interest
+CATEGORY_KEYS = ('amenity', 'shop', 'tourism', 'leisure', 'office')
+#Keys naming it, the first one found is compared
+NAME_KEYS = ('name', 'brand', 'operator')
+#Normalized spellings of the same name
+ALIASES = {
+    'overseas chinese banking corporation': 'ocbc',
+    'ocbc bank': 'ocbc',
+    'united overseas bank': 'uob',
+    'uob bank': 'uob',
+    'posb bank': 'posb',
+    'dbs bank': 'dbs',
+    'development bank of singapore': 'dbs',
+}
+#Similarity of the normalized names of near duplicates (difflib ratio)
+SIMILARITY = 0.85
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+METERS_PER_DEGREE = 111320.0
+
+punctuation_re = re.compile(r'[\W_]+', re.UNICODE)
+digits_re = re.compile(r'\d+')
+
+
+class Poi(namedtuple('Poi', 'id lat lon category name tags')):
+    """A tagged node: its id, coordinates, category ('amenity=atm'),
+    normalized name and number of tags."""
+
+    __slots__ = ()
+
+
+def geohash(lat, lon, precision):
+    """The geohash of a point, precision characters long."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, char, even = [], 0, 0, True
+    while len(chars) < precision:
+        value, interval = (lon, lon_range) if even else (lat, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        char <<= 1
+        if value >= middle:
+            char |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_BASE32[char])
+            bits = char = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """The (height, width) in degrees of the cells of a precision."""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** (bits - bits // 2)
+
+
+def neighbours(lat, lon, precision):
+    """The geohashes of the cell of a point and of the 8 cells around it."""
+    height, width = cell_size(precision)
+    result = set()
+    for d_lat in (-height, 0, height):
+        for d_lon in (-width, 0, width):
+            result.add(geohash(max(min(lat + d_lat, 90.0), -90.0),
+                               (lon + d_lon + 180) % 360 - 180, precision))
+    return result
+
+
+def precision_for(max_distance):
+    """The longest geohashes whose cells are at least max_distance meters
+    high and wide (at the equator)."""
+    for precision in range(12, 0, -1):
+        height, width = cell_size(precision)
+        if min(height, width) * METERS_PER_DEGREE >= max_distance:
+            return precision
+    return 1
+
+
+def normalize_name(value):
+    """Lowercase words without accents and punctuation, with the ALIASES
+    applied, e.g. 'Overseas Chinese Banking Corporation' -> 'ocbc'."""
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    value = unicodedata.normalize('NFKD', value)
+    value = ''.join(c for c in value if not unicodedata.combining(c))
+    value = punctuation_re.sub(' ', value.lower()).strip()
+    return ALIASES.get(value, value)
+
+
+def similar(name, other):
+    """Whether two normalized names are spellings of the same name. Names
+    with different numbers ('7 eleven 12', 'blk 21') are not."""
+    if name == other:
+        return True
+    return (digits_re.findall(name) == digits_re.findall(other) and
+            difflib.SequenceMatcher(None, name, other).ratio() >= SIMILARITY)
+
+
+class Duplicates(object):
+    """The points of interest, bucketed by geohash cell.
+
+    The object is a callable taking the elements, so it can be one of the
+    consumers of process_map().
+
+    Args:
+        max_distance (float): Meters between duplicates.
+        precision (int): Length of the geohashes, by default the longest
+            whose cells are max_distance wide.
+    """
+
+    def __init__(self, max_distance=50.0, precision=None):
+        self.max_distance = max_distance
+        self.precision = precision or precision_for(max_distance)
+        #geohash: {category: [Poi, ...]}
+        self.cells = defaultdict(lambda: defaultdict(list))
+        self.count = 0
+
+    def add(self, poi):
+        self.cells[geohash(poi.lat, poi.lon, self.precision)][
+            poi.category].append(poi)
+        self.count += 1
+
+    def __call__(self, element):
+        if element.tag != 'node':
+            return
+        tags = dict((tag.attrib['k'], tag.attrib['v'])
+                    for tag in element.iter('tag'))
+        category = next(('%s=%s' % (k, tags[k]) for k in CATEGORY_KEYS
+                         if k in tags), None)
+        name = next((tags[k] for k in NAME_KEYS if k in tags), None)
+        if category is None or name is None:
+            return
+        name = normalize_name(name)
+        if name:
+            self.add(Poi(int(element.attrib['id']),
+                         float(element.attrib['lat']),
+                         float(element.attrib['lon']), category, name,
+                         len(tags)))
+
+    def pairs(self):
+        """Yields (Poi, Poi, distance in meters) for the duplicates, each pair
+        once."""
+        for cell, categories in self.cells.items():
+            for category, pois in categories.items():
+                poi = pois[0]
+                others = []
+                for other_cell in neighbours(poi.lat, poi.lon, self.precision):
+                    #The cells after this one, the others are compared when
+                    #their turn comes
+                    if other_cell > cell and other_cell in self.cells:
+                        others.extend(self.cells[other_cell].get(category, ()))
+                for i, poi in enumerate(pois):
+                    for other in pois[i + 1:] + others:
+                        meters = distance(poi.lat, poi.lon, other.lat,
+                                          other.lon)
+                        if (meters <= self.max_distance and
+                                similar(poi.name, other.name)):
+                            yield poi, other, meters
+
+    def groups(self):
+        """The duplicates grouped around the node kept, each group sorted by
+        the number of tags, the most complete (the one kept) first.
+
+        Every member is a duplicate of the node kept, within max_distance of
+        it: the pairs are not chained, so a row of similar points a few
+        meters apart does not end up in a single group.
+        """
+        near = defaultdict(set)
+        for poi, other, _ in self.pairs():
+            near[poi].add(other)
+            near[other].add(poi)
+
+        def order(poi):
+            return -poi.tags, poi.id
+
+        grouped, groups = set(), []
+        for keep in sorted(near, key=order):
+            if keep in grouped:
+                continue
+            members = sorted(near[keep] - grouped, key=order)
+            if members:
+                grouped.add(keep)
+                grouped.update(members)
+                groups.append([keep] + members)
+        return groups
+
+    def candidates(self):
+        """The groups in a form to review: the node kept and its duplicates,
+        with their distance to it in meters."""
+        result = []
+        for group in sorted(self.groups(), key=lambda g: g[0].id):
+            keep = group[0]
+            result.append({
+                'category': keep.category,
+                'keep': {'id': keep.id, 'name': keep.name, 'tags': keep.tags},
+                'duplicates': [
+                    {'id': poi.id, 'name': poi.name, 'tags': poi.tags,
+                     'meters': round(distance(keep.lat, keep.lon, poi.lat,
+                                              poi.lon), 1)}
+                    for poi in group[1:]]})
+        return result
+
+    def write_candidates(self, path):
+        """Writes candidates() to a .json file, to be reviewed."""
+        with open(path, 'w') as review_file:
+            json.dump({'description': 'Flagged by wrangle_osm.dedup, to be '
+                       'reviewed before deleting anything',
+                       'candidates': self.candidates()}, review_file,
+                      indent=2, sort_keys=True)
+
+    def report(self, n=10):
+        groups = self.groups()
+        by_category = defaultdict(int)
+        for group in groups:
+            by_category[group[0].category] += len(group) - 1
+        print('%d points of interest, %d duplicates in %d groups' % (
+            self.count, sum(by_category.values()), len(groups)))
+        for category, count in sorted(by_category.items(),
+                                      key=lambda c: -c[1])[:n]:
+            print('  %-28s %6d' % (category, count))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Duplicate points of interest of an .osm or .pbf file')
+    parser.add_argument('path')
+    parser.add_argument('--distance', type=float, default=50.0,
+                        help='meters between duplicates')
+    parser.add_argument('--review', metavar='JSON',
+                        help='write the duplicates to review')
+    parser.add_argument('-n', type=int, default=10,
+                        help='number of categories reported')
+    args = parser.parse_args(argv)
+    from wrangle_osm.cli import iter_osm
+    dedup = Duplicates(args.distance)
+    for element in iter_osm(args.path):
+        dedup(element)
+    dedup.report(args.n)
+    if args.review:
+        dedup.write_candidates(args.review)
+
+
+if __name__ == '__main__':
+    main()
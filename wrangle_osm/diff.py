@@ -0,0 +1,191 @@
+"""Differences between two exports, in one pass over sorted files.
+
+After a change of mapping, EXPECTED or the postcode regex, the new export can
+be compared with the previous one table by table, without loading them:
+
+    for change in diff_exports('csv.old', 'csv'):
+        ...    #Change('ways_tags.csv', 'changed', (23946435, 'addr', 'street'),
+               #       old_row, new_row)
+
+    python -m wrangle_osm diff csv.old/ csv/ -n 5
+
+The files are read side by side, in the order of wrangle_osm.extsort (sort
+them first with `python -m wrangle_osm sort`), and the rows with the same key
+(id, plus type and key for the tags, position for the way nodes) are
+compared: only the rows of one key are in memory at a time. A row is
+'added' or 'removed' when its key is only in one export, 'changed' when the
+other columns differ.
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import Counter, OrderedDict, namedtuple
+from itertools import groupby
+
+from wrangle_osm.export import OUTPUTS, PY2, open_csv
+from wrangle_osm.extsort import key_function
+
+KINDS = ('added', 'removed', 'changed')
+
+
+class Change(namedtuple('Change', 'table kind key old new')):
+    """A difference of a table (its .csv file name): the kind, the key of the
+    rows, and the old and new rows ({column: value}, None when added or
+    removed)."""
+
+    __slots__ = ()
+
+
+def _read(path):
+    return open(path, 'rb') if PY2 else open_csv(path, 'r')
+
+
+def _groups(path, reader, key):
+    """Yields (key, rows) in the order of the file, checking it is sorted."""
+    previous = None
+    for group_key, rows in groupby(reader, key):
+        if previous is not None and group_key <= previous:
+            raise ValueError('%s is not sorted at %s (see wrangle_osm.extsort)'
+                             % (path, group_key))
+        previous = group_key
+        yield group_key, list(rows)
+
+
+def _compare(key, old_rows, new_rows):
+    """The (kind, old row, new row) changes of the rows of a key, in the
+    common case one row in each export."""
+    if old_rows == new_rows:
+        return
+    old_rows, new_rows = ([row for row in old_rows if row not in new_rows],
+                          [row for row in new_rows if row not in old_rows])
+    for old, new in zip(old_rows, new_rows):
+        yield 'changed', old, new
+    for old in old_rows[len(new_rows):]:
+        yield 'removed', old, None
+    for new in new_rows[len(old_rows):]:
+        yield 'added', None, new
+
+
+def diff_csv(old_path, new_path, output):
+    """Yields the changes between two sorted .csv files of an output.
+
+    Args:
+        output (str): The output of the files, e.g. 'way_nodes' (see OUTPUTS).
+    """
+    table = os.path.basename(new_path)
+    with _read(old_path) as old_file, _read(new_path) as new_file:
+        old_reader, new_reader = csv.reader(old_file), csv.reader(new_file)
+        header = next(old_reader)
+        if next(new_reader) != header:
+            raise ValueError('%s and %s have different columns' % (
+                old_path, new_path))
+        key = key_function(header, output)
+
+        def change(kind, group_key, old_row, new_row):
+            return Change(table, kind, group_key,
+                          old_row and OrderedDict(zip(header, old_row)),
+                          new_row and OrderedDict(zip(header, new_row)))
+
+        old_groups = _groups(old_path, old_reader, key)
+        new_groups = _groups(new_path, new_reader, key)
+        old, new = next(old_groups, None), next(new_groups, None)
+        while old is not None or new is not None:
+            if new is None or (old is not None and old[0] < new[0]):
+                for row in old[1]:
+                    yield change('removed', old[0], row, None)
+                old = next(old_groups, None)
+            elif old is None or new[0] < old[0]:
+                for row in new[1]:
+                    yield change('added', new[0], None, row)
+                new = next(new_groups, None)
+            else:
+                for kind, old_row, new_row in _compare(old[0], old[1], new[1]):
+                    yield change(kind, old[0], old_row, new_row)
+                old, new = next(old_groups, None), next(new_groups, None)
+
+
+def diff_exports(old_dir, new_dir):
+    """Yields the changes of the five tables between two sorted exports."""
+    for output, filename, _ in OUTPUTS:
+        for change in diff_csv(os.path.join(old_dir, filename),
+                               os.path.join(new_dir, filename), output):
+            yield change
+
+
+def describe(change):
+    """A line describing a change, with the columns that changed."""
+    if change.kind == 'changed':
+        fields = ['%s %r -> %r' % (column, old, change.new[column])
+                  for column, old in change.old.items()
+                  if old != change.new[column]]
+        return '%s: %s' % (change.key, ', '.join(fields))
+    return '%s: %s' % (change.key, ','.join((change.old or change.new).values()))
+
+
+class Summary(object):
+    """Counts of the changes per table and kind, with the first n examples.
+
+    The object is a callable taking the changes.
+    """
+
+    def __init__(self, n=5):
+        self.n = n
+        self.counts = Counter()
+        self.examples = {}
+
+    def __call__(self, change):
+        kind = (change.table, change.kind)
+        self.counts[kind] += 1
+        if self.counts[kind] <= self.n:
+            self.examples.setdefault(kind, []).append(change)
+
+    def __bool__(self):
+        return bool(self.counts)
+
+    __nonzero__ = __bool__  #Python 2
+
+    def report(self):
+        for _, filename, _ in OUTPUTS:
+            counts = [self.counts[(filename, kind)] for kind in KINDS]
+            print('%-16s %8d added %8d removed %8d changed' % ((filename, ) +
+                                                              tuple(counts)))
+            for kind in KINDS:
+                for change in self.examples.get((filename, kind), ()):
+                    print('  %-8s %s' % (kind, describe(change)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Rows added, removed and changed between two sorted '
+        'exports')
+    parser.add_argument('old_dir')
+    parser.add_argument('new_dir')
+    parser.add_argument('-n', type=int, default=5,
+                        help='examples reported per table and kind')
+    parser.add_argument('--output', metavar='CSV',
+                        help='write every change to this .csv file')
+    args = parser.parse_args(argv)
+    summary = Summary(args.n)
+    changes = diff_exports(args.old_dir, args.new_dir)
+    if args.output:
+        with open_csv(args.output) as out_file:
+            writer = csv.writer(out_file)
+            writer.writerow(['table', 'kind', 'old', 'new'])
+            for change in changes:
+                summary(change)
+                writer.writerow([change.table, change.kind] + [
+                    '' if row is None else json.dumps(row)
+                    for row in (change.old, change.new)])
+    else:
+        for change in changes:
+            summary(change)
+    summary.report()
+    return 1 if summary else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,323 @@
+"""Geocoding of the problematic addresses, many requests at a time.
+
+The notebook completes the addresses of PROBLEMATICS one complete_address()
+call at a time, each blocking on a request to the Google Maps API. Here the
+addresses of all the problem elements are geocoded by a pool of threads,
+within a rate limit, and the postcodes found are written as suggested
+correction rules (see wrangle_osm.corrections):
+
+    database = Database(dsn)
+    backend = HttpBackend('https://nominatim.openstreetmap.org/search',
+                          user_agent='wrangle_osm (you@example.com)')
+    rules = enrich(database.review(store), backend, workers=8)
+    write_suggestions(rules, 'suggestions.json')
+
+A backend is a callable taking an address and returning a dict with
+'address', 'postcode', 'lat' and 'lon', or None when the address is not
+found:
+
+* GeopyBackend: the GoogleV3 geocoder of the notebook (needs geopy).
+* HttpBackend: a JSON API with the parameters of Nominatim's /search.
+* StubServer: a local server of that API answering from a dict, for tests
+  and offline runs.
+"""
+from __future__ import print_function, division
+
+import json
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    from urllib.parse import urlencode, urlparse, parse_qs
+    from urllib.request import Request, urlopen
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  #Python 2
+    from urllib import urlencode
+    from urllib2 import Request, urlopen
+    from urlparse import urlparse, parse_qs
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from wrangle_osm.audit import normalize_postcode
+from wrangle_osm.instrument import clock
+
+
+class RateLimiter(object):
+    """Spaces out the calls of many threads to at most rate per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_call = clock()
+
+    def wait(self):
+        with self.lock:
+            now = clock()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+# ### Backends
+
+
+class GeopyBackend(object):
+    """A geopy geocoder, GoogleV3 by default like complete_address().
+
+    Args:
+        geocoder: A geopy geocoder.
+        retries (int): Attempts per address on GeocoderTimedOut.
+    """
+
+    def __init__(self, geocoder=None, retries=3):
+        from geopy.exc import GeocoderTimedOut
+        if geocoder is None:
+            from geopy.geocoders import GoogleV3
+            geocoder = GoogleV3()
+        self.geocoder = geocoder
+        self.retries = retries
+        self.timeout_error = GeocoderTimedOut
+
+    def __call__(self, address):
+        for attempt in range(self.retries):
+            try:
+                location = self.geocoder.geocode(address)
+                break
+            except self.timeout_error:
+                if attempt == self.retries - 1:
+                    raise
+        if location is None:
+            return None
+        postcode = None
+        for component in location.raw.get('address_components', ()):
+            if 'postal_code' in component['types']:
+                postcode = component['long_name']
+        return {'address': location.address, 'postcode': postcode,
+                'lat': location.latitude, 'lon': location.longitude}
+
+
+class HttpBackend(object):
+    """A JSON geocoding API with the parameters and results of Nominatim's
+    /search.
+
+    Nominatim's usage policy asks for at most one request per second (the
+    default rate of geocode_all()) and a User-Agent identifying the
+    application, and blocks the generic ones.
+
+    Args:
+        url (str): The URL of the search endpoint.
+        user_agent (str): The User-Agent header, naming the application and a
+            contact, e.g. 'wrangle_osm (you@example.com)'.
+        timeout (float): Seconds per request.
+        params (dict): Extra query parameters, e.g. {'countrycodes': 'sg'}.
+    """
+
+    def __init__(self, url, user_agent, timeout=10.0, params=None):
+        if not user_agent:
+            raise ValueError('HttpBackend needs a user_agent')
+        self.url = url
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.params = dict(params or {})
+
+    def __call__(self, address):
+        params = dict(self.params, q=address, format='json', addressdetails=1,
+                      limit=1)
+        request = Request(self.url + '?' + urlencode(params),
+                          headers={'User-Agent': self.user_agent})
+        response = urlopen(request, timeout=self.timeout)
+        try:
+            results = json.loads(response.read().decode('utf-8'))
+        finally:
+            response.close()
+        if not results:
+            return None
+        result = results[0]
+        return {'address': result.get('display_name'),
+                'postcode': result.get('address', {}).get('postcode'),
+                'lat': float(result['lat']), 'lon': float(result['lon'])}
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        address = query.get('q', [''])[0]
+        self.server.requests.append((address, self.headers.get('User-Agent'),
+                                     clock()))
+        result = self.server.addresses.get(address.strip())
+        body = json.dumps([result] if result else []).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(object):
+    """A local geocoding server answering like Nominatim from a dict.
+
+    Args:
+        addresses (dict): {address: Nominatim result}, e.g.
+            {'6 Sago Street, Singapore': {'display_name': ..., 'lat': '1.28',
+             'lon': '103.84', 'address': {'postcode': '059011'}}}
+        port (int): 0 for any free port.
+
+    The requests received are kept in requests, as (address, User-Agent,
+    clock()) tuples.
+    """
+
+    def __init__(self, addresses, port=0):
+        self.server = HTTPServer(('127.0.0.1', port), _StubHandler)
+        self.server.addresses = addresses
+        self.server.requests = []
+        self.thread = None
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/search' % self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+# ### Enrichment
+
+
+def address_of(tags):
+    """Builds the address to geocode from the tags of an element.
+
+    Args:
+        tags (list): The rows of get_tags(): (el_type, id, key, value, type).
+
+    Returns:
+        str: e.g. '6 Sago Street, Singapore', or None without a street.
+    """
+    values = dict((row[2], row[3]) for row in tags)
+    street = values.get('street')
+    if street is None:
+        return None
+    if 'housenumber' in values:
+        street = values['housenumber'] + ' ' + street
+    return street + ', Singapore'
+
+
+def geocode_all(addresses, backend, workers=8, rate=1.0):
+    """Geocodes many addresses with a pool of threads.
+
+    Every distinct address is requested once.
+
+    Args:
+        addresses (iterable): The addresses.
+        backend (callable): Returns the result of an address (see above).
+        workers (int): Concurrent requests.
+        rate (float): Maximum requests per second, None for no limit. The
+            default is the limit of the public Nominatim server.
+
+    Returns:
+        dict: {address: result or None}. The addresses whose request failed
+        are left out.
+    """
+    limiter = RateLimiter(rate)
+
+    def geocode(address):
+        limiter.wait()
+        try:
+            return address, backend(address), None
+        except Exception as error:  #Timeouts, HTTP errors, ...
+            return address, None, error
+
+    results = {}
+    distinct = sorted(set(a for a in addresses if a))
+    pool = ThreadPool(workers)
+    try:
+        for address, result, error in pool.imap_unordered(geocode, distinct):
+            if error is None:
+                results[address] = result
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def suggest(review, geocoded):
+    """Turns the postcodes found into correction rules.
+
+    Args:
+        review (list): (problem, tags) pairs, like Database.review().
+        geocoded (dict): {address: result} of geocode_all().
+
+    Returns:
+        list: Rules in the format of corrections.json, setting or adding the
+        postcode of the elements, one per element even if it has several
+        problems.
+    """
+    rules = []
+    seen = set()
+    for problem, tags in review:
+        element = tags[0][0].lower()
+        if (element, int(problem[0])) in seen:
+            continue
+        seen.add((element, int(problem[0])))
+        result = geocoded.get(address_of(tags))
+        postcode = normalize_postcode((result or {}).get('postcode') or '')
+        if postcode is None:
+            continue
+        current = [row[3] for row in tags if row[2] == 'postcode']
+        if postcode in current:
+            continue
+        rule = {'element': element, 'ids': [int(problem[0])], 'key': 'postcode',
+                'to': postcode}
+        if current:
+            rule['action'] = 'set_value'
+        else:
+            rule.update(action='add_tag', type='addr')
+        rule['note'] = 'Geocoded: %s' % result.get('address')
+        rules.append(rule)
+    return rules
+
+
+def enrich(review, backend, workers=8, rate=1.0):
+    """Geocodes the addresses of the problem elements and suggests
+    corrections.
+
+    Args:
+        review (iterable): (problem, tags) pairs, like Database.review().
+        backend, workers, rate: See geocode_all().
+
+    Returns:
+        list: The suggested rules (see suggest()).
+    """
+    review = [(problem, tags) for problem, tags in review if tags]
+    geocoded = geocode_all([address_of(tags) for _, tags in review], backend,
+                           workers, rate)
+    return suggest(review, geocoded)
+
+
+def write_suggestions(rules, path):
+    """Writes suggested rules to a file in the format of corrections.json, to
+    be reviewed and merged into it."""
+    with open(path, 'w') as rules_file:
+        json.dump({'description': 'Suggested by wrangle_osm.enrich',
+                   'rules': rules}, rules_file, indent=2, sort_keys=True)
@@ -0,0 +1,434 @@
+"""Shaping, validation and export of the elements to .csv files.
+
+The output follows the schema of the database tables: one file for the nodes,
+the ways and the way nodes, and one for the tags of each element type.
+"""
+import csv
+import io
+import os
+import pprint
+import re
+import sys
+import xml.etree.cElementTree as ET
+
+from wrangle_osm.instrument import Instrumentation, clock
+
+PY2 = sys.version_info[0] == 2
+
+PROBLEMCHARS = re.compile(r'[=\+/&<>;\'\"\?%#$@\,\.\t\r\n]')
+
+SCHEMA = {
+    'node': {
+        'type': 'dict',
+        'schema': {
+            'id': {'required': True, 'type': 'integer', 'coerce': int},
+            'lat': {'required': True, 'type': 'float', 'coerce': float},
+            'lon': {'required': True, 'type': 'float', 'coerce': float},
+            'user': {'required': True, 'type': 'string'},
+            'uid': {'required': True, 'type': 'integer', 'coerce': int},
+            'version': {'required': True, 'type': 'string'},
+            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
+            'timestamp': {'required': True, 'type': 'string'}
+        }
+    },
+    'node_tags': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'key': {'required': True, 'type': 'string'},
+                'value': {'required': True, 'type': 'string'},
+                'type': {'required': True, 'type': 'string'}
+            }
+        }
+    },
+    'way': {
+        'type': 'dict',
+        'schema': {
+            'id': {'required': True, 'type': 'integer', 'coerce': int},
+            'user': {'required': True, 'type': 'string'},
+            'uid': {'required': True, 'type': 'integer', 'coerce': int},
+            'version': {'required': True, 'type': 'string'},
+            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
+            'timestamp': {'required': True, 'type': 'string'}
+        }
+    },
+    'way_nodes': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'node_id': {'required': True, 'type': 'integer', 'coerce': int},
+                'position': {'required': True, 'type': 'integer', 'coerce': int}
+            }
+        }
+    },
+    'way_tags': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'key': {'required': True, 'type': 'string'},
+                'value': {'required': True, 'type': 'string'},
+                'type': {'required': True, 'type': 'string'}
+            }
+        }
+    }
+}
+
+NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
+NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+
+#The .csv file and the fields of each key of the shaped elements
+OUTPUTS = [
+    ('node', 'nodes.csv', NODE_FIELDS),
+    ('node_tags', 'nodes_tags.csv', NODE_TAGS_FIELDS),
+    ('way', 'ways.csv', WAY_FIELDS),
+    ('way_nodes', 'ways_nodes.csv', WAY_NODES_FIELDS),
+    ('way_tags', 'ways_tags.csv', WAY_TAGS_FIELDS),
+]
+
+#The lookup tables of the dictionary encoded exports
+DICTIONARY_OUTPUTS = [
+    ('users', 'users.csv', ['uid', 'user']),
+]
+
+
+def _identity(string):
+    return string
+
+
+def shape_element(element, strings=None):
+    """Clean and shape node or way XML element to Python dict
+
+    Arrgs:
+        element (element): An element of the XML tree
+        strings (StringTable): Interns the users and the keys, types and
+            values of the tags, so the elements share the repeated strings
+            (see wrangle_osm.interning).
+
+    Returns:
+        dict: if element is a node, the node's attributes and tags.
+              if element is a way, the ways attributes and tags along with the nodes that form the way.
+    """
+    node_attribs = {}
+    way_attribs = {}
+    way_nodes = []
+    tags = [
+    ]  # Handle secondary tags the same way for both node and way elements
+    intern = _identity if strings is None else strings.intern
+    if element.tag == 'node':
+        for field in NODE_FIELDS:
+            node_attribs[field] = element.get(field)
+        node_attribs['user'] = intern(node_attribs['user'])
+        for child in element:
+            if child.tag == 'tag':
+                tag = {'id': node_attribs['id']}
+                k = child.get('k')
+                if not PROBLEMCHARS.search(k):
+                    k = k.split(':', 1)
+                    tag['key'] = intern(k[-1])
+                    tag['value'] = intern(child.get('v'))
+                    if len(k) == 1:
+                        tag['type'] = 'regular'
+                    elif len(k) == 2:
+                        tag['type'] = intern(k[0])
+                    tags.append(tag)  #Tags with problematic keys are ignored
+        return {'node': node_attribs, 'node_tags': tags}
+    elif element.tag == 'way':
+        counter = 0
+        for field in WAY_FIELDS:
+            way_attribs[field] = element.get(field)
+        way_attribs['user'] = intern(way_attribs['user'])
+        for child in element:
+            if child.tag == 'tag':
+                tag = {'id': way_attribs['id']}
+                k = child.get('k')
+                if not PROBLEMCHARS.search(k):
+                    k = k.split(':', 1)
+                    tag['key'] = intern(k[-1])
+                    tag['value'] = intern(child.get('v'))
+                    if len(k) == 1:
+                        tag['type'] = 'regular'
+                    elif len(k) == 2:
+                        tag['type'] = intern(k[0])
+                    tags.append(tag)  #Tags with problematic keys are ignored
+            if child.tag == 'nd':
+                nd = {'id': way_attribs['id']}
+                nd['node_id'] = child.get('ref')
+                nd['position'] = counter
+                way_nodes.append(nd)
+            counter += 1
+        return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+
+
+def validate_element(element, validator, schema=SCHEMA):
+    """Raise ValidationError if element does not match schema
+
+    Args:
+        element (element): An element of the tree
+        validator (cerberus.validator): a validator
+        schema (dict): The schema to validate element against.
+
+    Returns:
+        Nothing
+
+        """
+    if validator.validate(element, schema) is not True:
+        field, errors = next(iter(validator.errors.items()))
+        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
+        error_string = pprint.pformat(errors)
+
+        raise Exception(message_string.format(field, error_string))
+
+
+class UnicodeDictWriter(csv.DictWriter, object):
+    """Extend csv.DictWriter to handle Unicode input"""
+
+    #Encoded strings kept for reuse, e.g. the users and the keys
+    max_cached = 100000
+
+    def __init__(self, *args, **kwargs):
+        super(UnicodeDictWriter, self).__init__(*args, **kwargs)
+        self._encoded = {}
+
+    def _encode(self, value):
+        encoded = self._encoded.get(value)
+        if encoded is None:
+            encoded = value.encode('utf-8')
+            if len(self._encoded) < self.max_cached:
+                self._encoded[value] = encoded
+        return encoded
+
+    def writerow(self, row):
+        if PY2:
+            row = {
+                k: (self._encode(v) if isinstance(v, unicode) else v)
+                for k, v in row.iteritems()
+            }
+        super(UnicodeDictWriter, self).writerow(row)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+
+def iter_top_level(path):
+    """Iterates over the top-level elements (nodes, ways, relations) of an
+    .osm file.
+
+    The elements are cleared once the caller is done with them, so memory use
+    does not grow with the size of the file. path can be a file opened in
+    binary mode, e.g. to follow the progress with its tell().
+    """
+    context = ET.iterparse(path, events=('start', 'end'))
+    _, root = next(context)
+    depth = 0
+    for event, element in context:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            yield element
+            element.clear()
+            root.clear()
+
+
+def open_csv(path, mode='w'):
+    """Opens a .csv file the way the csv module expects it on each Python version."""
+    if PY2:
+        return open(path, mode + 'b')
+    return io.open(path, mode, encoding='utf-8', newline='')
+
+
+class CsvWriters(object):
+    """The writers of the five output files of an export.
+
+    With dictionary=True, the user names are written once per uid to
+    users.csv instead of on every row of nodes.csv and ways.csv.
+
+    Args:
+        out_dir (str): The directory of the .csv files.
+        dictionary (bool): Write the lookup tables of DICTIONARY_OUTPUTS.
+        append (bool): Append to the files of an earlier CsvWriters instead of
+            starting new ones.
+        users (dict): The {uid: user} of an enclosing writer, e.g.
+            TiledWriters, that writes the lookup tables itself. The rows are
+            still encoded, but close() does not write the tables.
+    """
+
+    def __init__(self, out_dir='.', dictionary=False, append=False,
+                 users=None):
+        self.out_dir = out_dir
+        self.dictionary = dictionary
+        self.owns_users = users is None
+        self.users = {} if users is None else users
+        self.files = []
+        self.writers = {}
+        for key, filename, fields in OUTPUTS:
+            csv_file = open_csv(os.path.join(out_dir, filename),
+                                'a' if append else 'w')
+            self.files.append(csv_file)
+            self.writers[key] = UnicodeDictWriter(csv_file, fields)
+            if not append:
+                self.writers[key].writeheader()
+
+    def _encode(self, attribs):
+        """Moves the user name to the users table."""
+        if attribs['uid'] not in self.users:
+            self.users[attribs['uid']] = attribs['user']
+        return dict(attribs, user=None)
+
+    def write(self, el):
+        """Writes a shaped element to the files it belongs."""
+        if 'node' in el:
+            node = el['node']
+            if self.dictionary:
+                node = self._encode(node)
+            self.writers['node'].writerow(node)
+            self.writers['node_tags'].writerows(el['node_tags'])
+        elif 'way' in el:
+            way = el['way']
+            if self.dictionary:
+                way = self._encode(way)
+            self.writers['way'].writerow(way)
+            self.writers['way_nodes'].writerows(el['way_nodes'])
+            self.writers['way_tags'].writerows(el['way_tags'])
+
+    def close(self):
+        for csv_file in self.files:
+            csv_file.close()
+        if self.dictionary and self.owns_users:
+            write_dictionary(self.out_dir, self.users)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_dictionary(out_dir, users):
+    """Writes the lookup tables of DICTIONARY_OUTPUTS.
+
+    Args:
+        out_dir (str): The directory of the .csv files.
+        users (dict): {uid: user}.
+    """
+    rows = {
+        'users': [{'uid': uid, 'user': user}
+                  for uid, user in sorted(users.items(),
+                                          key=lambda i: int(i[0]))],
+    }
+    for key, filename, fields in DICTIONARY_OUTPUTS:
+        with open_csv(os.path.join(out_dir, filename)) as csv_file:
+            writer = UnicodeDictWriter(csv_file, fields)
+            writer.writeheader()
+            writer.writerows(rows[key])
+
+
+def process_map(elements, out_dir='.', validate=True, strict=True,
+                instrumentation=None, corrections=None, consumers=(),
+                strings=None, dictionary=False, tiles=None):
+    """Iteratively process each XML element and write to csv(s)
+
+    The elements should be cleaned (update_street_type(), fix_pcodes()) before
+    they are exported.
+
+    Arrgs:
+        elements (iterable): The elements to export, e.g. the root of the tree
+            or the elements of wrangle_osm.pbf.iter_elements().
+        out_dir (str): The directory of the .csv files.
+        validate (bool): Validate the data before write them to csv or not
+        strict (bool): Raise on the first invalid element. Otherwise invalid
+            elements are counted and skipped.
+        instrumentation (Instrumentation): Collects stage timers and counters
+            and reports the progress (see wrangle_osm.instrument).
+        corrections (Corrections): Rules applied to the shaped elements before
+            they are validated (see wrangle_osm.corrections).
+        consumers (list): Callables that get every element too, e.g. an
+            AuditRun (see wrangle_osm.auditors), so they share the parse.
+        strings (StringTable): Interns the repeated strings of the elements
+            (see shape_element()).
+        dictionary (bool): Write the users as a lookup table
+            (see CsvWriters). With tiles, the tables are written once, in
+            out_dir, for all the tiles.
+        tiles (Quadkeys, Grid or TiledWriters): Partition the output in
+            geographic tiles, one directory each (see wrangle_osm.tiles). A
+            TiledWriters keeps its own dictionary argument.
+
+    Returns:
+        Nothing
+    """
+    if validate is True:
+        import cerberus
+        validator = cerberus.Validator()
+
+    #Without instrumentation, the stats are collected but never reported
+    stats = instrumentation or Instrumentation(interval=None)
+    if stats.total is None and hasattr(elements, '__len__'):
+        stats.total = len(elements)
+
+    if tiles is not None:
+        from wrangle_osm.tiles import TiledWriters
+        writers = tiles if isinstance(tiles, TiledWriters) else \
+            TiledWriters(out_dir, tiles, dictionary=dictionary)
+    else:
+        writers = CsvWriters(out_dir, dictionary)
+
+    with stats, writers:
+        for element in elements:
+            if consumers:
+                t0 = clock()
+                for consumer in consumers:
+                    consumer(element)
+                stats.add_time('consumers', clock() - t0)
+            t0 = clock()
+            el = shape_element(element, strings)
+            t1 = clock()
+            stats.add_time('shape', t1 - t0)
+            if el:
+                _count_element(stats, element, el)
+                if corrections is not None:
+                    el = corrections.apply(el)
+                    t0, t1 = t1, clock()
+                    stats.add_time('correct', t1 - t0)
+                    if el is None:
+                        stats.count('deleted')
+                if el and validate is True:
+                    try:
+                        validate_element(el, validator)
+                    except Exception:
+                        stats.count('validation_failures')
+                        if strict:
+                            raise
+                        el = None
+                    t0, t1 = t1, clock()
+                    stats.add_time('validate', t1 - t0)
+                if el:
+                    writers.write(el)
+                    stats.add_time('write', clock() - t1)
+            stats.tick()
+
+
+def _count_element(stats, element, el):
+    """Updates the counters of the instrumentation for a shaped element."""
+    if 'node' in el:
+        stats.count('nodes')
+        tags = el['node_tags']
+    else:
+        stats.count('ways')
+        tags = el['way_tags']
+        stats.count('nds', len(el['way_nodes']))
+    stats.count('tags', len(tags))
+    #shape_element() drops the tags whose key matches PROBLEMCHARS
+    problem_keys = len(element.findall('tag')) - len(tags)
+    if problem_keys:
+        stats.count('problem_keys', problem_keys)
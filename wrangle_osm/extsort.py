@@ -0,0 +1,204 @@
+"""External merge sort of the .csv files, within a memory budget.
+
+The rows of an export are in the order of the input file, and the exports of
+a tiled run (see wrangle_osm.tiles) or of several shards are split in many
+files. sort_csv() orders any of them by id, whatever their size: the rows are
+read in runs that fit in the memory budget, each run is sorted and spilled to
+a temporary file, and the runs are merged with a heap, at most max_open files
+at a time.
+
+    sort_csv(['a/ways_nodes.csv', 'b/ways_nodes.csv'], 'ways_nodes.csv',
+             'way_nodes', memory=256 * 2**20)
+    sort_export('csv', 'sorted')                   #The five tables
+
+    python -m wrangle_osm sort csv/ -o sorted/ --memory 256
+
+The order is (id) for nodes and ways, (id, type, key) for the tags and
+(id, position) for the way nodes, with the ids and positions compared as
+integers. Rows with the same key keep their input order.
+"""
+from __future__ import print_function
+
+import csv
+import heapq
+import os
+import shutil
+import tempfile
+
+from wrangle_osm.export import OUTPUTS, PY2, open_csv
+
+#Key columns of every output, the integer ones first
+SORT_KEYS = {
+    'node': (('id', ), ()),
+    'way': (('id', ), ()),
+    'node_tags': (('id', ), ('type', 'key')),
+    'way_tags': (('id', ), ('type', 'key')),
+    'way_nodes': (('id', 'position'), ()),
+}
+#Approximate bytes of a row in memory, besides the bytes of its fields
+ROW_OVERHEAD = 120
+FIELD_OVERHEAD = 60
+
+DEFAULT_MEMORY = 256 * 2 ** 20
+
+
+def _read(path):
+    return open(path, 'rb') if PY2 else open_csv(path, 'r')
+
+
+def key_function(header, output):
+    """The sort key of the rows of an output, e.g. (123, 'addr', 'street')."""
+    integers, strings = SORT_KEYS[output]
+    integers = [header.index(column) for column in integers]
+    strings = [header.index(column) for column in strings]
+
+    def key(row):
+        return (tuple(int(row[i]) for i in integers) +
+                tuple(row[i] for i in strings))
+    return key
+
+
+def _temp_path(directory):
+    handle, path = tempfile.mkstemp(suffix='.csv', dir=directory)
+    os.close(handle)
+    return path
+
+
+def _spill(rows, key, directory):
+    """Sorts a run and writes it to a temporary file."""
+    rows.sort(key=key)  #Stable: equal keys keep the input order
+    path = _temp_path(directory)
+    with open_csv(path) as run_file:
+        csv.writer(run_file).writerows(rows)
+    return path
+
+
+def _iter_run(path, key, number):
+    """The rows of a run, decorated to be merged: (key, run number, row)."""
+    with _read(path) as run_file:
+        for row in csv.reader(run_file):
+            yield key(row), number, row
+
+
+def _merge(paths, key, out_file):
+    """Merges sorted runs into a writer, the earlier run first on ties."""
+    writer = csv.writer(out_file)
+    runs = [_iter_run(path, key, number) for number, path in enumerate(paths)]
+    for _, _, row in heapq.merge(*runs):
+        writer.writerow(row)
+
+
+def sort_csv(inputs, output_path, output, memory=DEFAULT_MEMORY, max_open=64,
+             tmp_dir=None):
+    """Sorts .csv files of an output into one file.
+
+    Args:
+        inputs (str or list): The .csv file(s), with the same header.
+        output_path (str): The sorted file, can be one of the inputs.
+        output (str): The output of the files, e.g. 'way_nodes' (see OUTPUTS).
+        memory (int): Bytes of rows kept in memory, approximately.
+        max_open (int): Runs merged at a time, at least 2.
+        tmp_dir (str): Where the runs are spilled, by default the directory
+            of output_path. The sorted file is always written next to
+            output_path, so tmp_dir can be on another filesystem.
+
+    Returns:
+        int: The number of rows.
+    """
+    if max_open < 2:
+        raise ValueError('max_open must be at least 2, not %r' % max_open)
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    out_dir = os.path.dirname(os.path.abspath(output_path))
+    directory = tempfile.mkdtemp(dir=tmp_dir or out_dir)
+    sorted_path = None
+    try:
+        header, runs, rows, size, count = None, [], [], 0, 0
+        for path in inputs:
+            with _read(path) as csv_file:
+                reader = csv.reader(csv_file)
+                file_header = next(reader)
+                if header is None:
+                    header = file_header
+                    key = key_function(header, output)
+                elif file_header != header:
+                    raise ValueError('%s: the header is not %s' % (
+                        path, ','.join(header)))
+                for row in reader:
+                    rows.append(row)
+                    count += 1
+                    size += ROW_OVERHEAD + sum(FIELD_OVERHEAD + len(field)
+                                               for field in row)
+                    if size >= memory:
+                        runs.append(_spill(rows, key, directory))
+                        rows, size = [], 0
+        if header is None:
+            raise ValueError('No input files')
+
+        #Merge the first runs max_open at a time until the last merge, so
+        #the runs stay in the input order
+        while len(runs) + bool(rows) > max_open:
+            merged = _temp_path(directory)
+            with open_csv(merged) as out_file:
+                _merge(runs[:max_open], key, out_file)
+            for path in runs[:max_open]:
+                os.remove(path)
+            runs = [merged] + runs[max_open:]
+        if rows:
+            runs.append(_spill(rows, key, directory))
+            del rows[:]
+        #os.rename() cannot move a file across filesystems, so the last
+        #merge is written in the directory of output_path
+        sorted_path = _temp_path(out_dir)
+        with open_csv(sorted_path) as out_file:
+            csv.writer(out_file).writerow(header)
+            _merge(runs, key, out_file)
+        os.rename(sorted_path, output_path)
+        sorted_path = None
+    finally:
+        shutil.rmtree(directory)
+        if sorted_path is not None and os.path.exists(sorted_path):
+            os.remove(sorted_path)
+    return count
+
+
+def sort_export(csv_dirs, out_dir=None, memory=DEFAULT_MEMORY, max_open=64):
+    """Sorts the five .csv files of exports.
+
+    Args:
+        csv_dirs (str or list): The directory of an export, or of many
+            (e.g. the tiles of a tiled export) merged together.
+        out_dir (str): Where the sorted files are written, by default in
+            place (with a single directory).
+
+    Returns:
+        dict: The number of rows of every file.
+    """
+    if isinstance(csv_dirs, str):
+        csv_dirs = [csv_dirs]
+    if out_dir is None:
+        if len(csv_dirs) != 1:
+            raise ValueError('Merging many exports needs an out_dir')
+        out_dir = csv_dirs[0]
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    counts = {}
+    for output, filename, _ in OUTPUTS:
+        counts[filename] = sort_csv(
+            [os.path.join(d, filename) for d in csv_dirs],
+            os.path.join(out_dir, filename), output, memory, max_open)
+    return counts
+
+
+def is_sorted(path, output):
+    """Whether the rows of a .csv file are in the order of sort_csv()."""
+    with _read(path) as csv_file:
+        reader = csv.reader(csv_file)
+        key = key_function(next(reader), output)
+        previous = None
+        for row in reader:
+            current = key(row)
+            if previous is not None and current < previous:
+                return False
+            previous = current
+    return True
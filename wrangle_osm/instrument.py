@@ -0,0 +1,229 @@
+"""Instrumentation of long running loops like process_map().
+
+An Instrumentation object collects per-stage timers and counters, prints a
+progress line with the throughput and the ETA every few seconds and can wrap
+the loop in cProfile or in a lightweight sampling profiler:
+
+    stats = Instrumentation(total=len(root), profile='process_map.prof')
+    process_map(root, instrumentation=stats)
+    stats.report()
+
+When the number of elements is not known in advance, like when an .osm file is
+streamed, the ETA is estimated from the bytes of the input read so far:
+
+    with open('Singapore.osm', 'rb') as osm_file:
+        stats = Instrumentation(size=os.path.getsize('Singapore.osm'),
+                                position=osm_file.tell)
+        process_map(iter_top_level(osm_file), instrumentation=stats)
+"""
+from __future__ import division, print_function
+
+import cProfile
+import signal
+import sys
+import traceback
+from collections import Counter, defaultdict
+
+try:
+    from time import perf_counter as clock
+except ImportError:  #Python 2
+    from timeit import default_timer as clock
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+class SamplingProfiler(object):
+    """Samples the stack of the main thread with a profiling timer signal.
+
+    Much cheaper than cProfile on long runs, as the cost does not depend on the
+    number of function calls. Only available on Unix.
+
+    Args:
+        interval (float): Seconds of CPU time between two samples.
+        depth (int): Number of stack frames kept per sample.
+    """
+
+    def __init__(self, interval=0.005, depth=8):
+        self.interval = interval
+        self.depth = depth
+        self.samples = Counter()
+
+    def _sample(self, signum, frame):
+        stack = traceback.extract_stack(frame, self.depth)
+        self.samples[tuple((f[0], f[1], f[2]) for f in stack)] += 1
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def top(self, n=20):
+        """The functions the samples landed in most often.
+
+        Returns:
+            list: (filename, line, function, percentage of samples) tuples
+        """
+        total = sum(self.samples.values()) or 1
+        frames = Counter()
+        for stack, count in self.samples.items():
+            frames[stack[-1]] += count
+        return [frame + (100 * count / total, )
+                for frame, count in frames.most_common(n)]
+
+    def dump(self, path):
+        """Writes the samples in the collapsed stack format of flamegraph.pl."""
+        with open(path, 'w') as out:
+            for stack, count in self.samples.items():
+                out.write(';'.join('%s:%s' % (f[2], f[1]) for f in stack))
+                out.write(' %d\n' % count)
+
+
+class Instrumentation(object):
+    """Timers, counters and progress reporting for a processing loop.
+
+    Args:
+        total (int): Expected number of elements, used for the ETA.
+        size (int): Bytes of the input, used for the ETA without a total.
+        position (callable): Returns the bytes of the input read so far,
+            e.g. the tell() of the input file.
+        interval (float): Seconds between two progress lines. None disables
+            the progress line.
+        profile (str): Profile the loop and write the results to this path.
+        profiler (str): 'cprofile' (pstats output) or 'sampling' (collapsed
+            stacks, see SamplingProfiler).
+        name (str): Prefix of the progress lines.
+        stream (file): Where the progress lines are written.
+    """
+
+    def __init__(self, total=None, interval=10.0, profile=None,
+                 profiler='cprofile', name='process_map', stream=None,
+                 size=None, position=None):
+        self.total = total
+        self.size = size
+        self.position = position
+        self.interval = interval
+        self.profile = profile
+        self.profiler = profiler
+        self.name = name
+        self.stream = stream or sys.stderr
+        self.timers = defaultdict(float)
+        self.counters = Counter()
+        self.elements = 0
+        self.started = None
+        self.finished = None
+        self._next_report = None
+        self._profiler = None
+
+    # ### Collection
+
+    def add_time(self, stage, seconds):
+        self.timers[stage] += seconds
+
+    def count(self, counter, n=1):
+        self.counters[counter] += n
+
+    def tick(self, n=1):
+        """Marks the end of the processing of n elements."""
+        self.elements += n
+        if self._next_report is not None and self.elements % 1000 == 0:
+            now = clock()
+            if now >= self._next_report:
+                self._next_report = now + self.interval
+                self.progress(now)
+
+    # ### Loop boundaries
+
+    def start(self):
+        self.started = clock()
+        if self.interval is not None:
+            self._next_report = self.started + self.interval
+        if self.profile:
+            if self.profiler == 'sampling':
+                self._profiler = SamplingProfiler()
+                self._profiler.start()
+            else:
+                self._profiler = cProfile.Profile()
+                self._profiler.enable()
+
+    def stop(self):
+        self.finished = clock()
+        if isinstance(self._profiler, SamplingProfiler):
+            self._profiler.stop()
+            self._profiler.dump(self.profile)
+        elif self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.profile)
+        if self.interval is not None:
+            self.progress(self.finished)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # ### Reporting
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or clock()) - self.started
+
+    def progress(self, now=None):
+        """Prints a progress line with the throughput and the ETA."""
+        elapsed = (now or clock()) - self.started
+        rate = self.elements / elapsed if elapsed else 0.0
+        line = '[%s] %d elements in %s (%.0f/s)' % (
+            self.name, self.elements, _format_duration(elapsed), rate)
+        if self.total:
+            done = self.elements / self.total
+        elif self.size and self.position is not None:
+            #The parsers read ahead, so this is a little optimistic
+            done = min(1.0, self.position() / self.size)
+        else:
+            done = None
+        if done is not None:
+            line += ' %.1f%%' % (100 * done)
+            if rate and 0 < done < 1:
+                line += ' ETA %s' % _format_duration(elapsed * (1 - done) /
+                                                     done)
+        if self.timers:
+            line += ' | ' + ' '.join('%s %.1fs' % item
+                                     for item in sorted(self.timers.items()))
+        print(line, file=self.stream)
+        self.stream.flush()
+
+    def summary(self):
+        """The collected measurements as a dict."""
+        result = {
+            'elements': self.elements,
+            'seconds': self.elapsed,
+            'elements_per_sec': self.elements / self.elapsed if self.elapsed else None,
+            'timers': dict(self.timers),
+            'counters': dict(self.counters)
+        }
+        if isinstance(self._profiler, SamplingProfiler):
+            result['hotspots'] = self._profiler.top()
+        return result
+
+    def report(self):
+        """Prints the timers and counters."""
+        summary = self.summary()
+        print('%s: %d elements in %.1fs (%.0f/s)' % (
+            self.name, summary['elements'], summary['seconds'],
+            summary['elements_per_sec'] or 0), file=self.stream)
+        for stage, seconds in sorted(self.timers.items(), key=lambda i: -i[1]):
+            print('  %-12s %8.2fs %5.1f%%' % (
+                stage, seconds, 100 * seconds / (summary['seconds'] or 1)),
+                  file=self.stream)
+        for counter, value in sorted(self.counters.items()):
+            print('  %-20s %d' % (counter, value), file=self.stream)
@@ -0,0 +1,199 @@
+"""Referential integrity of the way nodes, checked before the import.
+
+Extracts cut by a bounding box keep the ways that cross the border, with
+references to nodes that are not in the file. COPY then fails on
+ways_nodes_node_id_fkey, after every other table has been loaded. check()
+finds the dangling references of an export up front, and repair() drops them
+along with the ways left with less than two nodes:
+
+    report = integrity.check('csv')
+    if report.dangling:
+        integrity.repair('csv')
+
+The node ids are kept in a sorted int64 array, and the node_id column of
+ways_nodes.csv is looked up in it with a single numpy searchsorted; the
+results are aggregated per way with np.unique. Without numpy, the same lookup
+is done with bisect on an array of the ids, and aggregated in a loop.
+"""
+from __future__ import print_function
+
+import csv
+import os
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:  #numpy is optional, bisect is used instead
+    np = None
+
+from wrangle_osm.export import PY2, open_csv
+
+try:
+    array('q')
+    INT64 = 'q'
+except ValueError:  #Python 2, where long is 64 bits on 64 bit Unix
+    INT64 = 'l'
+
+
+class Report(namedtuple('Report', 'nodes way_nodes dangling broken_ways '
+                        'short_ways')):
+    """The integrity of an export.
+
+    nodes (int): Rows of nodes.csv.
+    way_nodes (int): Rows of ways_nodes.csv.
+    dangling (int): Rows of ways_nodes.csv referencing missing nodes.
+    broken_ways (set): Ids of the ways with dangling references.
+    short_ways (set): Ids of the ways with less than two distinct existing
+        nodes.
+    """
+
+    __slots__ = ()
+
+
+def _read(path):
+    return open(path, 'rb') if PY2 else open_csv(path, 'r')
+
+
+def read_column(path, column):
+    """Reads an integer column of a .csv file.
+
+    Returns:
+        array: The values, as signed 64 bit integers.
+    """
+    with _read(path) as csv_file:
+        reader = csv.reader(csv_file)
+        index = next(reader).index(column)
+        return array(INT64, (int(row[index]) for row in reader))
+
+
+class NodeIndex(object):
+    """A sorted array of node ids.
+
+    Args:
+        ids (iterable): The node ids, in any order.
+    """
+
+    def __init__(self, ids):
+        if np is not None:
+            self.ids = np.unique(np.asarray(ids, dtype=np.int64))
+        else:
+            self.ids = array(INT64, sorted(set(ids)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def contains(self, values):
+        """Looks up many ids at once.
+
+        Returns:
+            list or numpy.ndarray: A boolean for every value.
+        """
+        ids = self.ids
+        if np is not None:
+            values = np.asarray(values, dtype=np.int64)
+            positions = np.searchsorted(ids, values)
+            found = positions < len(ids)
+            found[found] = ids[positions[found]] == values[found]
+            return found
+        n = len(ids)
+        result = []
+        for value in values:
+            i = bisect_left(ids, value)
+            result.append(i < n and ids[i] == value)
+        return result
+
+
+def check(csv_dir):
+    """Finds the dangling references of ways_nodes.csv.
+
+    Args:
+        csv_dir (str): The directory of the .csv files.
+
+    Returns:
+        Report: The counts and the affected ways.
+    """
+    index = NodeIndex(read_column(os.path.join(csv_dir, 'nodes.csv'), 'id'))
+    path = os.path.join(csv_dir, 'ways_nodes.csv')
+    way_ids = read_column(path, 'id')
+    node_ids = read_column(path, 'node_id')
+    found = index.contains(node_ids)
+
+    if np is not None:
+        way_ids = np.asarray(way_ids, dtype=np.int64)
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        broken = np.unique(way_ids[~found])
+        #Closed ways repeat their first node, so the distinct pairs are counted
+        pairs = np.unique(np.column_stack((way_ids[found], node_ids[found])),
+                          axis=0)
+        ways, counts = np.unique(pairs[:, 0], return_counts=True)
+        short = np.setdiff1d(way_ids, ways[counts >= 2])
+        return Report(len(index), len(way_ids), int((~found).sum()),
+                      set(broken.tolist()), set(short.tolist()))
+
+    broken, existing = set(), {}
+    for way_id, node_id, ok in zip(way_ids, node_ids, found):
+        if ok:
+            existing.setdefault(way_id, set()).add(node_id)
+        else:
+            broken.add(way_id)
+    short = set(w for w in set(way_ids) if len(existing.get(w, ())) < 2)
+    return Report(len(index), len(way_ids), len(way_ids) - found.count(True),
+                  broken, short)
+
+
+def _filter_csv(path, keep):
+    """Rewrites a .csv file with the rows for which keep(row) is true.
+
+    Returns:
+        int: The number of rows dropped.
+    """
+    tmp_path = path + '.tmp'
+    dropped = 0
+    with _read(path) as src, open_csv(tmp_path) as dst:
+        reader, writer = csv.reader(src), csv.writer(dst)
+        header = next(reader)
+        writer.writerow(header)
+        for row in reader:
+            if keep(dict(zip(header, row))):
+                writer.writerow(row)
+            else:
+                dropped += 1
+    os.rename(tmp_path, path)
+    return dropped
+
+
+def repair(csv_dir, report=None):
+    """Drops the dangling references and the ways left with less than two
+    nodes (with their tags and way nodes), in place.
+
+    The positions of the remaining way nodes are kept as they are, like the
+    cascading delete of a node in the database.
+
+    Args:
+        csv_dir (str): The directory of the .csv files.
+        report (Report): The result of check(), computed if not given.
+
+    Returns:
+        dict: The rows dropped from every file.
+    """
+    report = report or check(csv_dir)
+    index = NodeIndex(read_column(os.path.join(csv_dir, 'nodes.csv'), 'id'))
+    short = set(str(w) for w in report.short_ways)
+    broken = set(str(w) for w in report.broken_ways)
+
+    def keep_way_node(row):
+        if row['id'] in short:
+            return False
+        if row['id'] in broken:
+            return bool(index.contains([int(row['node_id'])])[0])
+        return True
+
+    dropped = {}
+    for filename, keep in [
+            ('ways_nodes.csv', keep_way_node),
+            ('ways.csv', lambda row: row['id'] not in short),
+            ('ways_tags.csv', lambda row: row['id'] not in short)]:
+        dropped[filename] = _filter_csv(os.path.join(csv_dir, filename), keep)
+    return dropped
@@ -0,0 +1,68 @@
+"""Dictionary encoding of the repeated strings of an extract.
+
+A few thousand users, tag keys and types, and values like 'yes' or
+'residential' make up most of the strings of an extract. A StringTable gives
+every distinct string an integer code and keeps a single instance of it, so
+the shaped elements share their strings instead of holding copies:
+
+    strings = StringTable()
+    el = shape_element(element, strings)
+    strings.code('residential')     #An int
+    strings.string(3)               #The string of a code
+
+The table keeps every string it codes until it is dropped, so by default it
+stops growing at DEFAULT_MAX_SIZE strings (about 10 MB): the repeated strings
+are seen early, and the unique values (names, notes) met later are returned
+as they are.
+
+The export can also write the users as a lookup table (see
+CsvWriters(dictionary=True)).
+"""
+
+DEFAULT_MAX_SIZE = 100000
+
+
+class StringTable(object):
+    """Integer codes for strings, in the order they are first seen.
+
+    Args:
+        max_size (int): Stop adding strings after this many, so unique values
+            (names, notes) cannot grow the table without limit. The strings
+            seen after that are returned as they are and get no code. None
+            for a table without limit, when every string needs a code.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.codes = {}
+        self.strings = []
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __contains__(self, string):
+        return string in self.codes
+
+    def code(self, string):
+        """Returns the code of a string, adding it if needed (None if the
+        table is full)."""
+        code = self.codes.get(string)
+        if code is None and (self.max_size is None or
+                             len(self.strings) < self.max_size):
+            code = self.codes[string] = len(self.strings)
+            self.strings.append(string)
+        return code
+
+    def intern(self, string):
+        """Returns the instance of the string held by the table."""
+        if string is None:
+            return None
+        code = self.code(string)
+        return string if code is None else self.strings[code]
+
+    def string(self, code):
+        return self.strings[code]
+
+    def items(self):
+        """Returns [(code, string), ...]."""
+        return list(enumerate(self.strings))
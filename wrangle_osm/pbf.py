@@ -0,0 +1,764 @@
+"""Reader for the OpenStreetMap PBF (protobuf) format.
+
+A .pbf file is a sequence of independently compressed blobs, so the blobs are
+read in the main process and decoded by a pool of worker processes. Every
+decoded node and way is handed back as an ElementTree element with the same
+attributes and <tag>/<nd> children as the XML export, so anything that consumes
+the output of ET.parse()/iterparse() (e.g. shape_element()) works unchanged.
+
+The protobuf wire format is decoded by hand, so no protobuf library is needed.
+If numpy is installed, the packed varints and the delta-encoded ids, coordinates
+and metadata of DenseNodes and way refs are decoded in vectorized form.
+"""
+from __future__ import division, print_function
+
+import calendar
+import multiprocessing
+import struct
+import time
+import xml.etree.cElementTree as ET
+import zlib
+from collections import deque
+from itertools import chain, repeat
+
+try:
+    import numpy as np
+except ImportError:  #numpy is optional, the pure Python decoder is used instead
+    np = None
+
+try:
+    from itertools import accumulate
+except ImportError:  #Python 2
+
+    def accumulate(values):
+        total = 0
+        for value in values:
+            total += value
+            yield total
+
+
+#Protobuf wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+MEMBER_TYPES = ('node', 'way', 'relation')
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+#Blobs bigger than this are not allowed by the format specification
+MAX_BLOB_SIZE = 32 * 1024 * 1024
+
+#Packed fields shorter than this (e.g. the tags and refs of most ways) are
+#decoded faster in pure Python than with the fixed overhead of numpy calls
+NP_MIN_BYTES = 96
+
+
+# ### Protobuf wire format
+
+
+def _read_varint(buf, pos):
+    '''Decodes a single varint.
+
+    Args:
+        buf (bytes): The message.
+        pos (int): The offset of the varint in the message.
+
+    Returns:
+        tuple: (value, offset of the next field)
+    '''
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(buf):
+    '''Iterates over the fields of a protobuf message.
+
+    Args:
+        buf (bytes): The message.
+
+    Yields:
+        tuple: (field number, wire type, value). The value is an int for varints
+        and a bytes slice for length delimited fields.
+    '''
+    buf = bytearray(buf)
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 0x07
+        if wire_type == VARINT:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == LENGTH_DELIMITED:
+            size, pos = _read_varint(buf, pos)
+            value = bytes(buf[pos:pos + size])
+            pos += size
+        elif wire_type == FIXED64:
+            value = struct.unpack('<q', bytes(buf[pos:pos + 8]))[0]
+            pos += 8
+        elif wire_type == FIXED32:
+            value = struct.unpack('<i', bytes(buf[pos:pos + 4]))[0]
+            pos += 4
+        else:
+            raise ValueError('Unsupported wire type %d' % wire_type)
+        yield field, wire_type, value
+
+
+def _to_signed(value):
+    '''Reinterprets an unsigned 64 bit varint as a two's complement int64.'''
+    return value - (1 << 64) if value & (1 << 63) else value
+
+
+def _unzigzag(value):
+    '''Decodes a zigzag encoded (sint32/sint64) value.'''
+    return (value >> 1) ^ -(value & 1)
+
+
+def _packed_varints(buf):
+    '''Decodes a packed repeated varint field to a list of unsigned ints.'''
+    if np is not None and len(buf) >= NP_MIN_BYTES:
+        return _np_varints(buf).tolist()
+    buf = bytearray(buf)
+    result = []
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        value, pos = _read_varint(buf, pos)
+        result.append(value)
+    return result
+
+
+def _packed_signed(buf):
+    '''Decodes a packed int32/int64 field.'''
+    if np is not None and len(buf) >= NP_MIN_BYTES:
+        return _np_varints(buf).astype(np.int64).tolist()
+    return [_to_signed(v) for v in _packed_varints(buf)]
+
+
+def _packed_delta(buf):
+    '''Decodes a packed, zigzag and delta encoded sint64 field.'''
+    if np is not None and len(buf) >= NP_MIN_BYTES:
+        return np.cumsum(_np_unzigzag(_np_varints(buf))).tolist()
+    return list(accumulate(_unzigzag(v) for v in _packed_varints(buf)))
+
+
+def _np_varints(buf):
+    '''Vectorized decoding of a packed repeated varint field.
+
+    Every byte with the high bit unset terminates a varint, so the terminators
+    give the boundaries of the values and the position of each byte inside its
+    value gives the shift of its 7 payload bits.
+
+    Args:
+        buf (bytes): The packed field.
+
+    Returns:
+        numpy.ndarray: The decoded values as uint64.
+    '''
+    data = np.frombuffer(buf, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shifts = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    payload = (data & 0x7f).astype(np.uint64) << (7 * shifts).astype(np.uint64)
+    return np.bitwise_or.reduceat(payload, starts)
+
+
+def _np_unzigzag(values):
+    '''Vectorized zigzag decoding of uint64 values to int64.'''
+    values = values.astype(np.int64)
+    return (values >> 1) ^ -(values & 1)
+
+
+# ### File structure
+
+
+def iter_blobs(path):
+    '''Reads the raw blobs of a .pbf file without decompressing them.
+
+    Args:
+        path (str or file): The .pbf file, or the file opened in binary mode
+            (e.g. to follow the progress with its tell()).
+
+    Yields:
+        tuple: (blob type, serialized Blob message). The type is either
+        'OSMHeader' or 'OSMData'.
+    '''
+    if hasattr(path, 'read'):
+        for blob in _read_blobs(path):
+            yield blob
+        return
+    with open(path, 'rb') as pbf_file:
+        for blob in _read_blobs(pbf_file):
+            yield blob
+
+
+def _read_blobs(pbf_file):
+    while True:
+        size = pbf_file.read(4)
+        if not size:
+            return
+        header_size = struct.unpack('>i', size)[0]
+        blob_type, data_size = None, 0
+        for field, _, value in _iter_fields(pbf_file.read(header_size)):
+            if field == 1:
+                blob_type = value.decode('utf-8')
+            elif field == 3:
+                data_size = value
+        if data_size > MAX_BLOB_SIZE:
+            raise ValueError('Blob of %d bytes exceeds the maximum size' %
+                             data_size)
+        yield blob_type, pbf_file.read(data_size)
+
+
+def _blob_data(blob):
+    '''Decompresses a Blob message.'''
+    for field, _, value in _iter_fields(blob):
+        if field == 1:  #raw
+            return value
+        elif field == 3:  #zlib_data
+            return zlib.decompress(value)
+        elif field in (4, 5, 6, 7):
+            raise ValueError('Only raw and zlib compressed blobs are supported')
+    return b''
+
+
+# ### Primitive blocks
+
+
+def _info(buf, block):
+    '''Decodes an Info message to the attributes of an XML element.'''
+    info = {}
+    for field, _, value in _iter_fields(buf):
+        if field == 1:
+            info['version'] = str(value)
+        elif field == 2:
+            info['timestamp'] = _format_timestamp(
+                _to_signed(value) * block['date_granularity'])
+        elif field == 3:
+            info['changeset'] = str(_to_signed(value))
+        elif field == 4:
+            info['uid'] = str(_to_signed(value))
+        elif field == 5:
+            info['user'] = block['strings'][value]
+    return info
+
+
+def _format_timestamp(milliseconds):
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(milliseconds // 1000))
+
+
+def _format_coord(nanodegrees):
+    '''Formats a coordinate without going through a float.
+
+    Coordinates are stored in nanodegrees, but the usual granularity is 100
+    nanodegrees, which gives the 7 decimals of the XML export.
+    '''
+    sign = '-' if nanodegrees < 0 else ''
+    whole, fraction = divmod(abs(nanodegrees), 10**9)
+    if fraction % 100 == 0:
+        return '%s%d.%07d' % (sign, whole, fraction // 100)
+    return '%s%d.%09d' % (sign, whole, fraction)
+
+
+def _dense_nodes(buf, block):
+    '''Decodes a DenseNodes message.
+
+    Returns:
+        list: A list of ('node', attributes, tags, None) tuples.
+    '''
+    ids = lats = lons = []
+    keys_vals = []
+    info = {}
+    for field, _, value in _iter_fields(buf):
+        if field == 1:
+            ids = _packed_delta(value)
+        elif field == 5:
+            info = _dense_info(value, block)
+        elif field == 8:
+            lats = _packed_delta(value)
+        elif field == 9:
+            lons = _packed_delta(value)
+        elif field == 10:
+            keys_vals = _packed_varints(value)
+
+    strings = block['strings']
+    granularity = block['granularity']
+    lat_offset = block['lat_offset']
+    lon_offset = block['lon_offset']
+    tags = iter(keys_vals)
+    names = list(info)
+    #One row of the DenseInfo attributes per node
+    rows = zip(*[info[name] for name in names]) if names else repeat(())
+    result = []
+    for node_id, lat, lon, row in zip(ids, lats, lons, rows):
+        attribs = dict(zip(names, row))
+        attribs['id'] = str(node_id)
+        attribs['lat'] = _format_coord(lat_offset + granularity * lat)
+        attribs['lon'] = _format_coord(lon_offset + granularity * lon)
+        node_tags = []
+        for key in tags:  #keys_vals is a 0 delimited list of key/value pairs
+            if key == 0:
+                break
+            node_tags.append((strings[key], strings[next(tags)]))
+        result.append(('node', attribs, node_tags, None))
+    return result
+
+
+def _dense_info(buf, block):
+    '''Decodes a DenseInfo message to per-attribute lists of strings.'''
+    info = {}
+    for field, _, value in _iter_fields(buf):
+        if field == 1:
+            info['version'] = [str(v) for v in _packed_signed(value)]
+        elif field == 2:
+            granularity = block['date_granularity']
+            info['timestamp'] = [_format_timestamp(v * granularity)
+                                 for v in _packed_delta(value)]
+        elif field == 3:
+            info['changeset'] = [str(v) for v in _packed_delta(value)]
+        elif field == 4:
+            info['uid'] = [str(v) for v in _packed_delta(value)]
+        elif field == 5:
+            strings = block['strings']
+            info['user'] = [strings[v] for v in _packed_delta(value)]
+    return info
+
+
+def _primitive(buf, block, kind):
+    '''Decodes a Node, Way or Relation message.
+
+    Returns:
+        tuple: (kind, attributes, tags, refs). refs are the node ids of a way
+        or the (type, ref, role) members of a relation.
+    '''
+    strings = block['strings']
+    attribs = {}
+    keys = vals = refs = roles = types = ()
+    lat = lon = None
+    for field, _, value in _iter_fields(buf):
+        if field == 1:
+            attribs['id'] = str(_unzigzag(value) if kind == 'node' else
+                                _to_signed(value))
+        elif field == 2:
+            keys = _packed_varints(value)
+        elif field == 3:
+            vals = _packed_varints(value)
+        elif field == 4:
+            attribs.update(_info(value, block))
+        elif field == 8:
+            if kind == 'node':
+                lat = _unzigzag(value)
+            elif kind == 'way':
+                refs = _packed_delta(value)
+            else:
+                roles = _packed_signed(value)
+        elif field == 9:
+            if kind == 'node':
+                lon = _unzigzag(value)
+            elif kind == 'relation':
+                refs = _packed_delta(value)
+            #The lat of LocationsOnWays ways is skipped
+        elif field == 10 and kind == 'relation':
+            types = _packed_varints(value)
+    if kind == 'node':
+        attribs['lat'] = _format_coord(block['lat_offset'] +
+                                       block['granularity'] * lat)
+        attribs['lon'] = _format_coord(block['lon_offset'] +
+                                       block['granularity'] * lon)
+    tags = [(strings[k], strings[v]) for k, v in zip(keys, vals)]
+    if kind == 'way':
+        refs = [str(ref) for ref in refs]
+    elif kind == 'relation':
+        refs = [(MEMBER_TYPES[t], str(ref), strings[role])
+                for t, ref, role in zip(types, refs, roles)]
+    else:
+        refs = None
+    return kind, attribs, tags, refs
+
+
+def decode_blob(blob):
+    '''Decodes an OSMData blob to plain tuples.
+
+    The function is executed in the worker processes, so it returns picklable
+    tuples instead of elements.
+
+    Args:
+        blob (bytes): A serialized Blob message.
+
+    Returns:
+        list: (kind, attributes, tags, refs) tuples in file order.
+    '''
+    block = {
+        'strings': [],
+        'granularity': 100,
+        'lat_offset': 0,
+        'lon_offset': 0,
+        'date_granularity': 1000
+    }
+    groups = []
+    for field, _, value in _iter_fields(_blob_data(blob)):
+        if field == 1:
+            block['strings'] = [s.decode('utf-8') for _, _, s in
+                                _iter_fields(value)]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            block['granularity'] = value
+        elif field == 18:
+            block['date_granularity'] = value
+        elif field == 19:
+            block['lat_offset'] = _to_signed(value)
+        elif field == 20:
+            block['lon_offset'] = _to_signed(value)
+
+    result = []
+    for group in groups:
+        for field, _, value in _iter_fields(group):
+            if field == 1:
+                result.append(_primitive(value, block, 'node'))
+            elif field == 2:
+                result.extend(_dense_nodes(value, block))
+            elif field == 3:
+                result.append(_primitive(value, block, 'way'))
+            elif field == 4:
+                result.append(_primitive(value, block, 'relation'))
+    return result
+
+
+def iter_primitives(path, processes=None):
+    '''Decodes a .pbf file in parallel.
+
+    Args:
+        path (str or file): The .pbf file (see iter_blobs()).
+        processes (int): Number of worker processes. None uses one per CPU,
+            0 or 1 decodes everything in the current process.
+
+    Yields:
+        tuple: (kind, attributes, tags, refs) for every node, way and relation
+        in file order.
+    '''
+    blobs = (blob for blob_type, blob in iter_blobs(path)
+             if blob_type == 'OSMData')
+    if processes is not None and processes <= 1:
+        for blob in blobs:
+            for primitive in decode_blob(blob):
+                yield primitive
+        return
+
+    pool = multiprocessing.Pool(processes)
+    #At most 4 blobs per process are read ahead of the decoders, instead of
+    #the whole file with pool.imap()
+    pending = deque()
+    ahead = 4 * (processes or multiprocessing.cpu_count())
+    try:
+        for blob in blobs:
+            pending.append(pool.apply_async(decode_blob, (blob, )))
+            if len(pending) >= ahead:
+                for primitive in pending.popleft().get():
+                    yield primitive
+        while pending:
+            for primitive in pending.popleft().get():
+                yield primitive
+    finally:
+        pool.terminate()
+
+
+def to_element(primitive):
+    '''Builds the XML element of a decoded primitive.
+
+    Args:
+        primitive (tuple): A (kind, attributes, tags, refs) tuple.
+
+    Returns:
+        element: An element with the same structure as the one ET.parse()
+        would create from the XML export.
+    '''
+    kind, attribs, tags, refs = primitive
+    element = ET.Element(kind, attribs)
+    if kind == 'way':
+        for ref in refs:
+            ET.SubElement(element, 'nd', {'ref': ref})
+    elif kind == 'relation':
+        for member_type, ref, role in refs:
+            ET.SubElement(element, 'member',
+                          {'type': member_type, 'ref': ref, 'role': role})
+    for k, v in tags:
+        ET.SubElement(element, 'tag', {'k': k, 'v': v})
+    return element
+
+
+def iter_elements(path, processes=None):
+    '''Iterates over the elements of a .pbf file.
+
+    The elements can be passed to shape_element() like the ones of the
+    XML tree.
+
+    Args:
+        path (str or file): The .pbf file (see iter_blobs()).
+        processes (int): Number of worker processes (see iter_primitives()).
+
+    Yields:
+        element: The node, way and relation elements in file order.
+    '''
+    for primitive in iter_primitives(path, processes):
+        yield to_element(primitive)
+
+
+def parse(path, processes=None):
+    '''Drop-in replacement of ET.parse() for .pbf files.
+
+    Returns:
+        ElementTree: A tree with an <osm> root holding all the elements.
+    '''
+    root = ET.Element('osm', {'version': '0.6', 'generator': 'wrangle_osm.pbf'})
+    root.extend(iter_elements(path, processes))
+    return ET.ElementTree(root)
+
+
+# ### Writing .pbf files
+# Used to convert .osm samples locally, so the two readers can be compared.
+
+
+def _varint(value):
+    value &= (1 << 64) - 1
+    out = bytearray()
+    while True:
+        bits = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number, value):
+    '''Encodes a varint (int) or length delimited (bytes) field.'''
+    if isinstance(value, bytes):
+        return _varint(number << 3 | LENGTH_DELIMITED) + _varint(len(value)) + value
+    return _varint(number << 3 | VARINT) + _varint(value)
+
+
+def _packed(number, values):
+    return _field(number, b''.join(_varint(v) for v in values))
+
+
+def _deltas(values):
+    previous = 0
+    for value in values:
+        yield _zigzag(value - previous)
+        previous = value
+
+
+def _parse_timestamp(timestamp):
+    return calendar.timegm(time.strptime(timestamp, TIMESTAMP_FORMAT))
+
+
+def _nanodegrees(coord):
+    '''Converts a coordinate string to 100 nanodegree units without rounding
+    errors.'''
+    sign = -1 if coord.startswith('-') else 1
+    whole, _, fraction = coord.lstrip('-').partition('.')
+    fraction = (fraction + '0' * 7)[:7]
+    return sign * (int(whole) * 10**7 + int(fraction))
+
+
+class _BlockEncoder(object):
+    '''Collects the elements of one PrimitiveBlock.'''
+
+    def __init__(self):
+        self.strings = {'': 0}
+        self.nodes = []
+        self.ways = []
+        self.relations = []
+
+    def __len__(self):
+        return len(self.nodes) + len(self.ways) + len(self.relations)
+
+    def sid(self, string):
+        if string not in self.strings:
+            self.strings[string] = len(self.strings)
+        return self.strings[string]
+
+    def info(self, element):
+        return (int(element.get('version', 0)),
+                _parse_timestamp(element.get('timestamp', '1970-01-01T00:00:00Z')),
+                int(element.get('changeset', 0)), int(element.get('uid', 0)),
+                self.sid(element.get('user', '')))
+
+    def add(self, element):
+        tags = [(self.sid(tag.get('k')), self.sid(tag.get('v')))
+                for tag in element.iter('tag')]
+        if element.tag == 'node':
+            self.nodes.append((int(element.get('id')),
+                               _nanodegrees(element.get('lat')),
+                               _nanodegrees(element.get('lon')),
+                               self.info(element), tags))
+        elif element.tag == 'way':
+            refs = [int(nd.get('ref')) for nd in element.iter('nd')]
+            self.ways.append((int(element.get('id')), self.info(element), tags,
+                              refs))
+        elif element.tag == 'relation':
+            members = [(MEMBER_TYPES.index(m.get('type')), int(m.get('ref')),
+                        self.sid(m.get('role', '')))
+                       for m in element.iter('member')]
+            self.relations.append((int(element.get('id')), self.info(element),
+                                   tags, members))
+
+    def _info_message(self, info):
+        version, timestamp, changeset, uid, user_sid = info
+        return (_field(1, version) + _field(2, timestamp) +
+                _field(3, changeset) + _field(4, uid) + _field(5, user_sid))
+
+    def encode(self):
+        groups = []
+        if self.nodes:
+            ids, lats, lons, infos, tags = zip(*self.nodes)
+            versions, timestamps, changesets, uids, users = zip(*infos)
+            dense_info = (_packed(1, versions) + _packed(2, _deltas(timestamps)) +
+                          _packed(3, _deltas(changesets)) +
+                          _packed(4, _deltas(uids)) + _packed(5, _deltas(users)))
+            keys_vals = []
+            for node_tags in tags:
+                keys_vals.extend(chain.from_iterable(node_tags))
+                keys_vals.append(0)
+            dense = (_packed(1, _deltas(ids)) + _field(5, dense_info) +
+                     _packed(8, _deltas(lats)) + _packed(9, _deltas(lons)))
+            if any(tags):
+                dense += _packed(10, keys_vals)
+            groups.append(_field(2, dense))
+        if self.ways:
+            groups.append(b''.join(
+                _field(3, _field(1, way_id) + _packed(2, [k for k, _ in tags]) +
+                       _packed(3, [v for _, v in tags]) +
+                       _field(4, self._info_message(info)) +
+                       _packed(8, _deltas(refs)))
+                for way_id, info, tags, refs in self.ways))
+        if self.relations:
+            groups.append(b''.join(
+                _field(4, _field(1, relation_id) +
+                       _packed(2, [k for k, _ in tags]) +
+                       _packed(3, [v for _, v in tags]) +
+                       _field(4, self._info_message(info)) +
+                       _packed(8, [m[2] for m in members]) +
+                       _packed(9, _deltas([m[1] for m in members])) +
+                       _packed(10, [m[0] for m in members]))
+                for relation_id, info, tags, members in self.relations))
+
+        strings = sorted(self.strings, key=self.strings.get)
+        string_table = b''.join(_field(1, s.encode('utf-8')) for s in strings)
+        #A group holds a single type of primitives
+        return _field(1, string_table) + b''.join(_field(2, g) for g in groups)
+
+
+def _write_blob(pbf_file, blob_type, data):
+    blob = _field(2, len(data)) + _field(3, zlib.compress(data))
+    header = _field(1, blob_type.encode('utf-8')) + _field(3, len(blob))
+    pbf_file.write(struct.pack('>i', len(header)))
+    pbf_file.write(header)
+    pbf_file.write(blob)
+
+
+def convert_xml(osm_path, pbf_path, block_size=8000):
+    '''Converts an .osm (XML) file to .pbf.
+
+    Args:
+        osm_path (str): The XML file to convert.
+        pbf_path (str): The .pbf file to write.
+        block_size (int): Number of elements per blob (the specification
+            recommends 8000).
+
+    Returns:
+        int: The number of converted elements.
+    '''
+    count = 0
+    with open(pbf_path, 'wb') as pbf_file:
+        header = (_field(4, b'OsmSchema-V0.6') + _field(4, b'DenseNodes') +
+                  _field(16, b'wrangle_osm'))
+        _write_blob(pbf_file, 'OSMHeader', header)
+        block = _BlockEncoder()
+        for _, element in ET.iterparse(osm_path):
+            if element.tag not in MEMBER_TYPES:
+                continue
+            block.add(element)
+            element.clear()
+            count += 1
+            if len(block) >= block_size:
+                _write_blob(pbf_file, 'OSMData', block.encode())
+                block = _BlockEncoder()
+        if len(block):
+            _write_blob(pbf_file, 'OSMData', block.encode())
+    return count
+
+
+def compare_throughput(osm_path, pbf_path=None, processes=None):
+    '''Times reading the same data from XML and from PBF.
+
+    Both readers do the work of the export: every element is built and passed
+    to shape_element(), and the XML elements are cleared like in
+    iter_top_level(). The time of decoding the PBF primitives without building
+    elements is reported too, to tell the decoder from the construction of the
+    elements.
+
+    Args:
+        osm_path (str): The XML file (e.g. sample.osm).
+        pbf_path (str): The converted file. If it is missing, osm_path is
+            converted first.
+        processes (int): Worker processes for the PBF reader.
+
+    Returns:
+        dict: elements/sec of each reader.
+    '''
+    import os
+    from wrangle_osm.export import iter_top_level, shape_element
+    if pbf_path is None:
+        pbf_path = os.path.splitext(osm_path)[0] + '.osm.pbf'
+    if not os.path.exists(pbf_path):
+        convert_xml(osm_path, pbf_path)
+
+    def shape_all(elements):
+        start = time.time()
+        count = 0
+        for element in elements:
+            if element.tag in MEMBER_TYPES:  #Not the <bounds> of the XML
+                shape_element(element)
+                count += 1
+        return count, count / (time.time() - start)
+
+    xml_count, xml_rate = shape_all(iter_top_level(osm_path))
+    pbf_count, pbf_rate = shape_all(iter_elements(pbf_path, processes))
+
+    start = time.time()
+    decoded = sum(1 for _ in iter_primitives(pbf_path, processes))
+    decode_time = time.time() - start
+
+    return {
+        'elements': xml_count,
+        'pbf_elements': pbf_count,
+        'xml_elements_per_sec': xml_rate,
+        'pbf_elements_per_sec': pbf_rate,
+        'pbf_decode_elements_per_sec': decoded / decode_time,
+        'xml_bytes': os.path.getsize(osm_path),
+        'pbf_bytes': os.path.getsize(pbf_path)
+    }
+
+
+if __name__ == '__main__':
+    import pprint
+    import sys
+    pprint.pprint(compare_throughput(*sys.argv[1:2] or ['sample.osm']))
@@ -0,0 +1,171 @@
+"""A disk-backed replacement of the PROBLEMATICS list.
+
+PROBLEMATICS holds every record in memory and is gone when the process exits.
+ProblemStore keeps them in an SQLite table instead, indexed by element id,
+field and reason. Appending the same (element_id, field, value) twice keeps a
+single record. It has the append() of a list, so it can be passed wherever
+PROBLEMATICS is:
+
+    store = ProblemStore('problems.db')
+    fix_pcodes(tree, problematics=store)
+    audit_st_types(get_street_names(tree), problematics=store)
+    store.commit()
+
+    store.counts()                     #{(field, reason): records}
+    for record in store.page(field='postcode', limit=50):
+        ...
+
+The records are written in batches, and read back one page at a time.
+"""
+import sqlite3
+from collections import namedtuple
+
+Problem = namedtuple('Problem', 'element_id field value reason')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS problems
+(
+  element_id text NOT NULL,
+  field text NOT NULL,
+  value text,
+  reason text NOT NULL DEFAULT ''
+);
+
+--SQLite treats NULLs as distinct in a UNIQUE constraint, so records without a
+--value are deduplicated on ''
+CREATE UNIQUE INDEX IF NOT EXISTS problems_record_idx
+  ON problems (element_id, field, COALESCE(value, ''));
+
+CREATE INDEX IF NOT EXISTS problems_field_reason_idx
+  ON problems (field, reason);
+'''
+
+
+class ProblemStore(object):
+    """Problem records in an SQLite database.
+
+    Args:
+        path (str): The database file, ':memory:' for a temporary store.
+        batch_size (int): Records buffered before they are inserted.
+    """
+
+    def __init__(self, path=':memory:', batch_size=10000):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        self.batch_size = batch_size
+        self._pending = []
+
+    # ### Writing
+
+    def append(self, record):
+        """Adds an (element_id, field, value) or (element_id, field, value,
+        reason) record."""
+        if len(record) == 3:
+            record = tuple(record) + ('', )
+        element_id, field, value, reason = record
+        self._pending.append((str(element_id), field, value, reason or ''))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def flush(self):
+        """Inserts the buffered records, ignoring the duplicates."""
+        if self._pending:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO problems VALUES (?, ?, ?, ?)',
+                self._pending)
+            self._pending = []
+
+    def commit(self):
+        self.flush()
+        self.connection.commit()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # ### Reading
+
+    def _where(self, element_id=None, field=None, reason=None):
+        conditions, args = [], []
+        for column, value in [('element_id', element_id), ('field', field),
+                              ('reason', reason)]:
+            if value is not None:
+                conditions.append('%s = ?' % column)
+                args.append(str(value) if column == 'element_id' else value)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return where, args
+
+    def __len__(self):
+        self.flush()
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM problems').fetchone()[0]
+
+    def __iter__(self):
+        return self.iter_records()
+
+    def counts(self, by=('field', 'reason')):
+        """Returns the number of records per category.
+
+        Args:
+            by (tuple): The columns of the categories.
+
+        Returns:
+            dict: {(field, reason): records} with the default columns.
+        """
+        self.flush()
+        columns = ', '.join(by)
+        rows = self.connection.execute(
+            'SELECT %s, COUNT(*) FROM problems GROUP BY %s' % (columns, columns))
+        return dict((row[:-1], row[-1]) for row in rows)
+
+    def page(self, after=0, limit=100, element_id=None, field=None,
+             reason=None):
+        """Returns one page of records.
+
+        Pages are selected by position (keyset pagination), so they cost the
+        same wherever they are in the table.
+
+        Args:
+            after (int): The position of the last record of the previous page,
+                0 for the first page.
+            limit (int): The size of the page.
+            element_id, field, reason: Optional filters.
+
+        Returns:
+            list: (position, Problem) pairs.
+        """
+        self.flush()
+        where, args = self._where(element_id, field, reason)
+        where += (' AND' if where else ' WHERE') + ' rowid > ?'
+        rows = self.connection.execute(
+            'SELECT rowid, * FROM problems%s ORDER BY rowid LIMIT ?' % where,
+            args + [after, limit])
+        return [(row[0], Problem(*row[1:])) for row in rows]
+
+    def iter_records(self, page_size=1000, **filters):
+        """Iterates over the records, one page at a time.
+
+        Args:
+            **filters: element_id, field and/or reason (see page()).
+
+        Yields:
+            Problem: The records, in the order they were added.
+        """
+        after = 0
+        while True:
+            rows = self.page(after, page_size, **filters)
+            if not rows:
+                return
+            for _, record in rows:
+                yield record
+            after = rows[-1][0]
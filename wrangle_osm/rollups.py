@@ -0,0 +1,229 @@
+"""Precomputed tag statistics for the exploration queries.
+
+The exploration queries of the notebook (amenities, cuisine, religion, most
+popular streets) UNION ALL the whole nodes_tags and ways_tags tables and then
+GROUP BY the values. Instead, the counts are computed once after the import:
+
+* tags: a view over the tags of both element types, with an element_type
+  column, so ad hoc queries no longer need the UNION ALL themselves.
+* tag_rollup: (element_type, type, key, value, count). It is kept up to date
+  by statement level triggers on nodes_tags and ways_tags, which apply the
+  changes of every INSERT/UPDATE/DELETE (including the cascading deletes of
+  nodes and ways) as one grouped delta. Requires PostgreSQL 10 or later.
+* street_rollup: the counts of the street names, which need a join with the
+  highway tags of the ways. It is a materialized view, refreshed with
+  refresh().
+
+The dashboard queries then read a few hundred rows instead of every tag:
+
+    rollups.install(cursor)
+    rollups.dashboard(cursor, 'cuisine')
+"""
+
+TAGS_VIEW = '''
+CREATE OR REPLACE VIEW public.tags AS
+SELECT 'node'::text AS element_type, id, key, value, type FROM public.nodes_tags
+UNION ALL
+SELECT 'way'::text AS element_type, id, key, value, type FROM public.ways_tags;
+'''
+
+#type (and the key and value of nodes_tags) may be NULL, so the NULLs are
+#stored as '' to be part of the primary key.
+TAG_ROLLUP = '''
+DROP TABLE IF EXISTS public.tag_rollup;
+
+CREATE TABLE public.tag_rollup
+(
+  element_type text NOT NULL,
+  type text NOT NULL,
+  key text NOT NULL,
+  value text NOT NULL,
+  count bigint NOT NULL,
+  CONSTRAINT tag_rollup_pkey PRIMARY KEY (element_type, type, key, value)
+);
+
+INSERT INTO public.tag_rollup
+SELECT element_type, COALESCE(type, ''), COALESCE(key, ''),
+       COALESCE(value, ''), COUNT(*)
+FROM public.tags
+GROUP BY 1, 2, 3, 4;
+
+CREATE INDEX tag_rollup_key_idx ON public.tag_rollup (key, element_type);
+'''
+
+TRIGGERS = '''
+CREATE OR REPLACE FUNCTION public.tag_rollup_add() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO public.tag_rollup AS r
+  SELECT TG_ARGV[0], COALESCE(type, ''), COALESCE(key, ''),
+         COALESCE(value, ''), COUNT(*)
+  FROM new_rows
+  GROUP BY 1, 2, 3, 4
+  ON CONFLICT (element_type, type, key, value)
+  DO UPDATE SET count = r.count + EXCLUDED.count;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.tag_rollup_subtract() RETURNS trigger AS $$
+BEGIN
+  WITH delta AS (
+    SELECT COALESCE(type, '') AS type, COALESCE(key, '') AS key,
+           COALESCE(value, '') AS value, COUNT(*) AS count
+    FROM old_rows
+    GROUP BY 1, 2, 3)
+  UPDATE public.tag_rollup r
+  SET count = r.count - delta.count
+  FROM delta
+  WHERE r.element_type = TG_ARGV[0] AND r.type = delta.type
+    AND r.key = delta.key AND r.value = delta.value;
+
+  --Only the values of the changed rows can have dropped to 0, found with the
+  --primary key instead of a scan of the rollup
+  DELETE FROM public.tag_rollup r
+  USING (SELECT DISTINCT COALESCE(type, '') AS type, COALESCE(key, '') AS key,
+                COALESCE(value, '') AS value
+         FROM old_rows) AS changed
+  WHERE r.element_type = TG_ARGV[0] AND r.type = changed.type
+    AND r.key = changed.key AND r.value = changed.value AND r.count <= 0;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.tag_rollup_update() RETURNS trigger AS $$
+BEGIN
+  WITH delta AS (
+    SELECT COALESCE(type, '') AS type, COALESCE(key, '') AS key,
+           COALESCE(value, '') AS value, SUM(sign) AS count
+    FROM (SELECT type, key, value, 1 AS sign FROM new_rows
+          UNION ALL
+          SELECT type, key, value, -1 AS sign FROM old_rows) AS changes
+    GROUP BY 1, 2, 3
+    HAVING SUM(sign) <> 0)
+  INSERT INTO public.tag_rollup AS r
+  SELECT TG_ARGV[0], type, key, value, count FROM delta
+  ON CONFLICT (element_type, type, key, value)
+  DO UPDATE SET count = r.count + EXCLUDED.count;
+
+  --Only the values of the changed rows can have dropped to 0, found with the
+  --primary key instead of a scan of the rollup
+  DELETE FROM public.tag_rollup r
+  USING (SELECT DISTINCT COALESCE(type, '') AS type, COALESCE(key, '') AS key,
+                COALESCE(value, '') AS value
+         FROM old_rows) AS changed
+  WHERE r.element_type = TG_ARGV[0] AND r.type = changed.type
+    AND r.key = changed.key AND r.value = changed.value AND r.count <= 0;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+'''
+
+TABLE_TRIGGERS = '''
+DROP TRIGGER IF EXISTS {table}_rollup_insert ON public.{table};
+CREATE TRIGGER {table}_rollup_insert AFTER INSERT ON public.{table}
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE public.tag_rollup_add('{element_type}');
+
+DROP TRIGGER IF EXISTS {table}_rollup_delete ON public.{table};
+CREATE TRIGGER {table}_rollup_delete AFTER DELETE ON public.{table}
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE public.tag_rollup_subtract('{element_type}');
+
+DROP TRIGGER IF EXISTS {table}_rollup_update ON public.{table};
+CREATE TRIGGER {table}_rollup_update AFTER UPDATE ON public.{table}
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE public.tag_rollup_update('{element_type}');
+'''
+
+#The street names of the addresses and the names of the highways
+STREET_ROLLUP = '''
+DROP MATERIALIZED VIEW IF EXISTS public.street_rollup;
+
+CREATE MATERIALIZED VIEW public.street_rollup AS
+SELECT street_names.value AS street, COUNT(*) AS count
+FROM
+  (SELECT value
+   FROM public.nodes_tags
+   WHERE type = 'addr' AND key = 'street'
+   UNION ALL
+   SELECT value
+   FROM public.ways_tags
+   WHERE (type = 'addr' AND key = 'street')
+      OR (key = 'name' AND id IN (SELECT id FROM public.ways_tags
+                                  WHERE key = 'highway'))) AS street_names
+GROUP BY street_names.value;
+
+CREATE UNIQUE INDEX street_rollup_street_idx ON public.street_rollup (street);
+'''
+
+#The exploration queries of the notebook, on top of the rollups
+DASHBOARD = {
+    'amenities': '''
+        SELECT value AS "Amenity", SUM(count)::bigint AS "Occurrences"
+        FROM public.tag_rollup
+        WHERE key = 'amenity' AND element_type = 'node'
+        GROUP BY value
+        ORDER BY "Occurrences" DESC
+        LIMIT %(limit)s''',
+    'cuisine': '''
+        SELECT value AS "Cuisine", SUM(count)::bigint AS "Restaurants"
+        FROM public.tag_rollup
+        WHERE key = 'cuisine'
+        GROUP BY value
+        ORDER BY "Restaurants" DESC
+        LIMIT %(limit)s''',
+    'religion': '''
+        SELECT value AS "Religion", SUM(count)::bigint AS "Temples"
+        FROM public.tag_rollup
+        WHERE key = 'religion'
+        GROUP BY value
+        ORDER BY "Temples" DESC
+        LIMIT %(limit)s''',
+    'streets': '''
+        SELECT street AS "Street", count AS "Times Refered"
+        FROM public.street_rollup
+        ORDER BY count DESC
+        LIMIT %(limit)s''',
+}
+
+
+def install(cursor):
+    """Creates the rollups from the imported tags and the triggers that keep
+    them up to date.
+
+    Call it once, after the .csv files have been loaded, so the import itself
+    does not go through the triggers.
+
+    Args:
+        cursor: A DB-API cursor of the database.
+    """
+    cursor.execute(TAGS_VIEW)
+    cursor.execute(TAG_ROLLUP)
+    cursor.execute(TRIGGERS)
+    for table, element_type in [('nodes_tags', 'node'), ('ways_tags', 'way')]:
+        cursor.execute(TABLE_TRIGGERS.format(table=table,
+                                             element_type=element_type))
+    cursor.execute(STREET_ROLLUP)
+
+
+def refresh(cursor):
+    """Brings street_rollup up to date (tag_rollup is refreshed by the
+    triggers)."""
+    cursor.execute('REFRESH MATERIALIZED VIEW CONCURRENTLY public.street_rollup')
+
+
+def rebuild(cursor):
+    """Recomputes every rollup from scratch, e.g. after the triggers have
+    been disabled for a bulk load."""
+    cursor.execute(TAG_ROLLUP)
+    cursor.execute(STREET_ROLLUP)
+
+
+def dashboard(cursor, name, limit=10):
+    """Runs one of the DASHBOARD queries.
+
+    Returns:
+        list: The rows of the result.
+    """
+    cursor.execute(DASHBOARD[name], {'limit': limit})
+    return cursor.fetchall()
@@ -0,0 +1,311 @@
+"""Streaming sampler for .osm files.
+
+The sample keeps referential integrity: every node referenced by a sampled way
+is written too, even if the node itself was not selected. To achieve this
+without keeping the elements in memory, the input is read twice with
+iterparse():
+
+1. The selector is applied to every top-level element and the ids of the
+   selected elements, together with the node ids their ways reference, are
+   collected.
+2. The elements whose ids were collected are copied to the output in their
+   original order.
+
+Selection is a pure function of the element (its id, and the seed) so the same
+input, selector and seed always produce the same sample.
+
+Memory grows with the size of the sample (the collected ids), not of the
+input, except with --grid: BboxStratified keeps the cell of every node of the
+input to place the ways, about 100 bytes per node.
+
+With --target-size the sample is written more than once: the fraction is
+scaled by the ratio of the target to the written size until they match.
+
+Usage:
+    python -m wrangle_osm.sample Singapore.osm sample.osm --every 10
+    python -m wrangle_osm.sample Singapore.osm sample.osm --fraction 0.01 --seed 7
+    python -m wrangle_osm.sample Singapore.osm sample.osm --grid 8 --fraction 0.01
+    python -m wrangle_osm.sample Singapore.osm sample.osm --target-size 1MB
+"""
+from __future__ import division, print_function
+
+import argparse
+import os
+import re
+import xml.etree.cElementTree as ET
+import zlib
+from functools import partial
+
+from wrangle_osm.export import iter_top_level
+
+ELEMENT_TYPES = ('node', 'way', 'relation')
+
+
+# ### Selectors
+# A selector is called with every top-level element (before its children are
+# cleared) and returns True if the element belongs to the sample.
+
+
+def _uniform(element, seed):
+    '''Maps an element to a reproducible pseudo-random number in [0, 1).'''
+    key = '%s:%s:%s' % (seed, element.tag, element.get('id'))
+    return (zlib.crc32(key.encode('utf-8')) & 0xffffffff) / 2.0**32
+
+
+class EveryKth(object):
+    '''Selects every k-th element of each type.'''
+
+    def __init__(self, k):
+        if k < 1:
+            raise ValueError('k must be a positive integer')
+        self.k = k
+        self.counters = dict.fromkeys(ELEMENT_TYPES, 0)
+
+    def __call__(self, element):
+        self.counters[element.tag] += 1
+        return self.counters[element.tag] % self.k == 1 % self.k
+
+
+class RandomFraction(object):
+    '''Selects a seeded random fraction of the elements.'''
+
+    def __init__(self, fraction, seed=0):
+        self.fraction = fraction
+        self.seed = seed
+
+    def __call__(self, element):
+        return _uniform(element, self.seed) < self.fraction
+
+
+class BboxStratified(object):
+    '''Selects a random fraction of the elements of every cell of a grid.
+
+    The bounding box is split in grid x grid cells. Nodes are assigned to the
+    cell of their coordinates and ways to the cell of their first node. Every
+    cell keeps at least min_per_cell elements (if it has that many), so sparse
+    areas are not lost in small samples.
+
+    The cell of every node is kept until the end, so memory grows with the
+    number of nodes of the input.
+    '''
+
+    def __init__(self, bbox, grid, fraction, seed=0, min_per_cell=1):
+        self.min_lat, self.min_lon, self.max_lat, self.max_lon = bbox
+        self.grid = grid
+        self.fraction = fraction
+        self.seed = seed
+        self.min_per_cell = min_per_cell
+        self.node_cells = {}
+        self.selected_per_cell = {}
+
+    def cell(self, lat, lon):
+        row = int((lat - self.min_lat) / (self.max_lat - self.min_lat) * self.grid)
+        col = int((lon - self.min_lon) / (self.max_lon - self.min_lon) * self.grid)
+        #Nodes on (or outside of) the edges go to the nearest cell
+        return (min(max(row, 0), self.grid - 1) * self.grid +
+                min(max(col, 0), self.grid - 1))
+
+    def __call__(self, element):
+        if element.tag == 'node':
+            cell = self.cell(float(element.get('lat')), float(element.get('lon')))
+            self.node_cells[int(element.get('id'))] = cell
+        elif element.tag == 'way':
+            nd = element.find('nd')
+            cell = None if nd is None else self.node_cells.get(int(nd.get('ref')))
+        else:
+            cell = None
+        selected = self.selected_per_cell.get((element.tag, cell), 0)
+        if (selected < self.min_per_cell or
+                _uniform(element, self.seed) < self.fraction):
+            self.selected_per_cell[(element.tag, cell)] = selected + 1
+            return True
+        return False
+
+
+# ### Sampling
+
+
+def read_bounds(path):
+    '''Returns the (minlat, minlon, maxlat, maxlon) of the <bounds> element, or
+    None if the file has none.'''
+    for element in iter_top_level(path):
+        if element.tag == 'bounds':
+            return tuple(float(element.get(k))
+                         for k in ('minlat', 'minlon', 'maxlat', 'maxlon'))
+        if element.tag in ELEMENT_TYPES:
+            return
+
+
+def select_ids(path, selector):
+    '''First pass: the ids of the elements that go to the sample.
+
+    Args:
+        path (str): The .osm file.
+        selector (callable): Returns True for the elements to sample.
+
+    Returns:
+        dict: {element_type: set_of_ids}. The nodes include the ones referenced
+        by the selected ways.
+    '''
+    result = dict((t, set()) for t in ELEMENT_TYPES)
+    for element in iter_top_level(path):
+        if element.tag in ELEMENT_TYPES and selector(element):
+            result[element.tag].add(element.get('id'))
+            if element.tag == 'way':
+                result['node'].update(nd.get('ref') for nd in element.iter('nd'))
+    return result
+
+
+def write_sample(src, dst, ids):
+    '''Second pass: copies the selected elements to a new .osm file.
+
+    Args:
+        src (str): The .osm file to sample.
+        dst (str): The sample to write.
+        ids (dict): {element_type: set_of_ids} as returned by select_ids().
+
+    Returns:
+        dict: The number of elements written per type.
+    '''
+    counts = dict.fromkeys(ELEMENT_TYPES, 0)
+    with open(dst, 'wb') as sample:
+        sample.write(b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                     b'<osm version="0.6" generator="wrangle_osm.sample">\n')
+        for element in iter_top_level(src):
+            if element.tag == 'bounds':
+                pass
+            elif element.get('id') not in ids.get(element.tag, ()):
+                continue
+            else:
+                counts[element.tag] += 1
+            element.tail = '\n'
+            sample.write(b'  ' + ET.tostring(element, 'utf-8'))
+        sample.write(b'</osm>\n')
+    return counts
+
+
+def sample_osm(src, dst, selector):
+    '''Writes a sample of an .osm file.
+
+    Args:
+        src (str): The .osm file to sample.
+        dst (str): The sample to write.
+        selector (callable): Returns True for the elements to sample (see
+            EveryKth, RandomFraction and BboxStratified).
+
+    Returns:
+        dict: The number of elements written per type.
+    '''
+    return write_sample(src, dst, select_ids(src, selector))
+
+
+def sample_to_size(src, dst, target_size, make_selector, tolerance=0.05,
+                   max_rounds=5):
+    '''Writes a random sample of about target_size bytes.
+
+    The referenced nodes of the sampled ways make the sample bigger than the
+    fraction of the input size, by a factor that depends on the data, so the
+    fraction is calibrated on the written sample: it is scaled by
+    target_size / written size, then interpolated between the samples
+    below and above the target, until the size is within the tolerance.
+    Otherwise the closest of the samples is kept.
+
+    Args:
+        src (str): The .osm file to sample.
+        dst (str): The sample to write.
+        target_size (int): The size of the sample in bytes.
+        make_selector (callable): Returns a new selector for a fraction, e.g.
+            partial(RandomFraction, seed=7).
+        tolerance (float): The accepted relative error of the size.
+        max_rounds (int): Calibration rounds, the closest sample may be
+            written once more.
+
+    Returns:
+        tuple: (the number of elements written per type, the final fraction)
+    '''
+    fraction = min(1.0, target_size / os.path.getsize(src))
+    #The size grows with the fraction, so the samples closest to the target
+    #from below and from above bracket the next fraction
+    below, above = (0.0, 0), None
+    written = []
+    for _ in range(max_rounds):
+        counts = sample_osm(src, dst, make_selector(fraction))
+        size = os.path.getsize(dst)
+        if abs(size - target_size) <= tolerance * target_size or (
+                fraction >= 1.0 and size < target_size):
+            return counts, fraction
+        written.append((abs(size - target_size), fraction))
+        if size < target_size:
+            below = max(below, (fraction, size))
+        else:
+            above = min(above or (fraction, size), (fraction, size))
+        if above is None:
+            fraction = min(1.0, fraction * target_size / size)
+        else:  #Interpolated, as a few long ways make the size jump
+            (low, low_size), (high, high_size) = below, above
+            fraction = low + (high - low) * (
+                (target_size - low_size) / (high_size - low_size))
+    best = min(written)[1]
+    if best != written[-1][1]:
+        counts = sample_osm(src, dst, make_selector(best))
+    return counts, best
+
+
+def parse_size(size):
+    '''Parses sizes like "100MB" or "1 GB" to bytes.'''
+    match = re.match(r'^\s*([0-9.]+)\s*([KMG]?)B?\s*$', size.upper())
+    if not match:
+        raise ValueError('Invalid size: %s' % size)
+    number, unit = match.groups()
+    return int(float(number) * 1024**' KMG'.index(unit or ' '))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('src', help='the .osm file to sample')
+    parser.add_argument('dst', help='the sample to write')
+    method = parser.add_mutually_exclusive_group(required=True)
+    method.add_argument('--every', type=int, metavar='K',
+                        help='write every k-th element')
+    method.add_argument('--fraction', type=float,
+                        help='write a seeded random fraction of the elements')
+    method.add_argument('--target-size', metavar='SIZE',
+                        help='approximate size of the sample, e.g. 100MB (the '
+                        'fraction is calibrated on written samples)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--grid', type=int, metavar='N',
+                        help='stratify the random sample on a NxN grid over '
+                        'the bounding box')
+    parser.add_argument('--bbox', type=float, nargs=4,
+                        metavar=('MINLAT', 'MINLON', 'MAXLAT', 'MAXLON'),
+                        help='grid extent (defaults to the <bounds> element)')
+    args = parser.parse_args(argv)
+
+    if args.every is not None:
+        if args.every < 1:
+            parser.error('--every must be at least 1')
+        counts = sample_osm(args.src, args.dst, EveryKth(args.every))
+    else:
+        if args.grid:
+            bbox = args.bbox or read_bounds(args.src)
+            if bbox is None:
+                parser.error('--grid needs --bbox when the file has no <bounds>')
+            make_selector = partial(BboxStratified, bbox, args.grid,
+                                    seed=args.seed)
+        else:
+            make_selector = partial(RandomFraction, seed=args.seed)
+        if args.target_size:
+            counts, fraction = sample_to_size(
+                args.src, args.dst, parse_size(args.target_size),
+                make_selector)
+            print('fraction: %.6f' % fraction)
+        else:
+            counts = sample_osm(args.src, args.dst,
+                                make_selector(args.fraction))
+    for element_type in ELEMENT_TYPES:
+        print('%s: %d' % (element_type, counts[element_type]))
+    print('%s: %d bytes' % (args.dst, os.path.getsize(args.dst)))
+
+
+if __name__ == '__main__':
+    main()
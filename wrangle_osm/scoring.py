@@ -0,0 +1,341 @@
+"""Nearest amenities and walkability scores of candidate homes.
+
+The notebook closes with the idea of an application that scores potential
+rental homes by their distance to the work addresses and to amenities like
+supermarkets, cafes and public transport. AmenityIndex answers that for many
+candidates at once from the exported .csv files:
+
+    index = AmenityIndex.from_csv('csv')
+    distances, ids = index.nearest('supermarket', lats, lons, k=3)
+    scores = index.score(lats, lons, {'supermarket': 3, 'transit': 2,
+                                      'cafe': 1},
+                         work=[(1.2789, 103.8536, 2)])
+
+    python -m wrangle_osm.scoring csv/ listings.csv \
+        --weights supermarket=3,transit=2,cafe=1 --work 1.2789,103.8536,2
+
+The coordinates of every category are kept in arrays, and the distances of
+a batch of candidates to all the amenities of a category are computed with
+one vectorized haversine (in blocks, to bound the memory). Candidates are
+snapped to the centre of a grid cell of cell_size degrees (about 55 m by
+default) and the results are cached per cell, so nearby listings cost a
+dict lookup.
+
+numpy is needed for the vectorized path; without it the same results are
+computed one candidate at a time.
+"""
+from __future__ import print_function, division
+
+import argparse
+import csv
+import heapq
+import math
+import os
+import sys
+from collections import defaultdict
+
+try:
+    import numpy as np
+except ImportError:  #numpy is optional, the pure Python path is used instead
+    np = None
+
+from wrangle_osm.export import PY2, open_csv
+
+EARTH_RADIUS = 6371008.8  #Meters
+
+#category: the (key, value) tags of its nodes and ways
+CATEGORIES = {
+    'supermarket': [('shop', 'supermarket')],
+    'convenience': [('shop', 'convenience')],
+    'cafe': [('amenity', 'cafe')],
+    'restaurant': [('amenity', 'restaurant'), ('amenity', 'fast_food'),
+                   ('amenity', 'food_court')],
+    'transit': [('railway', 'station'), ('railway', 'subway_entrance'),
+                ('highway', 'bus_stop'), ('public_transport', 'station')],
+    'atm': [('amenity', 'atm')],
+    'school': [('amenity', 'school'), ('amenity', 'kindergarten')],
+    'clinic': [('amenity', 'clinic'), ('amenity', 'doctors'),
+               ('amenity', 'hospital'), ('amenity', 'pharmacy')],
+    'park': [('leisure', 'park'), ('leisure', 'playground')],
+}
+
+#Candidate x amenity distances computed at a time
+BLOCK_SIZE = 1 << 20
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """The great-circle distance in meters between points in degrees.
+
+    With numpy arrays the arguments are broadcast, e.g. a column of
+    candidates against a row of amenities.
+    """
+    if np is not None:
+        lat1, lon1, lat2, lon2 = [np.radians(np.asarray(v, dtype=float))
+                                  for v in (lat1, lon1, lat2, lon2)]
+        a = (np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) *
+             np.sin((lon2 - lon1) / 2) ** 2)
+        return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
+    return distance(lat1, lon1, lat2, lon2)
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """haversine() of two points, with math instead of numpy (faster for a
+    single pair)."""
+    lat1, lon1, lat2, lon2 = [math.radians(v) for v in (lat1, lon1, lat2, lon2)]
+    a = (math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) *
+         math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1)))
+
+
+def _read(path):
+    return open(path, 'rb') if PY2 else open_csv(path, 'r')
+
+
+def _tagged(path, by_tag):
+    """The categories of the elements of a tags .csv file, by element id."""
+    categories = defaultdict(set)
+    with _read(path) as csv_file:
+        for row in csv.DictReader(csv_file):
+            for category in by_tag.get((row['key'], row['value']), ()):
+                categories[int(row['id'])].add(category)
+    return categories
+
+
+def read_amenities(csv_dir, categories=CATEGORIES):
+    """Collects the coordinates of the nodes and ways of every category.
+
+    Amenities mapped as areas (parks, schools, supermarkets...) are ways: they
+    are placed at the centroid of their distinct nodes, and their ids are
+    negated so they do not collide with the node ids.
+
+    Args:
+        csv_dir (str): The directory of the .csv files of an export.
+
+    Returns:
+        dict: {category: [(id, lat, lon), ...]}, with -id for the ways.
+    """
+    by_tag = defaultdict(list)
+    for category, tags in categories.items():
+        for tag in tags:
+            by_tag[tag].append(category)
+
+    node_categories = _tagged(os.path.join(csv_dir, 'nodes_tags.csv'), by_tag)
+    way_categories = _tagged(os.path.join(csv_dir, 'ways_tags.csv'), by_tag)
+    way_nodes = defaultdict(set)
+    if way_categories:
+        with _read(os.path.join(csv_dir, 'ways_nodes.csv')) as csv_file:
+            for row in csv.DictReader(csv_file):
+                way_id = int(row['id'])
+                if way_id in way_categories:
+                    way_nodes[way_id].add(int(row['node_id']))
+    needed = set()
+    for nodes in way_nodes.values():
+        needed.update(nodes)
+
+    result = dict((category, []) for category in categories)
+    coords = {}
+    with _read(os.path.join(csv_dir, 'nodes.csv')) as csv_file:
+        for row in csv.DictReader(csv_file):
+            node_id = int(row['id'])
+            if node_id in node_categories or node_id in needed:
+                lat, lon = float(row['lat']), float(row['lon'])
+                for category in node_categories.get(node_id, ()):
+                    result[category].append((node_id, lat, lon))
+                if node_id in needed:
+                    coords[node_id] = (lat, lon)
+
+    for way_id in sorted(way_nodes):
+        points = [coords[nd] for nd in way_nodes[way_id] if nd in coords]
+        if points:
+            lat = sum(p[0] for p in points) / len(points)
+            lon = sum(p[1] for p in points) / len(points)
+            for category in way_categories[way_id]:
+                result[category].append((-way_id, lat, lon))
+    return result
+
+
+class AmenityIndex(object):
+    """The amenities of every category, for batched nearest-k queries.
+
+    Args:
+        amenities (dict): {category: [(id, lat, lon), ...]}, e.g. the output
+            of read_amenities().
+        cell_size (float): Size of the grid cells in degrees. The candidates
+            of a cell share the result of its centre (an error of at most
+            cell_size * 79 km). None for exact, uncached distances.
+    """
+
+    def __init__(self, amenities, cell_size=0.0005):
+        self.cell_size = cell_size
+        self.ids, self.lats, self.lons = {}, {}, {}
+        for category, points in amenities.items():
+            ids = [p[0] for p in points]
+            lats = [p[1] for p in points]
+            lons = [p[2] for p in points]
+            if np is not None:
+                ids, lats, lons = np.array(ids), np.array(lats), np.array(lons)
+            self.ids[category] = ids
+            self.lats[category] = lats
+            self.lons[category] = lons
+        self.cache = {}
+
+    @classmethod
+    def from_csv(cls, csv_dir, categories=CATEGORIES, cell_size=0.0005):
+        return cls(read_amenities(csv_dir, categories), cell_size)
+
+    def __len__(self):
+        return sum(len(ids) for ids in self.ids.values())
+
+    def empty(self, categories=None):
+        """The categories without any amenity, which score() ignores."""
+        return sorted(c for c in (categories or self.ids)
+                      if not len(self.ids[c]))
+
+    def _cells(self, lats, lons):
+        """The cells of the candidates, and the coordinates to query."""
+        if self.cell_size is None:
+            return list(zip(lats, lons)), lats, lons
+        size = self.cell_size
+        cells = [(int(math.floor(lat / size)), int(math.floor(lon / size)))
+                 for lat, lon in zip(lats, lons)]
+        return (cells, [(row + 0.5) * size for row, _ in cells],
+                [(col + 0.5) * size for _, col in cells])
+
+    def _query(self, category, lats, lons, k):
+        """The k nearest amenities of each point, without the cache."""
+        a_lats, a_lons, ids = (self.lats[category], self.lons[category],
+                               self.ids[category])
+        k = min(k, len(ids))
+        if np is None:
+            result = []
+            for lat, lon in zip(lats, lons):
+                nearest = heapq.nsmallest(k, (
+                    (distance(lat, lon, a_lat, a_lon), i)
+                    for i, a_lat, a_lon in zip(ids, a_lats, a_lons)))
+                result.append(([d for d, _ in nearest],
+                               [i for _, i in nearest]))
+            return result
+        result = []
+        step = max(1, BLOCK_SIZE // max(len(ids), 1))
+        lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+        for start in range(0, len(lats), step):
+            distances = haversine(lats[start:start + step, None],
+                                  lons[start:start + step, None],
+                                  a_lats[None, :], a_lons[None, :])
+            if k < len(ids):
+                nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            else:
+                nearest = np.tile(np.arange(len(ids)), (len(distances), 1))
+            rows = np.arange(len(distances))[:, None]
+            order = np.argsort(distances[rows, nearest], axis=1)
+            nearest = nearest[rows, order]
+            for d, i in zip(distances[rows, nearest], ids[nearest]):
+                result.append((d.tolist(), i.tolist()))
+        return result
+
+    def nearest(self, category, lats, lons, k=1):
+        """The k nearest amenities of a category for many points.
+
+        Args:
+            category (str): One of the categories of the index.
+            lats, lons (list): The coordinates of the candidates.
+            k (int): Amenities per candidate (fewer if the category has less).
+
+        Returns:
+            tuple: (distances, ids), one list per candidate with the distances
+            in meters and the ids of its nearest amenities (negated for the
+            ways), nearest first.
+        """
+        cells, q_lats, q_lons = self._cells(list(lats), list(lons))
+        if not len(self.ids[category]):
+            return [[] for _ in cells], [[] for _ in cells]
+        cache = self.cache if self.cell_size is not None else {}
+        missing = {}
+        for cell, lat, lon in zip(cells, q_lats, q_lons):
+            if (category, k, cell) not in cache and cell not in missing:
+                missing[cell] = (lat, lon)
+        if missing:
+            todo = list(missing.items())
+            results = self._query(category, [p[1][0] for p in todo],
+                                  [p[1][1] for p in todo], k)
+            for (cell, _), result in zip(todo, results):
+                cache[(category, k, cell)] = result
+        results = [cache[(category, k, cell)] for cell in cells]
+        return [r[0] for r in results], [r[1] for r in results]
+
+    def score(self, lats, lons, weights, k=1, scale=500.0, work=None):
+        """Scores candidate homes between 0 (nothing nearby) and 1.
+
+        Every category, and every work address, contributes
+        weight * exp(-distance / scale), with the mean distance of its k
+        nearest amenities. Categories without any amenity in the index are
+        left out, weight included, so an area where a category is not mapped
+        is not scored down for it (see empty()).
+
+        Args:
+            weights (dict): {category: weight}.
+            scale (float): Meters at which a contribution drops to 37%.
+            work (list): (lat, lon, weight) of the work addresses, measured
+                with scale * 10 since they are commuted to.
+
+        Returns:
+            list: The score of every candidate.
+        """
+        lats, lons = list(lats), list(lons)
+        totals = [0.0] * len(lats)
+        weight_sum = 0.0
+        for category, weight in weights.items():
+            if not len(self.ids[category]):
+                continue
+            distances, _ = self.nearest(category, lats, lons, k)
+            weight_sum += weight
+            for i, d in enumerate(distances):
+                if d:
+                    totals[i] += weight * math.exp(-sum(d) / len(d) / scale)
+        for w_lat, w_lon, weight in work or ():
+            weight_sum += weight
+            for i, (lat, lon) in enumerate(zip(lats, lons)):
+                totals[i] += weight * math.exp(
+                    -distance(lat, lon, w_lat, w_lon) / (scale * 10))
+        return [t / weight_sum for t in totals] if weight_sum else totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Walkability scores of candidate homes, from an export')
+    parser.add_argument('csv_dir', help='the directory of the .csv files')
+    parser.add_argument('candidates',
+                        help='a .csv file with lat and lon columns')
+    parser.add_argument('--weights', default='supermarket=3,transit=2,cafe=1',
+                        help='comma separated category=weight')
+    parser.add_argument('--work', action='append', default=[],
+                        metavar='LAT,LON,WEIGHT', help='a work address')
+    parser.add_argument('-k', type=int, default=1,
+                        help='nearest amenities averaged per category')
+    parser.add_argument('--scale', type=float, default=500.0,
+                        help='meters at which a category counts for 37%%')
+    args = parser.parse_args(argv)
+    weights = dict((name, float(weight)) for name, weight in
+                   (pair.split('=') for pair in args.weights.split(',')))
+    unknown = set(weights) - set(CATEGORIES)
+    if unknown:
+        parser.error('unknown categories: %s' % ', '.join(sorted(unknown)))
+    work = [tuple(float(v) for v in w.split(',')) for w in args.work]
+    with _read(args.candidates) as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    index = AmenityIndex.from_csv(args.csv_dir)
+    empty = index.empty(weights)
+    if empty:
+        print('No amenities for %s, left out of the scores' %
+              ', '.join(empty), file=sys.stderr)
+    scores = index.score([float(r['lat']) for r in rows],
+                         [float(r['lon']) for r in rows], weights, args.k,
+                         args.scale, work)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['lat', 'lon', 'score'])
+    for row, score in zip(rows, scores):
+        writer.writerow([row['lat'], row['lon'], '%.4f' % score])
+
+
+if __name__ == '__main__':
+    main()
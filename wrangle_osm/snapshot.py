@@ -0,0 +1,297 @@
+"""Snapshots of the cleaned data, for fast notebook restarts.
+
+After every restart the notebook parses the extract and runs the street and
+postcode audits and cleaning again before the review can go on. A snapshot
+keeps their results in a cache directory, keyed by the SHA-1 of the extract:
+
+    snap = snapshot.load(SG_OSM)      #Builds the snapshot the first time
+    PROBLEMATICS = snap.problematics
+    street_types = snap.street_types
+    process_map(snap.elements(), 'csv')
+    tree = snap.tree()                #The whole cleaned tree, if needed
+
+* audit.json: the street names, street types, changes and PROBLEMATICS,
+  loaded in a fraction of a second.
+* strings.json and *.bin: the cleaned elements, dictionary encoded. Every
+  distinct tag name, attribute name and value is stored once in strings.json
+  and the elements are flat arrays of codes and offsets (see COLUMNS), which
+  are memory mapped (with numpy) or read with array.fromfile(). Nothing is
+  parsed: elements() rebuilds the elements one at a time, when they are used.
+
+Bump VERSION when the cleaning or the format changes, so the old snapshots are
+not used.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import xml.etree.cElementTree as ET
+from array import array
+from xml.sax.saxutils import quoteattr
+
+try:
+    import numpy as np
+except ImportError:  #numpy is optional, the arrays are read into memory
+    np = None
+
+from wrangle_osm import audit
+from wrangle_osm.integrity import INT64
+from wrangle_osm.interning import StringTable
+
+VERSION = 2
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'wrangle_osm')
+
+#The arrays of a snapshot: (name, typecode). The elements are the children of
+#the root, each with its tag, its text (-1 for none) and the offsets of its
+#first attribute and first child, plus a last entry for the end. The children
+#(<tag>, <nd>, <member>) have the offset of their first attribute; the
+#attributes of an element are followed by those of its children.
+COLUMNS = [
+    ('element_tag', 'i'),
+    ('element_text', 'i'),
+    ('element_attrs', INT64),
+    ('element_children', INT64),
+    ('child_tag', 'i'),
+    ('child_attrs', INT64),
+    ('attr_name', 'i'),
+    ('attr_value', 'i'),
+]
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """The SHA-1 hex digest of a file."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as osm_file:
+        for chunk in iter(lambda: osm_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def encode(elements):
+    """Dictionary encodes elements and their children.
+
+    Args:
+        elements (iterable): The top-level elements, e.g. the root of a tree.
+
+    Returns:
+        tuple: (strings, {column: array}), see COLUMNS.
+    """
+    strings = StringTable(max_size=None)
+    code = strings.code
+    columns = dict((name, array(typecode)) for name, typecode in COLUMNS)
+    attr_name, attr_value = columns['attr_name'], columns['attr_value']
+
+    def add_attrs(element):
+        for name, value in element.attrib.items():
+            attr_name.append(code(name))
+            attr_value.append(code(value))
+
+    for element in elements:
+        columns['element_tag'].append(code(element.tag))
+        text = (element.text or '').strip()
+        columns['element_text'].append(code(text) if text else -1)
+        columns['element_attrs'].append(len(attr_name))
+        columns['element_children'].append(len(columns['child_tag']))
+        add_attrs(element)
+        for child in element:
+            columns['child_tag'].append(code(child.tag))
+            columns['child_attrs'].append(len(attr_name))
+            add_attrs(child)
+    columns['element_attrs'].append(len(attr_name))
+    columns['element_children'].append(len(columns['child_tag']))
+    return strings.strings, columns
+
+
+def _read_column(path, typecode):
+    """Memory maps (with numpy) or reads an array written by tofile()."""
+    size = os.path.getsize(path)
+    if np is not None:
+        if not size:
+            return np.zeros(0, dtype=typecode)
+        return np.memmap(path, dtype=typecode, mode='r')
+    result = array(typecode)
+    with open(path, 'rb') as column_file:
+        result.fromfile(column_file, size // result.itemsize)
+    return result
+
+
+class Snapshot(object):
+    """The cleaned data of an extract, in a snapshot directory.
+
+    Args:
+        directory (str): The directory written by build().
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'audit.json')) as audit_file:
+            self.audit = json.load(audit_file)
+        self.columns = dict(
+            (name, _read_column(os.path.join(directory, name + '.bin'),
+                                typecode))
+            for name, typecode in COLUMNS)
+        self._strings = None
+
+    @property
+    def streets(self):
+        """{element_id: street_name}, like get_street_names()."""
+        return self.audit['streets']
+
+    @property
+    def street_types(self):
+        """{street_type: set(street_names)}, like audit_st_types()."""
+        return dict((k, set(v)) for k, v in self.audit['street_types'].items())
+
+    @property
+    def street_changes(self):
+        """The changes of update_street_type()."""
+        return self.audit['street_changes']
+
+    @property
+    def postcode_changes(self):
+        """The changes of fix_pcodes()."""
+        return self.audit['postcode_changes']
+
+    @property
+    def problematics(self):
+        """The PROBLEMATICS found by the audits."""
+        return [tuple(p) for p in self.audit['problematics']]
+
+    @property
+    def strings(self):
+        """The string table, read the first time it is needed."""
+        if self._strings is None:
+            with open(os.path.join(self.directory, 'strings.json')) as f:
+                self._strings = json.load(f)
+        return self._strings
+
+    def __len__(self):
+        return len(self.columns['element_tag'])
+
+    def elements(self):
+        """Rebuilds the cleaned elements, one at a time.
+
+        Yields:
+            Element: The top-level elements (nodes, ways...) with their
+            children, in the order of the extract.
+        """
+        strings = self.strings
+        columns = dict((name, column.tolist())
+                       for name, column in self.columns.items())
+        names, values = columns['attr_name'], columns['attr_value']
+        child_tags, child_attrs = columns['child_tag'], columns['child_attrs']
+        element_attrs = columns['element_attrs']
+        element_children = columns['element_children']
+
+        def attrs(start, end):
+            return dict((strings[names[i]], strings[values[i]])
+                        for i in range(start, end))
+
+        for i, tag in enumerate(columns['element_tag']):
+            first, end = element_children[i], element_children[i + 1]
+            #The attributes of the element end where the ones of its first
+            #child start, and the ones of its last child where the next
+            #element's start
+            bounds = ([element_attrs[i]] + child_attrs[first:end] +
+                      [element_attrs[i + 1]])
+            element = ET.Element(strings[tag], attrs(bounds[0], bounds[1]))
+            text = columns['element_text'][i]
+            if text >= 0:
+                element.text = strings[text]
+            for j in range(first, end):
+                ET.SubElement(element, strings[child_tags[j]],
+                              attrs(bounds[j - first + 1], bounds[j - first + 2]))
+            yield element
+
+    def tree(self):
+        """Rebuilds the whole cleaned tree.
+
+        Returns:
+            ElementTree: The tree after update_street_type() and fix_pcodes().
+        """
+        root = ET.Element('osm', self.audit['root'])
+        root.extend(self.elements())
+        return ET.ElementTree(root)
+
+    def write_osm(self, path):
+        """Writes the cleaned elements to an .osm file, one at a time."""
+        with open(path, 'wb') as osm_file:
+            osm_file.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+            osm_file.write(('<osm%s>\n' % ''.join(
+                ' %s=%s' % (k, quoteattr(v))
+                for k, v in sorted(self.audit['root'].items()))).encode('utf-8'))
+            for element in self.elements():
+                element.tail = '\n'
+                osm_file.write(b'  ' + ET.tostring(element, 'utf-8'))
+            osm_file.write(b'</osm>\n')
+
+    @classmethod
+    def build(cls, osm_path, directory):
+        """Parses, audits and cleans an extract and writes the snapshot.
+
+        The files are written to a temporary directory first, so an
+        interrupted build leaves no snapshot behind.
+
+        Returns:
+            Snapshot: The new snapshot.
+        """
+        tree = ET.parse(osm_path)
+        problematics = []
+        streets = audit.get_street_names(tree)
+        street_types = audit.audit_st_types(streets, problematics)
+        street_changes = audit.update_street_type(tree, verbose=False)
+        postcode_changes = audit.fix_pcodes(tree, problematics, verbose=False)
+        strings, columns = encode(tree.getroot())
+
+        parent = os.path.dirname(os.path.abspath(directory))
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        tmp_dir = tempfile.mkdtemp(dir=parent)
+        try:
+            for name, column in columns.items():
+                with open(os.path.join(tmp_dir, name + '.bin'), 'wb') as f:
+                    column.tofile(f)
+            with open(os.path.join(tmp_dir, 'strings.json'), 'w') as f:
+                json.dump(strings, f)
+            with open(os.path.join(tmp_dir, 'audit.json'), 'w') as audit_file:
+                json.dump({
+                    'source': os.path.abspath(osm_path),
+                    'root': dict(tree.getroot().attrib),
+                    'streets': streets,
+                    'street_types': dict((k, sorted(v))
+                                         for k, v in street_types.items()),
+                    'street_changes': street_changes,
+                    'postcode_changes': postcode_changes,
+                    'problematics': problematics,
+                }, audit_file)
+            os.rename(tmp_dir, directory)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return cls(directory)
+
+
+def snapshot_dir(osm_path, cache_dir=None):
+    """The directory of the snapshot of an extract in its current state."""
+    return os.path.join(cache_dir or DEFAULT_CACHE_DIR,
+                        '%s-v%d' % (file_hash(osm_path), VERSION))
+
+
+def load(osm_path, cache_dir=None):
+    """Loads the snapshot of an extract, building it if there is none.
+
+    Args:
+        osm_path (str): The .osm file.
+        cache_dir (str): Where the snapshots are kept, ~/.cache/wrangle_osm by
+            default.
+
+    Returns:
+        Snapshot: The snapshot of the file's current content.
+    """
+    directory = snapshot_dir(osm_path, cache_dir)
+    if os.path.isdir(directory):
+        return Snapshot(directory)
+    return Snapshot.build(osm_path, directory)
@@ -0,0 +1,331 @@
+"""Synthetic OpenStreetMap data for load testing.
+
+Writes a valid .osm file of (approximately) a chosen size whose contents look
+like the Singapore extract, including the dirt the pipeline has to clean:
+
+* tag keys with colons (addr:street, name:en, ...) and keys matched by
+  PROBLEMCHARS,
+* Singapore style street names, with the abbreviations and misspellings of
+  the street type mapping,
+* postcodes with the country prefix, without the leading 0 or with an invalid
+  postal sector,
+* ways with many nds.
+
+The output is streamed, so files of any size can be generated with constant
+memory. Node ids are a function of the node's index, so ways can reference
+nodes without keeping their ids around.
+
+Usage:
+    python -m wrangle_osm.synthetic country.osm --size 1GB --seed 42
+"""
+from __future__ import division, print_function
+
+import argparse
+import bisect
+import random
+import sys
+import time
+from xml.sax.saxutils import quoteattr
+
+from wrangle_osm.audit import mapping
+from wrangle_osm.sample import parse_size
+
+#Center of Singapore (the bbox of the notebook's extract)
+BBOX = (1.2369, 103.7651, 1.3539, 103.9310)
+
+TAGGED_NODES = 0.2  #Share of the nodes with tags
+LONG_WAYS = 0.02  #Share of the ways with hundreds of nds
+RELATIONS = 0.01  #Share of the output taken up by relations
+
+#Postal sectors 01 to 80, excluding 74
+SECTORS = [s for s in range(1, 81) if s != 74]
+
+STREET_TYPES = [('Road', 40), ('Street', 15), ('Avenue', 12), ('Drive', 6),
+                ('Crescent', 4), ('Lane', 4), ('Park', 3), ('Walk', 3),
+                ('Link', 3), ('Terrace', 2), ('Close', 2), ('Place', 2)]
+STREET_NAMES = ['Orchard', 'Serangoon', 'Bedok North', 'Bukit Timah', 'Arab',
+                'Clementi', 'Toa Payoh', 'Ang Mo Kio', 'Tanjong Pagar', 'Sago',
+                'New Bridge', 'Sultan', 'Alexandra', 'Holland', 'Jurong West',
+                'Tampines', 'Pasir Ris', 'Yishun', 'Marine Parade', 'Rhu Cross',
+                'Jalan Pelatina', 'Lorong 4', 'Upper Thomson', 'Hougang']
+#Abbreviations and misspellings, as found in the extract
+BAD_STREET_TYPES = sorted(mapping)
+
+AMENITIES = [('restaurant', 30), ('cafe', 10), ('fast_food', 10), ('atm', 8),
+             ('bank', 5), ('place_of_worship', 6), ('school', 5),
+             ('parking', 8), ('toilets', 4), ('pharmacy', 3), ('bar', 4),
+             ('post_box', 3), ('food_court', 4)]
+CUISINES = [('chinese', 20), ('japanese', 10), ('indian', 8), ('italian', 6),
+            ('korean', 5), ('thai', 4), ('coffee_shop', 6), ('burger', 4),
+            ('malay', 4), ('asian', 6)]
+RELIGIONS = [('buddhist', 10), ('christian', 10), ('muslim', 6), ('hindu', 4),
+             ('taoist', 3)]
+OPERATORS = ['POSB', 'Posb', 'UOB', 'Uob', 'OCBC', 'DBS', 'Citibank',
+             'Overseas Chinese Banking Corporation', 'home']
+HIGHWAYS = [('residential', 30), ('service', 25), ('footway', 15),
+            ('tertiary', 8), ('secondary', 6), ('primary', 5),
+            ('living_street', 2), ('motorway', 2)]
+#Keys matched by PROBLEMCHARS, so shape_element() has to drop them
+PROBLEM_KEYS = ['fixme?', 'note.1', 'contact/phone', 'name =', 'opening hours;',
+                'source#1', 'is_in,country']
+#Keys with a namespace prefix
+COLON_KEYS = ['name:en', 'name:zh', 'name:ms', 'name:ta', 'is_in:country',
+              'building:levels', 'roof:shape', 'payment:cash']
+
+
+class _Weighted(object):
+    '''Fast weighted choice from a list of (value, weight) pairs.'''
+
+    def __init__(self, items):
+        self.values = [v for v, _ in items]
+        self.cumulative = []
+        total = 0
+        for _, weight in items:
+            total += weight
+            self.cumulative.append(total)
+
+    def __call__(self, rnd):
+        return self.values[bisect.bisect(self.cumulative,
+                                         rnd.random() * self.cumulative[-1])]
+
+
+class Generator(object):
+    '''Generates the elements of a synthetic extract.
+
+    Args:
+        seed (int): Seed of the random generator, the same seed gives the same
+            file.
+        users (int): Size of the pool of contributors. Edits per user follow a
+            Zipf like distribution, like in the real data.
+    '''
+
+    def __init__(self, seed=0, users=2000):
+        self.rnd = random.Random(seed)
+        self.users = ['mapper_%d' % i for i in range(users)]
+        self.uids = [self.rnd.randint(1000, 5000000) for _ in range(users)]
+        self.user_weights = _Weighted([(i, 1.0 / (i + 1)) for i in range(users)])
+        self.street_type = _Weighted(STREET_TYPES)
+        self.amenity = _Weighted(AMENITIES)
+        self.cuisine = _Weighted(CUISINES)
+        self.religion = _Weighted(RELIGIONS)
+        self.highway = _Weighted(HIGHWAYS)
+        #Nodes gather around a few centers, like in a city
+        self.centers = [(self.rnd.uniform(BBOX[0], BBOX[2]),
+                         self.rnd.uniform(BBOX[1], BBOX[3])) for _ in range(50)]
+        self.changeset = 1000000
+
+    @staticmethod
+    def node_id(index):
+        '''The id of the index-th node: increasing, with gaps.'''
+        return 20000000 + 3 * index + (index * 7919) % 3
+
+    @staticmethod
+    def way_id(index):
+        return 4000000 + 2 * index + (index * 7919) % 2
+
+    # ### Attribute values
+
+    def _meta(self, rnd):
+        user = self.user_weights(rnd)
+        if rnd.random() < 0.05:
+            self.changeset += rnd.randint(1, 500)
+        return (' version="%d" timestamp="%s" changeset="%d" uid="%d" user=%s' %
+                (min(int(rnd.expovariate(0.5)) + 1, 60),
+                 time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(
+                     rnd.randint(1199145600, 1481760000))),
+                 self.changeset, self.uids[user], quoteattr(self.users[user])))
+
+    def street(self, rnd):
+        name = rnd.choice(STREET_NAMES)
+        roll = rnd.random()
+        if roll < 0.08:
+            street_type = rnd.choice(BAD_STREET_TYPES)
+        elif roll < 0.1:
+            street_type = self.street_type(rnd).lower()
+        else:
+            street_type = self.street_type(rnd)
+        street = '%s %s' % (name, street_type)
+        if rnd.random() < 0.15:  #"Bedok North Avenue 1"
+            street += ' %d' % rnd.randint(1, 10)
+        elif rnd.random() < 0.005:  #One word street names end up in PROBLEMATICS
+            street = str(rnd.randint(1, 300))
+        return street
+
+    def postcode(self, rnd):
+        sector = rnd.choice(SECTORS)
+        postcode = '%02d%04d' % (sector, rnd.randint(0, 9999))
+        roll = rnd.random()
+        if roll < 0.03:
+            return 'S ' + postcode
+        elif roll < 0.05:
+            return 'Singapore ' + postcode
+        elif roll < 0.07 and postcode.startswith('0'):
+            return postcode[1:]  #Stored as an integer at some point
+        elif roll < 0.08:
+            return '74%04d' % rnd.randint(0, 9999)  #Invalid postal sector
+        elif roll < 0.09:
+            return str(rnd.randint(1, 999))  #A housenumber
+        return postcode
+
+    def tags(self, rnd, kind):
+        '''Tags of a tagged node or of a way.'''
+        tags = []
+        if kind == 'way':
+            if rnd.random() < 0.6:
+                tags.append(('highway', self.highway(rnd)))
+                tags.append(('name', self.street(rnd)))
+            else:
+                tags.append(('building', 'yes'))
+        else:
+            amenity = self.amenity(rnd)
+            tags.append(('amenity', amenity))
+            if amenity in ('restaurant', 'fast_food', 'food_court'):
+                tags.append(('cuisine', self.cuisine(rnd)))
+            elif amenity == 'place_of_worship':
+                tags.append(('religion', self.religion(rnd)))
+            elif amenity in ('atm', 'bank'):
+                tags.append(('operator', rnd.choice(OPERATORS)))
+            tags.append(('name', '%s %d' % (amenity.title(), rnd.randint(1, 999))))
+        if rnd.random() < 0.3:
+            tags.append(('addr:housenumber', str(rnd.randint(1, 999))))
+            tags.append(('addr:street', self.street(rnd)))
+            tags.append(('addr:postcode', self.postcode(rnd)))
+            tags.append(('addr:city', 'Singapore'))
+        if rnd.random() < 0.1:
+            tags.append((rnd.choice(COLON_KEYS), 'yes'))
+        if rnd.random() < 0.01:
+            tags.append((rnd.choice(PROBLEM_KEYS), 'check'))
+        return tags
+
+    # ### Elements
+
+    def _tags_xml(self, tags):
+        return ''.join('\n    <tag k=%s v=%s/>' % (quoteattr(k), quoteattr(v))
+                       for k, v in tags)
+
+    def node(self, index):
+        rnd = self.rnd
+        lat, lon = rnd.choice(self.centers)
+        lat = min(max(rnd.gauss(lat, 0.01), BBOX[0]), BBOX[2])
+        lon = min(max(rnd.gauss(lon, 0.01), BBOX[1]), BBOX[3])
+        head = '  <node id="%d" lat="%.7f" lon="%.7f"%s' % (
+            self.node_id(index), lat, lon, self._meta(rnd))
+        if rnd.random() < TAGGED_NODES:
+            return head + '>' + self._tags_xml(self.tags(rnd, 'node')) + \
+                '\n  </node>\n'
+        return head + '/>\n'
+
+    def way(self, index, n_nodes):
+        rnd = self.rnd
+        if rnd.random() < LONG_WAYS:
+            length = rnd.randint(200, 2000)  #2000 is the API's limit
+        else:
+            length = int(rnd.paretovariate(1.5)) + 1
+        length = max(2, min(length, n_nodes))
+        #Consecutive nodes with a few jumps, for some locality
+        start = rnd.randrange(n_nodes - length + 1)
+        refs = []
+        for i in range(length):
+            if rnd.random() < 0.05:
+                refs.append(rnd.randrange(n_nodes))
+            else:
+                refs.append(start + i)
+        if length >= 4 and rnd.random() < 0.1:  #Closed ways (areas)
+            refs[-1] = refs[0]
+        nds = ''.join('\n    <nd ref="%d"/>' % self.node_id(r) for r in refs)
+        return '  <way id="%d"%s>%s%s\n  </way>\n' % (
+            self.way_id(index), self._meta(rnd), nds,
+            self._tags_xml(self.tags(rnd, 'way')))
+
+    def relation(self, index, n_nodes, n_ways):
+        rnd = self.rnd
+        members = ''.join(
+            '\n    <member type="way" ref="%d" role="%s"/>' % (
+                self.way_id(rnd.randrange(n_ways)), rnd.choice(['outer', 'inner']))
+            for _ in range(rnd.randint(1, 10)))
+        return '  <relation id="%d"%s>%s%s\n  </relation>\n' % (
+            100000 + index, self._meta(rnd), members,
+            self._tags_xml([('type', 'multipolygon')]))
+
+
+def _share_of_nodes(seed):
+    '''Calibrates the share of the output taken up by the nodes.'''
+    generator = Generator(seed)
+    nodes = sum(len(generator.node(i)) for i in range(5000))
+    ways = sum(len(generator.way(i, 5000)) for i in range(500))
+    return nodes / (nodes + ways)
+
+
+def _write_until(out, make, written, limit, chunk=1000):
+    """Writes the elements of make(index) until the output reaches limit.
+
+    Returns:
+        tuple: (number of elements, bytes written so far)
+    """
+    count = 0
+    while written < limit:
+        lines = []
+        for _ in range(chunk):
+            line = make(count)
+            lines.append(line)
+            written += len(line)
+            count += 1
+            if written >= limit:
+                break
+        out.write(''.join(lines))
+    return count, written
+
+
+def generate(out, size, seed=0):
+    '''Writes a synthetic .osm file.
+
+    Args:
+        out (file): A file opened for writing text.
+        size (int): The approximate size of the output in bytes.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        dict: The number of elements written per type.
+    '''
+    generator = Generator(seed)
+    header = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<osm version="0.6" generator="wrangle_osm.synthetic">\n'
+              '  <bounds minlat="%s" minlon="%s" maxlat="%s" maxlon="%s"/>\n' %
+              BBOX)
+    out.write(header)
+    written = len(header)
+
+    #Nodes first, then ways and relations, like the API's output
+    n_nodes, written = _write_until(
+        out, generator.node, written,
+        max(size * (1 - RELATIONS) * _share_of_nodes(seed), written + 1))
+    n_nodes = max(n_nodes, 2)
+    n_ways, written = _write_until(
+        out, lambda i: generator.way(i, n_nodes), written,
+        max(size * (1 - RELATIONS), written + 1))
+    n_relations, written = _write_until(
+        out, lambda i: generator.relation(i, n_nodes, n_ways), written, size)
+    out.write('</osm>\n')
+    return {'node': n_nodes, 'way': n_ways, 'relation': n_relations}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic .osm file')
+    parser.add_argument('path', help="the file to write, '-' for stdout")
+    parser.add_argument('--size', default='100MB',
+                        help='approximate size, e.g. 100MB or 50GB')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    size = parse_size(args.size)
+    if args.path == '-':
+        counts = generate(sys.stdout, size, args.seed)
+    else:
+        with open(args.path, 'w') as out:
+            counts = generate(out, size, args.seed)
+    print(', '.join('%s: %d' % (t, counts[t]) for t in ('node', 'way', 'relation')),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""Export partitioned in geographic tiles.
+
+Instead of one set of .csv files for the whole area, process_map(tiles=...)
+writes one set per tile, in a directory named after the tile:
+
+    process_map(elements, 'csv', tiles=Quadkeys(zoom=13))
+    #csv/1322301021113/nodes.csv, ..., csv/tiles.json
+
+The nodes go to the tile of their coordinates, and the ways (with their tags
+and way nodes) to the tile of their first node, or of their centroid with
+way_tile='centroid'. tiles.json lists the tiles, their bounds and counts, so
+regional jobs can pick the tiles they need.
+
+A way near the border of a tile may reference nodes of the neighbouring
+tiles: load the nodes of all the tiles it needs first (see
+wrangle_osm.db.load_tiles()).
+
+With dictionary=True, users.csv is written once for all the tiles, next to
+tiles.json.
+
+To place the ways, the tile of every node (or its coordinates, with
+way_tile='centroid') is kept until the end of the export, so memory grows
+with the number of nodes of the input: about 100 bytes per node, several GB
+for a continent.
+"""
+from __future__ import division
+
+import json
+import math
+import os
+from collections import Counter, OrderedDict
+
+from wrangle_osm.export import CsvWriters, write_dictionary
+from wrangle_osm.interning import StringTable
+
+#Elements of ways whose nodes are not in the extract
+UNKNOWN_TILE = 'unknown'
+
+
+class Quadkeys(object):
+    """The tiles of the web maps (Web Mercator), named by their quadkey.
+
+    Args:
+        zoom (int): The level of the tiles: 4**zoom tiles for the world, a
+            tile is about 5 km wide at zoom 13 near the equator.
+    """
+
+    def __init__(self, zoom=13):
+        self.zoom = zoom
+
+    def _xy(self, lat, lon):
+        n = 2 ** self.zoom
+        lat = max(min(lat, 85.05112878), -85.05112878)
+        x = int((lon + 180) / 360 * n)
+        sin_lat = math.sin(math.radians(lat))
+        y = int((0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) /
+                 (4 * math.pi)) * n)
+        return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+    def tile(self, lat, lon):
+        x, y = self._xy(lat, lon)
+        digits = []
+        for i in range(self.zoom, 0, -1):
+            mask = 1 << (i - 1)
+            digits.append(str((1 if x & mask else 0) + (2 if y & mask else 0)))
+        return ''.join(digits)
+
+    def bounds(self, tile):
+        """Returns the (minlat, minlon, maxlat, maxlon) of a quadkey."""
+        x = y = 0
+        for digit in tile:
+            x, y = x * 2 + (int(digit) & 1), y * 2 + (int(digit) >> 1)
+        n = 2 ** len(tile)
+
+        def lat(y):
+            return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+        return (lat(y + 1), x / n * 360 - 180, lat(y), (x + 1) / n * 360 - 180)
+
+
+class Grid(object):
+    """A fixed grid of rows x cols cells over a bounding box, named
+    '<row>_<col>'. Coordinates outside the box go to the nearest cell.
+
+    Args:
+        bbox (tuple): (minlat, minlon, maxlat, maxlon), e.g. read_bounds().
+    """
+
+    def __init__(self, bbox, rows=8, cols=8):
+        self.bbox = bbox
+        self.rows = rows
+        self.cols = cols
+
+    def tile(self, lat, lon):
+        minlat, minlon, maxlat, maxlon = self.bbox
+        row = int((lat - minlat) / (maxlat - minlat) * self.rows)
+        col = int((lon - minlon) / (maxlon - minlon) * self.cols)
+        return '%d_%d' % (min(max(row, 0), self.rows - 1),
+                          min(max(col, 0), self.cols - 1))
+
+    def bounds(self, tile):
+        minlat, minlon, maxlat, maxlon = self.bbox
+        row, col = [int(i) for i in tile.split('_')]
+        height = (maxlat - minlat) / self.rows
+        width = (maxlon - minlon) / self.cols
+        return (minlat + row * height, minlon + col * width,
+                minlat + (row + 1) * height, minlon + (col + 1) * width)
+
+
+class TiledWriters(object):
+    """The CsvWriters of every tile.
+
+    At most max_open tiles have their files open at a time; the others are
+    closed and appended to when they get elements again.
+
+    Args:
+        out_dir (str): The directory of the tile directories.
+        tiling: Quadkeys or Grid.
+        way_tile (str): 'first' for the tile of the first node of a way,
+            'centroid' for the tile of the mean of its coordinates (keeps the
+            coordinates of every node in memory).
+        max_open (int): Tiles with open files (5 files each).
+        dictionary (bool): Write the users once, to out_dir/users.csv (see
+            CsvWriters).
+    """
+
+    def __init__(self, out_dir, tiling, way_tile='first', max_open=50,
+                 dictionary=False):
+        if way_tile not in ('first', 'centroid'):
+            raise ValueError('Unknown way_tile: %s' % way_tile)
+        self.out_dir = out_dir
+        self.tiling = tiling
+        self.way_tile = way_tile
+        self.max_open = max_open
+        self.dictionary = dictionary
+        self.users = {}  #Of all the tiles
+        self.writers = OrderedDict()  #Open tiles, the most recent last
+        self.started = set()
+        self.tile_names = StringTable(max_size=None)
+        self.node_tiles = {}  #node id: code of the tile in tile_names
+        self.node_coords = {}
+        self.counts = Counter()
+
+    def _writers(self, tile):
+        writers = self.writers.pop(tile, None)
+        if writers is None:
+            if len(self.writers) >= self.max_open:
+                self.writers.popitem(last=False)[1].close()
+            directory = os.path.join(self.out_dir, tile)
+            if tile not in self.started:
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+            writers = CsvWriters(directory, self.dictionary,
+                                 append=tile in self.started,
+                                 users=self.users)
+            self.started.add(tile)
+        self.writers[tile] = writers
+        return writers
+
+    def _way_tile(self, way_nodes):
+        if self.way_tile == 'centroid':
+            coords = [self.node_coords[nd] for nd in way_nodes
+                      if nd in self.node_coords]
+            if coords:
+                return self.tiling.tile(sum(c[0] for c in coords) / len(coords),
+                                        sum(c[1] for c in coords) / len(coords))
+            return UNKNOWN_TILE
+        for nd in way_nodes[:1]:
+            code = self.node_tiles.get(nd)
+            if code is not None:
+                return self.tile_names.string(code)
+        return UNKNOWN_TILE
+
+    def write(self, el):
+        """Writes a shaped element to the files of its tile."""
+        if 'node' in el:
+            node = el['node']
+            lat, lon = float(node['lat']), float(node['lon'])
+            tile = self.tiling.tile(lat, lon)
+            if self.way_tile == 'centroid':
+                self.node_coords[int(node['id'])] = (lat, lon)
+            else:
+                self.node_tiles[int(node['id'])] = self.tile_names.code(tile)
+            self.counts[(tile, 'nodes')] += 1
+        elif 'way' in el:
+            tile = self._way_tile([int(nd['node_id'])
+                                   for nd in el['way_nodes']])
+            self.counts[(tile, 'ways')] += 1
+        else:
+            return
+        self._writers(tile).write(el)
+
+    def manifest(self):
+        """Returns {tile: {'bounds': ..., 'nodes': n, 'ways': n}}."""
+        result = OrderedDict()
+        for tile in sorted(self.started):
+            result[tile] = OrderedDict([
+                ('bounds', None if tile == UNKNOWN_TILE
+                 else self.tiling.bounds(tile)),
+                ('nodes', self.counts[(tile, 'nodes')]),
+                ('ways', self.counts[(tile, 'ways')]),
+            ])
+        return result
+
+    def close(self):
+        for writers in self.writers.values():
+            writers.close()
+        self.writers.clear()
+        if self.dictionary:
+            write_dictionary(self.out_dir, self.users)
+        with open(os.path.join(self.out_dir, 'tiles.json'), 'w') as f:
+            json.dump(self.manifest(), f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_manifest(out_dir):
+    """Returns the tiles of a tiled export, like TiledWriters.manifest()."""
+    with open(os.path.join(out_dir, 'tiles.json')) as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+
+def tiles_in(out_dir, bbox):
+    """Returns the tiles of an export that intersect a bounding box.
+
+    Args:
+        bbox (tuple): (minlat, minlon, maxlat, maxlon).
+    """
+    minlat, minlon, maxlat, maxlon = bbox
+    result = []
+    for tile, info in read_manifest(out_dir).items():
+        bounds = info['bounds']
+        if bounds is None or (bounds[0] <= maxlat and minlat <= bounds[2] and
+                              bounds[1] <= maxlon and minlon <= bounds[3]):
+            result.append(tile)
+    return result